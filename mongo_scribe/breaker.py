@@ -0,0 +1,95 @@
+import logging
+import time
+from collections import deque
+
+CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+STATE_NAMES = {CLOSED: "closed", OPEN: "open", HALF_OPEN: "half-open"}
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of the last `window` writes to stop writing while the
+    database is failing
+
+    A write counts as failed when it raises or takes longer than `slow_call`
+    seconds. Once at least `min_calls` writes were recorded and the fraction
+    of failed ones reaches `error_rate`, the circuit opens. After
+    `open_time` seconds, a single probe write is allowed (half-open state):
+    if it succeeds the circuit closes, otherwise it opens again for twice
+    as long, up to `max_open_time` seconds.
+
+    `on_change` is called with the new state on every transition, including
+    the one to half-open made by `allow`.
+    """
+
+    def __init__(
+        self,
+        window: int = 20,
+        min_calls: int = 5,
+        error_rate: float = 0.5,
+        slow_call: float = 10,
+        open_time: float = 5,
+        max_open_time: float = 120,
+        on_change=None,
+    ):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.base_open_time = open_time
+        self.max_open_time = max_open_time
+        self.outcomes = deque(maxlen=window)
+        self.state = CLOSED
+        self.open_time = open_time
+        self.opened_at = 0.0
+        self.on_change = on_change
+
+    def _set_state(self, state: int):
+        if state != self.state:
+            logging.warning(
+                f"Circuit breaker {STATE_NAMES[self.state]} -> "
+                f"{STATE_NAMES[state]}"
+            )
+            self.state = state
+            if self.on_change is not None:
+                self.on_change(state)
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._set_state(OPEN)
+
+    def remaining(self) -> float:
+        """
+        Seconds until a probe write is allowed
+        """
+        if self.state != OPEN:
+            return 0
+        return max(0, self.opened_at + self.open_time - time.monotonic())
+
+    def allow(self) -> bool:
+        """
+        Whether a write can be attempted. Moves an open circuit to half-open
+        once its open time is over
+        """
+        if self.state == OPEN and self.remaining() == 0:
+            self._set_state(HALF_OPEN)
+        return self.state != OPEN
+
+    def record(self, seconds: float, failed: bool = False):
+        failed = failed or seconds > self.slow_call
+        if self.state == HALF_OPEN:
+            if failed:
+                self.open_time = min(self.open_time * 2, self.max_open_time)
+                self._open()
+            else:
+                self.outcomes.clear()
+                self.open_time = self.base_open_time
+                self._set_state(CLOSED)
+            return
+
+        self.outcomes.append(failed)
+        if (
+            len(self.outcomes) >= self.min_calls
+            and sum(self.outcomes) / len(self.outcomes) >= self.error_rate
+        ):
+            self.outcomes.clear()
+            self._open()
@@ -1,10 +1,17 @@
 import abc
 from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional
 
+import numpy as np
 from pymongo.operations import InsertOne, UpdateOne
 
 from .exceptions import *
 from .commons import ValidCommands
+from .features import FEATURE_SCHEMA_COLLECTION, feature_schema, pack_values
+
+# Number of distinct classifiers and class sets whose operations are cached
+PROBABILITIES_TEMPLATE_CACHE_SIZE = 128
 
 
 @dataclass
@@ -15,6 +22,7 @@ class Options:
 
     upsert: bool = False
     set_on_insert: bool = False
+    packed: bool = False
 
 
 class Command(abc.ABC):
@@ -28,9 +36,12 @@ class Command(abc.ABC):
     Finally, `options` can be a dictionary with possible additional settings defined in the class `Options`.
     Whether a specific option is used or not, will depend on subclass implementation. If unrecognized options
     or wrong types are provided, the command will use the default options.
+
+    The `timestamp` is the Kafka timestamp (in milliseconds) of the message that originated the command, if known.
     """
 
     type: str
+    timestamp: Optional[float] = None
 
     def __init__(
         self,
@@ -53,6 +64,16 @@ class Command(abc.ABC):
             )
             self.options = Options()
 
+    def document_key(self, fields=("_id", "aid")):
+        """Returns the value of the first of `fields` found in the criteria or,
+        failing that, in the data. Returns `None` if none of them is present.
+        """
+        for source in (self.criteria, self.data):
+            for field in fields:
+                if field in source:
+                    return source[field]
+        return None
+
     def _check_inputs(self, collection, data, criteria):
         if not collection:
             raise NoCollectionProvidedException()
@@ -63,6 +84,10 @@ class Command(abc.ABC):
     def get_operations(self) -> list:
         pass
 
+    def filters(self) -> List[dict]:
+        """Returns the filters used by the operations of the command, to check that they are covered by indexes"""
+        return []
+
 
 class InsertCommand(Command):
     """Directly inserts `data` into the database"""
@@ -86,6 +111,9 @@ class UpdateCommand(Command):
         if not criteria:
             raise UpdateWithNoCriteriaException()
 
+    def filters(self) -> List[dict]:
+        return [self.criteria]
+
     def get_operations(self) -> list:
         op = "$setOnInsert" if self.options.set_on_insert else "$set"
         return [
@@ -122,6 +150,7 @@ class UpdateProbabilitiesCommand(UpdateCommand):
     """
 
     type = ValidCommands.update_probabilities
+    _ranked = None
 
     def _check_inputs(self, collection, data, criteria):
         super()._check_inputs(collection, data, criteria)
@@ -130,42 +159,97 @@ class UpdateProbabilitiesCommand(UpdateCommand):
         self.classifier_name = data.pop("classifier_name")
         self.classifier_version = data.pop("classifier_version")
 
+    @classmethod
+    def from_matrix(
+        cls,
+        collection: str,
+        classifier_name: str,
+        classifier_version: str,
+        class_names: List[str],
+        probabilities,
+        criteria: List[dict],
+        options=None,
+    ) -> List["UpdateProbabilitiesCommand"]:
+        """Creates a command per row of a matrix of probabilities.
+
+        Each row has the probabilities of the object with the same index in `criteria`, with a column per
+        class in `class_names`. The rankings of all rows are computed at once, keeping the order of the
+        columns for ties, as when sorting a single command.
+        """
+        matrix = np.asarray(probabilities, dtype=float)
+        if matrix.ndim != 2 or matrix.shape != (
+            len(criteria),
+            len(class_names),
+        ):
+            raise ProbabilitiesShapeException(
+                matrix.shape, len(criteria), len(class_names)
+            )
+        order = np.argsort(-matrix, axis=1, kind="stable")
+        names = np.asarray(class_names, dtype=object)[order].tolist()
+        values = np.take_along_axis(matrix, order, axis=1).tolist()
+
+        commands = []
+        for row_names, row_values, row_criteria in zip(
+            names, values, criteria
+        ):
+            data = dict(zip(row_names, row_values))
+            data["classifier_name"] = classifier_name
+            data["classifier_version"] = classifier_version
+            command = cls(collection, data, row_criteria, options)
+            command._ranked = (row_names, row_values)
+            commands.append(command)
+        return commands
+
     def _sort(self, reverse=True):
+        if self._ranked is not None and reverse:
+            return list(zip(*self._ranked))
         return sorted(self.data.items(), key=lambda x: x[1], reverse=reverse)
 
+    def filters(self) -> List[dict]:
+        not_classified = {
+            _ProbabilitiesTemplate.not_classified_field: {
+                "$ne": self.classifier_name
+            }
+        }
+        return [self.criteria, {**self.criteria, **not_classified}]
+
     def get_operations(self) -> list:
+        template = _probabilities_template(
+            self.classifier_name,
+            self.classifier_version,
+            # Rows of a matrix are in ranking order, so the key ignores it
+            frozenset(self.data),
+            self.options.set_on_insert,
+        )
+        ranked = self._sort()
         criteria = {
-            "probabilities.classifier_name": {"$ne": self.classifier_name},
+            template.not_classified_field: template.not_classified,
             **self.criteria,
         }
         probabilities = [
             {
-                "classifier_name": self.classifier_name,
-                "classifier_version": self.classifier_version,
-                "class_name": cls,
+                **template.items[cls],
                 "probability": p,
                 "ranking": i + 1,
             }
-            for i, (cls, p) in enumerate(self._sort())
+            for i, (cls, p) in enumerate(ranked)
         ]
         insert = {"$push": {"probabilities": {"$each": probabilities}}}
 
         # Insert empty probabilities if AID doesn't exist
-        upsert = {"$setOnInsert": {"probabilities": []}}
         ops = [
-            UpdateOne(self.criteria, upsert, upsert=self.options.upsert),
+            UpdateOne(
+                self.criteria,
+                {"$setOnInsert": {"probabilities": []}},
+                upsert=self.options.upsert,
+            ),
             UpdateOne(criteria, insert),
         ]
 
         if self.options.set_on_insert:
             return ops
 
-        for i, (cls, p) in enumerate(self._sort()):
-            filters = {
-                "el.classifier_name": self.classifier_name,
-                "el.classifier_version": self.classifier_version,
-                "el.class_name": cls,
-            }
+        for i, (cls, p) in enumerate(ranked):
             update = {
                 "$set": {
                     "probabilities.$[el].probability": p,
@@ -176,12 +260,53 @@ class UpdateProbabilitiesCommand(UpdateCommand):
                 UpdateOne(
                     self.criteria,
                     update,
-                    array_filters=[filters],
+                    array_filters=template.array_filters[cls],
                 )
             )
         return ops
 
 
+class _ProbabilitiesTemplate:
+    """Parts of the operations of `UpdateProbabilitiesCommand` that only depend on the classifier and its classes"""
+
+    not_classified_field = "probabilities.classifier_name"
+
+    def __init__(
+        self, classifier_name, classifier_version, class_names, set_on_insert
+    ):
+        self.not_classified = {"$ne": classifier_name}
+        self.items = {
+            cls: {
+                "classifier_name": classifier_name,
+                "classifier_version": classifier_version,
+                "class_name": cls,
+            }
+            for cls in class_names
+        }
+        self.array_filters = {}
+        if not set_on_insert:
+            self.array_filters = {
+                cls: [
+                    {
+                        "el.classifier_name": classifier_name,
+                        "el.classifier_version": classifier_version,
+                        "el.class_name": cls,
+                    }
+                ]
+                for cls in class_names
+            }
+
+
+@lru_cache(maxsize=PROBABILITIES_TEMPLATE_CACHE_SIZE)
+def _probabilities_template(
+    classifier_name, classifier_version, class_names, set_on_insert
+):
+    """Returns the shared template of a classifier. Templates must not be modified"""
+    return _ProbabilitiesTemplate(
+        classifier_name, classifier_version, class_names, set_on_insert
+    )
+
+
 class UpdateFeaturesCommand(UpdateCommand):
     """Update Features for a given object.
 
@@ -206,6 +331,15 @@ class UpdateFeaturesCommand(UpdateCommand):
     if there wasnt any feature with the same version and name found.
 
     Using the `upsert` option will create the object if it doesn't already exist.
+
+    With the `packed` option, each feature group is stored as a reference to a schema document (the names and
+    band ids of the features, in order) and the values as a binary array of float64:
+
+    .. code-block::
+       {"version": "v1", "schema": "<schema id>", "values": <binary>}
+
+    The schema is written to the `feature_schema` collection by the command returned by `schema_command`. Use
+    `unpack_features` to read the features back.
     """
 
     type = ValidCommands.update_features
@@ -221,11 +355,34 @@ class UpdateFeaturesCommand(UpdateCommand):
         self.features_version = data.pop("features_version")
         self.features_group = data.pop("features_group")
 
+    def schema(self) -> dict:
+        return feature_schema(
+            self.features_version, self.features_group, self.data["features"]
+        )
+
+    def schema_command(self) -> UpdateCommand:
+        """Returns the command that writes the schema of the features, when using the `packed` option"""
+        schema = self.schema()
+        schema_id = schema.pop("_id")
+        return UpdateCommand(
+            FEATURE_SCHEMA_COLLECTION,
+            schema,
+            {"_id": schema_id},
+            {"upsert": True, "set_on_insert": True},
+        )
+
     def get_operations(self) -> list:
-        features = {
-            "version": self.features_version,
-            "features": self.data["features"],
-        }
+        if self.options.packed:
+            features = {
+                "version": self.features_version,
+                "schema": self.schema()["_id"],
+                "values": pack_values(self.data["features"]),
+            }
+        else:
+            features = {
+                "version": self.features_version,
+                "features": self.data["features"],
+            }
 
         # Grug patch
         # upsert_operation = {"$setOnInsert": {"features": {}}}
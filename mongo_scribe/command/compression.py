@@ -0,0 +1,111 @@
+import threading
+import zlib
+from base64 import b64decode
+from typing import Union
+
+from .exceptions import (
+    PayloadTooLargeException,
+    UnsupportedCompressionException,
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+GZIP_MAGIC = b"\x1f\x8b"
+LZ4_MAGIC = b"\x04\x22\x4d\x18"
+
+# Largest decompressed payload accepted, to guard against decompression bombs
+DEFAULT_MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+_local = threading.local()
+
+
+def _checked(data: bytes, max_size: int) -> bytes:
+    if len(data) > max_size:
+        raise PayloadTooLargeException(max_size)
+    return data
+
+
+def _zstd_decompress(data: bytes, max_size: int) -> bytes:
+    if zstandard is None:
+        raise UnsupportedCompressionException("zstd")
+    decompressor = getattr(_local, "zstd", None)
+    if decompressor is None:
+        decompressor = _local.zstd = zstandard.ZstdDecompressor()
+    size = zstandard.frame_content_size(data)
+    if size > max_size:
+        raise PayloadTooLargeException(max_size)
+    if size >= 0:
+        return decompressor.decompress(data)
+    # Frames written without their content size are read up to the limit
+    with decompressor.stream_reader(data) as reader:
+        return _checked(reader.read(max_size + 1), max_size)
+
+
+def _gzip_decompress(data: bytes, max_size: int) -> bytes:
+    # zlib streams can't be reset and copying one costs more than a new one
+    decompressor = zlib.decompressobj(wbits=31)
+    return _checked(decompressor.decompress(data, max_size + 1), max_size)
+
+
+def _lz4_decompress(data: bytes, max_size: int) -> bytes:
+    if lz4_frame is None:
+        raise UnsupportedCompressionException("lz4")
+    decompressor = getattr(_local, "lz4", None)
+    if decompressor is None:
+        decompressor = _local.lz4 = lz4_frame.LZ4FrameDecompressor()
+    # Previous frames may have been left unfinished, either truncated or cut
+    # at the size limit
+    decompressor.reset()
+    return _checked(
+        decompressor.decompress(data, max_length=max_size + 1), max_size
+    )
+
+
+_BY_MAGIC = (
+    (ZSTD_MAGIC, _zstd_decompress),
+    (GZIP_MAGIC, _gzip_decompress),
+    (LZ4_MAGIC, _lz4_decompress),
+)
+_BY_PREFIX = {
+    "zstd": _zstd_decompress,
+    "gzip": _gzip_decompress,
+    "lz4": _lz4_decompress,
+}
+
+
+def decompress_payload(
+    payload: Union[str, bytes], max_size: int = DEFAULT_MAX_DECOMPRESSED_SIZE
+) -> Union[str, bytes]:
+    """
+    Returns the payload decompressed if it was compressed, or as is otherwise.
+    Raises `PayloadTooLargeException` if it decompresses to more than
+    `max_size` bytes, without decompressing the rest.
+
+    Binary payloads are detected by the magic number of zstd, gzip or LZ4
+    frames. Since payloads in string fields can't hold binary data, these
+    can be the codec name, a colon and the base64 encoded compressed payload
+    (e.g., `zstd:KLUv/Q...`). Plain JSON payloads always start with `{` or
+    `[`, so they are never mistaken for compressed ones.
+    """
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        header = bytes(payload[:4])
+        for magic, decompress in _BY_MAGIC:
+            if header.startswith(magic):
+                return decompress(payload, max_size)
+        return payload
+
+    if payload[:1] in ("{", "["):
+        return payload
+    codec, separator, encoded = payload.partition(":")
+    if not separator or codec not in _BY_PREFIX:
+        return payload
+    return _BY_PREFIX[codec](b64decode(encoded), max_size)
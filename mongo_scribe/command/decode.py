@@ -1,7 +1,14 @@
 from json import loads
+from typing import List, Union
 
 from .commands import *
-from .exceptions import WrongFormatCommandException
+from .compression import DEFAULT_MAX_DECOMPRESSED_SIZE, decompress_payload
+from .formats import decode_bson, decode_msgpack, is_bson, is_msgpack
+from .exceptions import (
+    EnvelopeLengthMismatchException,
+    NoClassifierInfoProvidedException,
+    WrongFormatCommandException,
+)
 
 
 def validate(message: dict) -> dict:
@@ -23,22 +30,42 @@ def validate(message: dict) -> dict:
     return message
 
 
-def decode_message(encoded_message: str):
+def decode_payload(
+    payload: Union[str, bytes], max_size: int = DEFAULT_MAX_DECOMPRESSED_SIZE
+) -> dict:
     """
-    Transforms a JSON string into a Python dictionary.
+    Transforms a JSON string into a Python dictionary, without validating it.
+    Compressed payloads are decompressed first, up to `max_size` bytes.
+    Binary payloads can also be BSON or MessagePack encoded.
     """
-    decoded = loads(encoded_message)
+    payload = decompress_payload(payload, max_size)
+    if isinstance(payload, (bytes, bytearray)):
+        if is_bson(payload):
+            return decode_bson(payload)
+        if is_msgpack(payload):
+            return decode_msgpack(payload)
+    return loads(payload)
+
+
+def decode_message(encoded_message: str) -> Union[dict, List[dict]]:
+    """
+    Transforms a JSON string into a Python dictionary. If the JSON string is
+    an array of commands, returns a list with each of them validated.
+    """
+    decoded = decode_payload(encoded_message)
+    if isinstance(decoded, list):
+        return [validate(message) for message in decoded]
     valid_message = validate(decoded)
 
     return valid_message
 
 
-def db_command_factory(msg: str) -> Command:
+def build_command(message: dict) -> Command:
     """
-    Returns a DbCommand instance based on a JSON stringified.
-    Raises MisformattedCommand if the JSON string is not a valid command.
+    Returns a DbCommand instance based on an already decoded message.
+    Raises MisformattedCommand if the dictionary is not a valid command.
     """
-    decoded_message = decode_message(msg)
+    decoded_message = validate(message)
     msg_type = decoded_message.pop("type")
 
     if msg_type == InsertCommand.type:
@@ -50,3 +77,116 @@ def db_command_factory(msg: str) -> Command:
     if msg_type == UpdateFeaturesCommand.type:
         return UpdateFeaturesCommand(**decoded_message)
     raise ValueError(f"Unrecognized command type {msg_type}")
+
+
+def db_command_factory(msg: str) -> Command:
+    """
+    Returns a DbCommand instance based on a JSON stringified.
+    Raises MisformattedCommand if the JSON string is not a valid command.
+    """
+    return build_command(decode_payload(msg))
+
+
+def expand_envelope(envelope: dict) -> List[dict]:
+    """
+    Returns the commands contained in a columnar envelope.
+
+    An envelope is a command whose `data` is a list, with a row per command.
+    The `criteria`, if present, must be a list of the same length. The
+    `type`, `collection` and `options` are shared by every command.
+    """
+    envelope = validate(envelope)
+    data = envelope["data"]
+    criteria = envelope["criteria"] or [{}] * len(data)
+    if not isinstance(criteria, list) or len(criteria) != len(data):
+        raise EnvelopeLengthMismatchException(len(data), len(criteria))
+    return [
+        {
+            "type": envelope["type"],
+            "collection": envelope["collection"],
+            "options": envelope["options"],
+            "data": row_data,
+            "criteria": row_criteria,
+        }
+        for row_data, row_criteria in zip(data, criteria)
+    ]
+
+
+def is_probabilities_matrix(message: dict) -> bool:
+    """
+    Whether the message is an `update_probabilities` command with columnar
+    data: the `class_names` once and a row of `probabilities` per object,
+    with a list of `criteria` in the same order.
+    """
+    data = message.get("data")
+    return (
+        message.get("type") == UpdateProbabilitiesCommand.type
+        and isinstance(data, dict)
+        and "class_names" in data
+        and "probabilities" in data
+    )
+
+
+def build_probabilities(message: dict) -> List[Command]:
+    message = validate(message)
+    data = message["data"]
+    if "classifier_name" not in data or "classifier_version" not in data:
+        raise NoClassifierInfoProvidedException()
+    return UpdateProbabilitiesCommand.from_matrix(
+        message["collection"],
+        data["classifier_name"],
+        data["classifier_version"],
+        data["class_names"],
+        data["probabilities"],
+        message["criteria"] or [],
+        message["options"],
+    )
+
+
+def with_feature_schemas(commands: List[Command]) -> List[Command]:
+    """
+    Adds the commands writing the schemas of packed features, once per
+    schema in the message. Schemas already written are dropped by the
+    executor, which knows whether the write succeeded.
+    """
+    result, schemas = [], set()
+    for command in commands:
+        if type(command) is UpdateFeaturesCommand and command.options.packed:
+            schema = command.schema_command()
+            if schema.criteria["_id"] not in schemas:
+                schemas.add(schema.criteria["_id"])
+                result.append(schema)
+        result.append(command)
+    return result
+
+
+def build_commands(message: Union[dict, list]) -> List[Command]:
+    """
+    Returns the commands of an already decoded message, which can be a
+    single command, an array of commands, a columnar envelope or a matrix
+    of probabilities. Commands writing the schemas of packed features are
+    included when needed.
+    """
+    if isinstance(message, list):
+        commands = [build_command(command) for command in message]
+    elif isinstance(message, dict) and is_probabilities_matrix(message):
+        return build_probabilities(message)
+    elif isinstance(message, dict) and isinstance(message.get("data"), list):
+        commands = [
+            build_command(command) for command in expand_envelope(message)
+        ]
+    else:
+        commands = [build_command(message)]
+    return with_feature_schemas(commands)
+
+
+def db_commands_factory(
+    msg: str, max_size: int = DEFAULT_MAX_DECOMPRESSED_SIZE
+) -> List[Command]:
+    """
+    Returns the DbCommand instances of a JSON stringified message, which can
+    contain a single command, an array of commands, a columnar envelope or a
+    matrix of probabilities.
+    Raises MisformattedCommand if any of the commands is not valid.
+    """
+    return build_commands(decode_payload(msg, max_size))
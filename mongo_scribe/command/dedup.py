@@ -0,0 +1,63 @@
+import time
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Iterable, Union
+
+
+class DuplicatePayloadFilter:
+    """
+    Remembers the hashes of recently written payloads to skip exact
+    duplicates before they are decoded
+
+    Keeps at most `max_entries` hashes (about 200 bytes each), evicting the
+    least recently seen ones, and forgets a hash `ttl` seconds after it was
+    last seen. Payloads of the command types in `exempt_types` are never
+    remembered, so they are always written.
+    """
+
+    def __init__(
+        self, max_entries: int, ttl: float, exempt_types: Iterable[str] = ()
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.exempt_types = set(exempt_types)
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(payload: Union[str, bytes]) -> bytes:
+        if isinstance(payload, str):
+            payload = payload.encode()
+        return blake2b(payload, digest_size=16).digest()
+
+    def _expire(self, now: float):
+        while self.entries:
+            key, seen_at = next(iter(self.entries.items()))
+            if now - seen_at < self.ttl:
+                return
+            del self.entries[key]
+
+    def seen(self, key: bytes) -> bool:
+        """
+        Whether the payload with this hash was added and hasn't expired
+        """
+        now = time.monotonic()
+        self._expire(now)
+        if key not in self.entries:
+            return False
+        self.entries[key] = now
+        self.entries.move_to_end(key)
+        return True
+
+    def add(self, keys: Iterable[bytes]):
+        """
+        Remembers the hashes of payloads that were written
+        """
+        now = time.monotonic()
+        for key in keys:
+            self.entries[key] = now
+            self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
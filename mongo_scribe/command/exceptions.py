@@ -25,6 +25,53 @@ class WrongFormatCommandException(ValueError):
         super().__init__("Received a badly formatted message")
 
 
+class EnvelopeLengthMismatchException(ValueError):
+    """
+    Exception to raise when the criteria of a columnar envelope don't match
+    its data rows
+    """
+
+    def __init__(self, n_data: int, n_criteria: int):
+        super().__init__(
+            f"Envelope has {n_data} data rows but {n_criteria} criteria"
+        )
+
+
+class ProbabilitiesShapeException(ValueError):
+    """
+    Exception to raise when a matrix of probabilities doesn't have a row per
+    object and a column per class
+    """
+
+    def __init__(self, shape: tuple, n_objects: int, n_classes: int):
+        super().__init__(
+            f"Probabilities have shape {shape}, expected "
+            f"({n_objects}, {n_classes})"
+        )
+
+
+class UnsupportedCompressionException(ValueError):
+    """
+    Exception to raise when a payload is compressed with a codec whose
+    library isn't installed
+    """
+
+    def __init__(self, codec: str):
+        super().__init__(f"Can't decompress {codec} payload, install {codec}")
+
+
+class UnsupportedFormatException(ValueError):
+    """
+    Exception to raise when a payload is encoded in a format whose library
+    isn't installed
+    """
+
+    def __init__(self, encoding: str):
+        super().__init__(
+            f"Can't decode {encoding} payload, install {encoding}"
+        )
+
+
 class NonExistentCollectionException(ValueError):
     """
     Exception to raise when trying to obtain a non-existent collection
@@ -91,3 +138,22 @@ class NoFeatureGroupProvidedException(ValueError):
 
     def __init__(self):
         super().__init__("No features_group provided in the command")
+
+
+class PartitionWorkerException(RuntimeError):
+    """
+    Exception to raise when a partition worker fails to write its commands
+    """
+
+    def __init__(self, errors: dict):
+        super().__init__(f"Partition workers failed: {errors}")
+
+
+class PayloadTooLargeException(ValueError):
+    """
+    Exception to raise when a compressed payload decompresses to more than
+    the maximum size allowed
+    """
+
+    def __init__(self, max_size: int):
+        super().__init__(f"Payload decompresses to more than {max_size} bytes")
@@ -0,0 +1,59 @@
+import json
+from functools import lru_cache
+from hashlib import blake2b
+from typing import List
+
+import numpy as np
+from bson.binary import Binary
+
+FEATURE_SCHEMA_COLLECTION = "feature_schema"
+
+
+@lru_cache(maxsize=256)
+def _schema(version: str, group: str, names: tuple, fids: tuple) -> dict:
+    key = json.dumps([version, group, names, fids], default=str)
+    return {
+        "_id": blake2b(key.encode(), digest_size=12).hexdigest(),
+        "version": version,
+        "group": group,
+        "names": list(names),
+        "fids": list(fids),
+    }
+
+
+def feature_schema(version: str, group: str, features: List[dict]) -> dict:
+    """
+    Returns the schema document of a list of features: the names and band
+    ids of the features, in order.
+
+    Its `_id` is derived from its content, so every process computes the same
+    identifier for the same version, group and features.
+    """
+    names = tuple(feature["name"] for feature in features)
+    fids = tuple(feature["fid"] for feature in features)
+    return dict(_schema(version, group, names, fids))
+
+
+def pack_values(features: List[dict]) -> Binary:
+    """
+    Packs the feature values as little-endian float64, with `None` as NaN
+    """
+    values = [feature["value"] for feature in features]
+    return Binary(np.array(values, dtype="<f8").tobytes())
+
+
+def unpack_features(packed: dict, schema: dict) -> List[dict]:
+    """
+    Returns the features of a packed feature group in the original format,
+    given its schema document (found by `packed["schema"]` in the
+    `feature_schema` collection).
+    """
+    values = np.frombuffer(packed["values"], dtype="<f8").tolist()
+    return [
+        {
+            "name": name,
+            "value": None if value != value else value,
+            "fid": fid,
+        }
+        for name, fid, value in zip(schema["names"], schema["fids"], values)
+    ]
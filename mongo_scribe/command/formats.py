@@ -0,0 +1,66 @@
+import struct
+from typing import Union
+
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+from .commons import ValidCommands
+from .exceptions import UnsupportedFormatException
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_RAW = CodecOptions(document_class=RawBSONDocument)
+_INT32 = struct.Struct("<i")
+
+# First bytes of MessagePack maps (fixmap, map 16, map 32) and arrays
+_MSGPACK_CONTAINERS = frozenset([*range(0x80, 0xA0), 0xDC, 0xDD, 0xDE, 0xDF])
+
+
+def is_bson(payload: bytes) -> bool:
+    """
+    Whether the payload looks like a BSON document: it starts with its own
+    length and ends with a null byte
+    """
+    return (
+        len(payload) >= 5
+        and _INT32.unpack_from(payload)[0] == len(payload)
+        and payload[-1] == 0
+    )
+
+
+def is_msgpack(payload: bytes) -> bool:
+    return len(payload) > 0 and payload[0] in _MSGPACK_CONTAINERS
+
+
+def _inflate(value):
+    if isinstance(value, RawBSONDocument):
+        return bson.decode(value.raw)
+    if isinstance(value, list):
+        return [_inflate(item) for item in value]
+    return value
+
+
+def decode_bson(payload: bytes) -> dict:
+    """
+    Decodes a BSON command. The `data` of `insert` commands is kept as raw
+    BSON, so it is sent to the database without being decoded and encoded
+    again. Other commands are fully decoded, since their data is modified
+    before writing.
+    """
+    raw = bson.decode(payload, codec_options=_RAW)
+    if raw.get("type") != ValidCommands.insert:
+        return bson.decode(payload)
+    message = {key: _inflate(raw[key]) for key in raw if key != "data"}
+    if "data" in raw:
+        message["data"] = raw["data"]
+    return message
+
+
+def decode_msgpack(payload: bytes) -> Union[dict, list]:
+    if msgpack is None:
+        raise UnsupportedFormatException("msgpack")
+    return msgpack.unpackb(payload, raw=False)
@@ -0,0 +1,112 @@
+import math
+from typing import Iterable, List
+
+from pymongo import InsertOne, UpdateOne
+
+
+class BucketStrategy:
+    """
+    Writes the inserts of some collections (e.g., `detection` and
+    `non_detection`) as entries of bucket documents, one per object and time
+    window, instead of one document per entry
+
+    Each bucket has the object id, the `window` index (the time divided by
+    `window` days), the `entries` and their `count`, and the `first` and
+    `last` times of its entries. An entry is pushed into a bucket of its
+    object and window that has less than `max_size` entries, and a new
+    bucket is created when all of them are full. Buckets should be indexed
+    by object id, window and count (`index_key`).
+
+    Entries without an object id or time are inserted as plain documents.
+    Entries written again (e.g., when a batch is reprocessed) are repeated
+    in the buckets, and dropped by `flatten_buckets`.
+    """
+
+    def __init__(
+        self,
+        collections: List[str],
+        max_size: int = 100,
+        window: float = 30,
+        object_field: str = "aid",
+        time_field: str = "mjd",
+    ):
+        self.collections = set(collections)
+        self.max_size = max_size
+        self.window = window
+        self.object_field = object_field
+        self.time_field = time_field
+
+    def __contains__(self, collection: str) -> bool:
+        return collection in self.collections
+
+    @property
+    def index_key(self) -> List[str]:
+        return [self.object_field, "window", "count"]
+
+    def operation(self, entry: dict):
+        try:
+            object_id = entry[self.object_field]
+            time = entry[self.time_field]
+        except KeyError:
+            return InsertOne(entry)
+        if object_id is None or time is None:
+            return InsertOne(entry)
+        return UpdateOne(
+            {
+                self.object_field: object_id,
+                "window": math.floor(time / self.window),
+                "count": {"$lt": self.max_size},
+            },
+            {
+                "$push": {"entries": entry},
+                "$inc": {"count": 1},
+                "$min": {"first": time},
+                "$max": {"last": time},
+            },
+            upsert=True,
+        )
+
+    def find(self, collection, object_id, since=None, until=None) -> list:
+        """
+        Returns the entries of an object, optionally between two times,
+        reading only the buckets of the windows involved
+        """
+        query = {self.object_field: object_id}
+        if since is not None:
+            query["last"] = {"$gte": since}
+        if until is not None:
+            query["first"] = {"$lte": until}
+        entries = flatten_buckets(collection.find(query), self.time_field)
+        if since is None and until is None:
+            return entries
+        since = -math.inf if since is None else since
+        until = math.inf if until is None else until
+        return [
+            entry
+            for entry in entries
+            if entry.get(self.time_field) is not None
+            and since <= entry[self.time_field] <= until
+        ]
+
+
+def _time(entry: dict, time_field: str) -> float:
+    time = entry.get(time_field)
+    return math.inf if time is None else time
+
+
+def flatten_buckets(documents: Iterable[dict], time_field="mjd") -> list:
+    """
+    Returns the entries of bucket documents sorted by time, as they would
+    have been written without buckets. Documents that aren't buckets are
+    returned as they are, and repeated entries (by `_id`) are dropped.
+    """
+    entries, seen = [], set()
+    for document in documents:
+        for entry in document.get("entries", [document]):
+            if "_id" in entry:
+                if entry["_id"] in seen:
+                    continue
+                seen.add(entry["_id"])
+            entries.append(entry)
+    entries.sort(key=lambda entry: _time(entry, time_field))
+    return entries
@@ -0,0 +1,89 @@
+import json
+import time
+from typing import Dict, List
+
+from ..command.commands import Command, UpdateCommand
+
+
+def _criteria_key(command: Command) -> str:
+    return json.dumps(command.criteria, sort_keys=True, default=str)
+
+
+class WriteBehindBuffer:
+    """
+    Holds `update` commands for some collections, merging those that target
+    the same document until they are flushed
+
+    An update is merged into the latest pending update of its document
+    (same collection and criteria) when both have the same options, and
+    queued after it otherwise, so updates of a document are drained in
+    order. With `$set`, the last value of each field wins, while with
+    `$setOnInsert` the first one is kept. The merged command keeps the
+    oldest Kafka timestamp.
+
+    The buffer should be flushed when it holds `max_size` documents or when
+    its oldest entry is older than `max_age` seconds. The step also flushes
+    it whenever a poll returns no messages.
+    """
+
+    def __init__(self, collections: List[str], max_size: int, max_age: float):
+        self.collections = set(collections)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.pending: List[UpdateCommand] = []
+        # Latest pending update of each document
+        self.documents: Dict[tuple, UpdateCommand] = {}
+        self.oldest = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def accepts(self, command: Command) -> bool:
+        return (
+            type(command) is UpdateCommand
+            and command.collection in self.collections
+        )
+
+    def holds(self, command: Command) -> bool:
+        """
+        Whether there are pending updates for the document of the command
+        """
+        if not self.pending or command.collection not in self.collections:
+            return False
+        return (command.collection, _criteria_key(command)) in self.documents
+
+    def add(self, command: UpdateCommand):
+        document = (command.collection, _criteria_key(command))
+        if not self.pending:
+            self.oldest = time.monotonic()
+
+        existing = self.documents.get(document)
+        if existing is None or existing.options != command.options:
+            command.data = dict(command.data)
+            self.pending.append(command)
+            self.documents[document] = command
+            return
+
+        if command.options.set_on_insert:
+            existing.data = {**command.data, **existing.data}
+        else:
+            existing.data.update(command.data)
+        if command.timestamp and (
+            not existing.timestamp or command.timestamp < existing.timestamp
+        ):
+            existing.timestamp = command.timestamp
+
+    def should_flush(self) -> bool:
+        if not self.pending:
+            return False
+        return (
+            len(self.pending) >= self.max_size
+            or time.monotonic() - self.oldest >= self.max_age
+        )
+
+    def drain(self) -> List[UpdateCommand]:
+        commands = self.pending
+        self.pending = []
+        self.documents.clear()
+        self.oldest = None
+        return commands
@@ -0,0 +1,56 @@
+from typing import Collection, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+DUPLICATE_KEY = 11000
+
+
+def _is_id_conflict(error: dict) -> bool:
+    """
+    Whether a write error is a duplicate key in the `_id` index
+    """
+    if error.get("code") != DUPLICATE_KEY:
+        return False
+    if "keyPattern" in error:
+        return list(error["keyPattern"]) == ["_id"]
+    return list(error.get("keyValue", {})) == ["_id"]
+
+
+def upsert_conflicts(
+    chunk: list,
+    exc: BulkWriteError,
+    ordered: bool = True,
+    retried: Collection[int] = (),
+) -> Optional[Tuple[List, int]]:
+    """
+    Operations to write again after a bulk write failed only because of
+    upserts that lost the race to insert a document (i.e., another process
+    created it in between), or `None` if it failed for any other reason.
+
+    An update can only cause a duplicate `_id` by upserting, so those errors
+    are the conflicts. Conflicting upserts are repeated as they are: the
+    document now exists, so they update it, keeping every option of the
+    operation. An operation whose `id` is in `retried` already conflicted
+    before, so it isn't a race and is not repeated again. In ordered writes,
+    the operations after the failed one weren't attempted, so they are
+    repeated too.
+
+    Returns the operations and the number of conflicts.
+    """
+    details = exc.details
+    errors = details.get("writeErrors", [])
+    if not errors or details.get("writeConcernErrors"):
+        return None
+    conflicts = [chunk[error["index"]] for error in errors]
+    if not all(
+        _is_id_conflict(error)
+        and isinstance(operation, UpdateOne)
+        and id(operation) not in retried
+        for error, operation in zip(errors, conflicts)
+    ):
+        return None
+    retry = conflicts
+    if ordered:
+        retry = retry + chunk[errors[-1]["index"] + 1 :]
+    return retry, len(errors)
@@ -0,0 +1,84 @@
+import logging
+import os
+import threading
+
+from pymongo import MongoClient
+
+_lock = threading.Lock()
+_connections = {}
+
+REQUIRED_KEYS = {"host", "port", "username", "password", "database"}
+
+
+def _camel_case(key: str) -> str:
+    """
+    Converts a (case-insensitive) `snake_case` key to `lowerCamelCase`, as
+    used by `MongoClient`
+    """
+    words = key.split("_")
+    return words[0].lower() + "".join(word.title() for word in words[1:])
+
+
+class MongoConnection:
+    """
+    Mongo client and database used by every executor in a process
+
+    The `MONGO` configuration is read like in db-plugins: it requires the
+    keys `HOST`, `PORT`, `USERNAME`, `PASSWORD` and `DATABASE`, in any case,
+    and every other key (e.g., `AUTH_SOURCE`) is converted to lowerCamelCase
+    and passed to `MongoClient`. `client_options` are passed directly to
+    `MongoClient`, e.g., `maxPoolSize`, `minPoolSize`, `compressors`,
+    `serverSelectionTimeoutMS`, `connectTimeoutMS` or `socketTimeoutMS`.
+
+    The client doesn't connect until it is first used.
+    """
+
+    def __init__(self, config: dict, client_options: dict = None):
+        options = {_camel_case(key): value for key, value in config.items()}
+        missing = REQUIRED_KEYS.difference(options)
+        if missing:
+            missing = ", ".join(sorted(key.upper() for key in missing))
+            raise ValueError(f"Invalid configuration. Missing keys: {missing}")
+        database = options.pop("database")
+        options.update(client_options or {})
+        self.client = MongoClient(connect=False, **options)
+        self.database = self.client[database]
+
+    def warm_up(self):
+        """
+        Establishes the connection to the server. When `minPoolSize` is set,
+        the driver fills the pool in the background from this point
+        """
+        self.client.admin.command("ping")
+
+    def close(self):
+        self.client.close()
+
+
+def get_connection(config: dict) -> MongoConnection:
+    """
+    Returns the connection of the current process for the given `DB_CONFIG`.
+
+    All threads in a process share the same client (and connection pool). A
+    forked process never reuses the client of its parent, a new one is created
+    the first time it is requested in the child.
+    """
+    key = (repr(config["MONGO"]), repr(config.get("CLIENT_OPTIONS")))
+    with _lock:
+        if key not in _connections:
+            _connections[key] = MongoConnection(
+                config["MONGO"], config.get("CLIENT_OPTIONS")
+            )
+            logging.debug(f"Created Mongo client in process {os.getpid()}")
+        return _connections[key]
+
+
+def _reset_after_fork():
+    global _lock
+    # The parent's clients are not safe to use after a fork. The lock could
+    # also have been held by another thread at the time of the fork
+    _lock = threading.Lock()
+    _connections.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
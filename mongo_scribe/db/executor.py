@@ -1,16 +1,66 @@
 import logging
 import os
-from typing import List, Dict
-from db_plugins.db.generic import new_DBConnection
-from db_plugins.db.mongo.connection import MongoDatabaseCreator
+import time
+from collections import deque
+from itertools import chain, islice
+from typing import List, Dict, Iterable, Iterator
+from pymongo.errors import (
+    BulkWriteError,
+    ConnectionFailure,
+    ExecutionTimeout,
+    WTimeoutError,
+)
 from db_plugins.db.mongo.models import (
     Object,
     Detection,
     NonDetection,
     ForcedPhotometry,
 )
-from ..command.commands import Command
+from ..command.commands import Command, InsertCommand
+from ..command.features import FEATURE_SCHEMA_COLLECTION
 from ..command.exceptions import NonExistentCollectionException
+from ..tracing import NULL_SPAN
+from .buckets import BucketStrategy
+from .buffer import WriteBehindBuffer
+from .conflicts import upsert_conflicts
+from .connection import get_connection
+from .indexes import IndexChecker, command_indexes, ensure_indexes
+from .noop import LastWrittenCache
+from .profiles import write_profiles
+from .routing import ShardRouter, sort_by_key
+
+DEFAULT_CHUNK_SIZE = 1000
+# Number of operations sorted together for the collections in SORT_KEYS
+DEFAULT_SORT_WINDOW = 10000
+
+# Errors caused by an unreachable or overloaded database, worth retrying
+TRANSIENT_ERRORS = (ConnectionFailure, ExecutionTimeout, WTimeoutError)
+
+
+def _chunks(operations: Iterable, size: int) -> Iterator[list]:
+    """
+    Splits an iterable of operations into lists of at most `size` elements
+    """
+    iterator = iter(operations)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _CollectionWrite:
+    """
+    Commands of a collection to write. Once started, keeps the iterator of
+    its chunks, with the chunk that failed first, so it can be resumed
+    """
+
+    def __init__(self, collection_name: str, commands: List[Command]):
+        self.collection_name = collection_name
+        self.commands = commands
+        self.chunks = None
+        self.counters, self.expanded = {}, []
+        self.n_operations = 0
 
 
 class ScribeCommandExecutor:
@@ -23,43 +73,325 @@ class ScribeCommandExecutor:
         Detection.__tablename__,
         NonDetection.__tablename__,
         ForcedPhotometry.__tablename__,
+        FEATURE_SCHEMA_COLLECTION,
     )
 
-    def __init__(self, config):
-        connection = new_DBConnection(MongoDatabaseCreator)
-        connection.connect(config["MONGO"])
-        self.connection = connection
+    def __init__(self, config, metrics=None, tracer=None, profiler=None):
+        self.config = config
+        self.metrics = metrics
+        self.tracer = tracer
+        self.profiler = profiler
+        self._connection = None
+        self.pending = deque()
+        self.written_schemas = set()
+        self.chunk_size = config.get("CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+        self.buffer = None
+        if config.get("WRITE_BEHIND"):
+            write_behind = config["WRITE_BEHIND"]
+            self.buffer = WriteBehindBuffer(
+                write_behind["COLLECTIONS"],
+                write_behind.get("MAX_SIZE", 10000),
+                write_behind.get("MAX_AGE", 5),
+            )
+        self.indexes = config.get("INDEXES")
+        self.ensured_indexes = set()
+        indexes = self.indexes or {}
+        self.index_checker = None
+        if indexes.get("EXPLAIN_SAMPLE_RATE"):
+            self.index_checker = IndexChecker(
+                indexes["EXPLAIN_SAMPLE_RATE"], metrics=metrics
+            )
+        self.router = None
+        if config.get("SHARD_KEYS"):
+            self.router = ShardRouter(
+                config["SHARD_KEYS"], config.get("SHARD_BOUNDARIES")
+            )
+        self.sort_keys = config.get("SORT_KEYS", {})
+        self.sort_window = config.get("SORT_WINDOW", DEFAULT_SORT_WINDOW)
+        self.profiles = write_profiles(config.get("WRITE_PROFILES", {}))
+        self.buckets = None
+        if config.get("BUCKETS"):
+            buckets = config["BUCKETS"]
+            self.buckets = BucketStrategy(
+                buckets["COLLECTIONS"],
+                buckets.get("MAX_SIZE", 100),
+                buckets.get("WINDOW", 30),
+            )
+        self.noop_cache = None
+        if config.get("NOOP_CACHE"):
+            self.noop_cache = LastWrittenCache(
+                config["NOOP_CACHE"]["MAX_DOCUMENTS"]
+            )
+
+    @property
+    def connection(self):
+        """
+        Connection shared by the process. Only created when first used, so
+        the executor can be safely instantiated before forking
+        """
+        if self._connection is None:
+            self._connection = get_connection(self.config)
+        return self._connection
+
+    @connection.setter
+    def connection(self, connection):
+        self._connection = connection
+
+    def warm_up(self):
+        """
+        Connects to the database before the first batch arrives, checking
+        the required indexes if configured. The index of the bucketed
+        collections is always created if missing, since every bucketed
+        insert is an upsert by it.
+        """
+        self.connection.warm_up()
+        if self.buckets is not None:
+            ensure_indexes(
+                self.connection.database,
+                {
+                    collection: [self.buckets.index_key]
+                    for collection in self.buckets.collections
+                },
+                True,
+            )
+        if self.indexes is None:
+            return
+        required = self.indexes.get("REQUIRED", {})
+        if required:
+            ensure_indexes(
+                self.connection.database,
+                required,
+                self.indexes.get("CREATE", False),
+            )
+
+    def _ensure_indexes(self, write: _CollectionWrite):
+        """
+        Checks, or creates, the indexes needed by the filters of the commands
+        the first time each one is needed
+        """
+        keys = {
+            (write.collection_name, key)
+            for key in command_indexes(write.commands)
+        } - self.ensured_indexes
+        if not keys:
+            return
+        ensure_indexes(
+            self.connection.database,
+            {write.collection_name: [list(key) for _, key in keys]},
+            self.indexes.get("CREATE", False),
+        )
+        self.ensured_indexes |= keys
+
+    def _get_operations(self, command: Command) -> list:
+        """
+        Operations of a command, writing inserts into buckets for the
+        bucketed collections
+        """
+        if (
+            self.buckets is not None
+            and type(command) is InsertCommand
+            and command.collection in self.buckets
+        ):
+            return [self.buckets.operation(command.data)]
+        return command.get_operations()
+
+    def _operations(
+        self, commands: List[Command], counters: dict, expanded: list
+    ):
+        """
+        Lazily expands the commands into operations, counting commands per type
+
+        When metrics are enabled, commands are added to `expanded` right
+        before their last operation is generated, so they are observed with
+        the chunk that completes them
+        """
+        metrics = self.metrics
+        get_operations = self._get_operations
+        for command in commands:
+            counters[command.type] = counters.get(command.type, 0) + 1
+            if metrics is None:
+                yield from get_operations(command)
+                continue
+            start = time.perf_counter()
+            operations = get_operations(command)
+            metrics.observe_build(command.type, time.perf_counter() - start)
+            yield from operations[:-1]
+            expanded.append(command)
+            yield from operations[-1:]
+
+    def _span(self, name: str, **args):
+        if self.tracer is None:
+            return NULL_SPAN
+        return self.tracer.span(name, **args)
+
+    def _profile(self, name: str):
+        if self.profiler is None:
+            return NULL_SPAN
+        return self.profiler.stage(name)
+
+    def _chunks(self, operations: Iterator, collection_name: str):
+        """
+        Groups the operations in chunks, tracing and profiling the building of
+        each one. Operations are sorted first by shard key or by the sort key
+        of the collection, if any. Keys are sorted within windows of
+        `sort_window` operations, to keep memory bounded.
+
+        Yields each chunk with its routing label, or `None` when the
+        collection isn't routed by shard key.
+        """
+        chunk_size = self.chunk_size
+        profile = self.profiles.get(collection_name)
+        if profile is not None and profile.chunk_size:
+            chunk_size = profile.chunk_size
+        if self.router is not None and collection_name in self.router:
+            chunks = self.router.route(
+                collection_name, operations, chunk_size, self.sort_window
+            )
+        else:
+            if collection_name in self.sort_keys:
+                operations = sort_by_key(
+                    operations,
+                    self.sort_keys[collection_name],
+                    self.sort_window,
+                )
+            chunks = (
+                (chunk, None) for chunk in _chunks(operations, chunk_size)
+            )
+        if self.tracer is None and self.profiler is None:
+            yield from chunks
+            return
+        while True:
+            with self._span(
+                "build", collection=collection_name
+            ), self._profile("build"):
+                routed = next(chunks, None)
+            if routed is None:
+                return
+            yield routed
+
+    def _observe_latency(self, collection_name: str, written: list):
+        """
+        Records the time since the Kafka timestamp of each written command
+        """
+        now = time.time()
+        for command in written:
+            if command.timestamp and command.timestamp > 0:
+                self.metrics.observe_latency(
+                    collection_name,
+                    command.type,
+                    now - command.timestamp / 1000,
+                )
+        written.clear()
+
+    def _write_chunk(
+        self, collection_name: str, chunk: list, profile, retried: set
+    ):
+        """
+        Writes a chunk of operations. Returns the operations to write again:
+        upserts that conflicted with a document inserted concurrently by
+        another process, which now update it, along with the operations that
+        weren't attempted. The ids of the conflicting operations are added
+        to `retried`, so they aren't retried twice.
+        """
+        try:
+            if profile is None:
+                self.connection.database[collection_name].bulk_write(chunk)
+            else:
+                profile.bulk_write(
+                    self.connection.database, collection_name, chunk
+                )
+            return []
+        except BulkWriteError as exc:
+            ordered = profile is None or profile.ordered
+            conflicts = upsert_conflicts(chunk, exc, ordered, retried)
+            if conflicts is None:
+                raise
+            retry, n_conflicts = conflicts
+            retried.update(id(operation) for operation in retry[:n_conflicts])
+            logging.info(
+                f"Retrying {n_conflicts} conflicting upserts in "
+                f"{collection_name}"
+            )
+            if self.metrics is not None:
+                self.metrics.count_upsert_conflicts(
+                    collection_name, n_conflicts
+                )
+            return retry
 
-    def _bulk_execute(self, collection_name: str, commands: List[Command]):
+    def _bulk_execute(self, write: _CollectionWrite):
         """
         Executes a list of commands obtained from a Kafka topic
         Does nothing when the command list is empty
+
+        Operations are generated while writing, so at most `chunk_size`
+        operations are held in memory for each `bulk_write` call, or
+        `sort_window` for collections sorted or routed by key. The latency of
+        the commands of a window is recorded when its first chunk is written.
+        When a chunk fails, it is kept to resume the write from it.
+        Returns the number of operations written by this call
         """
+        collection_name = write.collection_name
         if collection_name not in self.allowed:
             raise NonExistentCollectionException(collection_name)
 
-        operations = []
-        operation_counters = {}
-        for command in commands:
-            operation_counters[command.type] = (
-                operation_counters.get(command.type, 0) + 1
+        if write.chunks is None and not os.getenv("MOCK_DB_COLLECTION"):
+            if self.indexes is not None:
+                self._ensure_indexes(write)
+            if self.index_checker is not None:
+                self.index_checker.check(
+                    self.connection.database, collection_name, write.commands
+                )
+        if write.chunks is None:
+            operations = self._operations(
+                write.commands, write.counters, write.expanded
             )
-            operations.extend(command.get_operations())
-
-        if os.getenv("MOCK_DB_COLLECTION"):
-            print(operations)
-        elif operations:
+            write.chunks = self._chunks(operations, collection_name)
+        profile = self.profiles.get(collection_name)
+        chunks, written = write.chunks, write.n_operations
+        for chunk, routing in chunks:
+            if os.getenv("MOCK_DB_COLLECTION"):
+                write.n_operations += len(chunk)
+                print(chunk)
+                continue
             logging.info(
-                f"Executing {len(operations)} operations in {collection_name}"
+                f"Executing {len(chunk)} operations in {collection_name}"
             )
-            logging.info(operation_counters)
-            self.connection.database[collection_name].bulk_write(operations)
-        else:
-            return
+            start = time.perf_counter()
+            n_operations, remaining, retried = len(chunk), chunk, set()
+            try:
+                with self._span(
+                    "write", collection=collection_name, size=len(chunk)
+                ), self._profile("write"):
+                    while remaining:
+                        remaining = self._write_chunk(
+                            collection_name, remaining, profile, retried
+                        )
+            except Exception:
+                write.chunks = chain([(remaining, routing)], chunks)
+                raise
+            write.n_operations += n_operations
+            if self.metrics is not None:
+                elapsed = time.perf_counter() - start
+                self.metrics.observe_write(collection_name, elapsed)
+                if routing is not None:
+                    self.metrics.observe_routing(collection_name, routing)
+                if profile is not None:
+                    self.metrics.observe_profile_write(
+                        profile.name, n_operations, elapsed
+                    )
+                self._observe_latency(collection_name, write.expanded)
 
-    def bulk_execute(self, commands: List[Command]):
+        if write.counters:
+            logging.info(write.counters)
+        if self.metrics is not None and write.commands:
+            self.metrics.observe_amplification(
+                collection_name, len(write.commands), write.n_operations
+            )
+        return write.n_operations - written
+
+    def _queue(self, commands: List[Command]):
         """
-        Receives all commands and separates them according to their collection
+        Queues the commands to be written, grouped by collection
         """
         commands_per_collection: Dict[str, list] = {}
         for command in commands:
@@ -67,6 +399,142 @@ class ScribeCommandExecutor:
             if collection not in commands_per_collection:
                 commands_per_collection[collection] = []
             commands_per_collection[collection].append(command)
-
         for collection_name, command_list in commands_per_collection.items():
-            self._bulk_execute(collection_name, command_list)
+            self.pending.append(
+                _CollectionWrite(collection_name, command_list)
+            )
+
+    def _write_pending(self) -> int:
+        """
+        Writes the queued commands in order. When a write fails, it stays
+        queued from the chunk that failed
+        """
+        n_operations = 0
+        try:
+            while self.pending:
+                n_operations += self._bulk_execute(self.pending[0])
+                write = self.pending.popleft()
+                if write.collection_name == FEATURE_SCHEMA_COLLECTION:
+                    self.written_schemas.update(
+                        command.criteria["_id"] for command in write.commands
+                    )
+        except Exception:
+            # Values may have been cached without being written
+            if self.noop_cache is not None:
+                self.noop_cache.clear()
+            raise
+        return n_operations
+
+    def _buffer_commands(self, commands: List[Command]):
+        """
+        Moves the commands accepted by the buffer into it and queues the rest.
+
+        Before a command that can't be buffered is queued for a document with
+        pending updates, the commands preceding it and the pending updates are
+        queued, to keep their order
+        """
+        direct = []
+        for command in commands:
+            if self.buffer.accepts(command):
+                self.buffer.add(command)
+                continue
+            if self.buffer.holds(command):
+                self._queue(direct)
+                direct = []
+                self._queue(self.buffer.drain())
+            direct.append(command)
+        self._queue(direct)
+        if self.buffer.should_flush():
+            self._queue(self.buffer.drain())
+
+    def _new_schemas(self, commands: List[Command]) -> List[Command]:
+        """
+        Drops the commands writing feature schemas that were already written,
+        or that are repeated in the batch
+        """
+        result, schemas = [], set()
+        for command in commands:
+            if command.collection == FEATURE_SCHEMA_COLLECTION:
+                schema_id = command.criteria["_id"]
+                if schema_id in self.written_schemas or schema_id in schemas:
+                    continue
+                schemas.add(schema_id)
+            result.append(command)
+        return result
+
+    def _prune(self, commands: List[Command]) -> List[Command]:
+        """
+        Drops the fields of updates that were already written with the same
+        value
+        """
+        commands, dropped = self.noop_cache.prune(commands)
+        for collection, (n_fields, n_updates) in dropped.items():
+            logging.info(
+                f"Dropped {n_fields} unchanged fields and {n_updates} "
+                f"updates in {collection}"
+            )
+            if self.metrics is not None:
+                self.metrics.count_noop(collection, n_fields, n_updates)
+        return commands
+
+    def has_pending_writes(self) -> bool:
+        """
+        Whether there are buffered commands, or commands of a failed write,
+        that haven't been written yet
+        """
+        return bool(self.pending) or (
+            self.buffer is not None and len(self.buffer) > 0
+        )
+
+    def flush(self) -> int:
+        """
+        Writes all buffered commands. Returns the number of operations written
+        """
+        if self.buffer is not None and len(self.buffer) > 0:
+            commands = self.buffer.drain()
+            logging.info(f"Flushing {len(commands)} buffered commands")
+            self._queue(commands)
+        return self._write_pending()
+
+    def resume(self) -> int:
+        """
+        Resumes a failed write from the chunk that failed, without writing
+        again what was already written. Returns the number of operations
+        written
+        """
+        return self._write_pending()
+
+    def discard(self) -> List[Command]:
+        """
+        Drops the commands of a failed write and returns them. The commands
+        of a collection are returned whole, even if some of their chunks were
+        written
+        """
+        commands = [
+            command for write in self.pending for command in write.commands
+        ]
+        self.pending.clear()
+        return commands
+
+    def bulk_execute(self, commands: List[Command]):
+        """
+        Receives all commands and separates them according to their collection.
+        Returns the total number of operations written
+
+        With a write-behind buffer, accepted commands are only written when
+        the buffer reaches its maximum size or age. With a no-op cache,
+        updates that wouldn't change the stored values are dropped first.
+        Feature schemas are only written until a write of them succeeds.
+
+        Commands that weren't written because of an error (including those
+        drained from the buffer) are kept, and written before the new ones.
+        Use `resume` to retry a failed write.
+        """
+        commands = self._new_schemas(commands)
+        if self.noop_cache is not None:
+            commands = self._prune(commands)
+        if self.buffer is not None:
+            self._buffer_commands(commands)
+        else:
+            self._queue(commands)
+        return self._write_pending()
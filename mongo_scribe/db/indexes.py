@@ -0,0 +1,150 @@
+import logging
+import random
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ASCENDING
+
+from ..command.commands import Command
+
+IndexKey = List[Tuple[str, int]]
+
+
+def _key(fields) -> IndexKey:
+    return [
+        (field, ASCENDING) if isinstance(field, str) else tuple(field)
+        for field in fields
+    ]
+
+
+def ensure_indexes(database, required: Dict[str, list], create: bool):
+    """
+    Checks that every collection has the indexes it needs, creating the
+    missing ones when `create` is set. Otherwise, they are only reported.
+
+    `required` maps each collection to a list of index keys, each a list of
+    field names (ascending) or `(field, direction)` pairs. An existing index
+    whose key starts with the required fields covers it.
+
+    Returns the indexes that are still missing, by collection.
+    """
+    missing = {}
+    for collection_name, keys in required.items():
+        collection = database[collection_name]
+        existing = [
+            [tuple(field) for field in index["key"]]
+            for index in collection.index_information().values()
+        ]
+        for fields in keys:
+            key = _key(fields)
+            if any(index[: len(key)] == key for index in existing):
+                continue
+            if create:
+                logging.info(f"Creating index {key} in {collection_name}")
+                collection.create_index(key)
+                continue
+            logging.warning(f"Missing index {key} in {collection_name}")
+            missing.setdefault(collection_name, []).append(key)
+    return missing
+
+
+def _is_equality(condition) -> bool:
+    return not (
+        isinstance(condition, dict)
+        and any(name.startswith("$") for name in condition)
+    )
+
+
+def filter_key(query: dict) -> Optional[Tuple[str, ...]]:
+    """
+    Fields of the index needed by a filter: those matched by equality first,
+    then the rest. Returns `None` when no index is needed, i.e., the filter
+    is empty or matches `_id`, which is always indexed.
+    """
+    if not query or ("_id" in query and _is_equality(query["_id"])):
+        return None
+    equality = [field for field in query if _is_equality(query[field])]
+    return tuple(equality) + tuple(
+        field for field in query if field not in equality
+    )
+
+
+def command_indexes(commands: Iterable[Command]) -> set:
+    """
+    Keys of the indexes needed by the filters of the commands
+    """
+    keys = set()
+    for command in commands:
+        for query in command.filters():
+            key = filter_key(query)
+            if key is not None:
+                keys.add(key)
+    return keys
+
+
+def _stages(plan) -> set:
+    """
+    Names of every stage of a query plan, including those of each shard
+    """
+    stages = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.add(plan["stage"])
+        for value in plan.values():
+            stages |= _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages |= _stages(value)
+    return stages
+
+
+class IndexChecker:
+    """
+    Explains the filters of a sample of the commands written to report those
+    that aren't covered by an index (i.e., that need a collection scan)
+
+    A fraction `sample_rate` of the writes is inspected. Each collection and
+    set of filter fields is explained only once, since the plan depends on
+    the fields rather than on their values.
+    """
+
+    def __init__(self, sample_rate: float, metrics=None):
+        self.sample_rate = sample_rate
+        self.metrics = metrics
+        self.checked = set()
+
+    def _explain(self, database, collection_name: str, query: dict):
+        result = database.command(
+            {
+                "explain": {"find": collection_name, "filter": query},
+                "verbosity": "queryPlanner",
+            }
+        )
+        return _stages(result.get("queryPlanner", result))
+
+    def _queries(self, collection_name: str, commands: List[Command]):
+        """
+        Filters of the commands whose shape hasn't been explained yet
+        """
+        for command in commands:
+            for query in command.filters():
+                shape = (collection_name, tuple(sorted(query)))
+                if query and shape not in self.checked:
+                    self.checked.add(shape)
+                    yield shape, query
+
+    def check(self, database, collection_name: str, commands: List[Command]):
+        if random.random() >= self.sample_rate:
+            return
+        for shape, query in self._queries(collection_name, commands):
+            try:
+                stages = self._explain(database, collection_name, query)
+            except Exception as exc:
+                logging.warning(f"Couldn't explain filter: {exc}")
+                continue
+            if "COLLSCAN" in stages:
+                logging.warning(
+                    f"Updates in {collection_name} by {list(shape[1])} "
+                    "are not covered by an index"
+                )
+                if self.metrics is not None:
+                    self.metrics.count_unindexed(collection_name)
@@ -0,0 +1,404 @@
+import functools
+import logging
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from typing import Iterator, List, Tuple
+
+from ..command.commands import Command
+from .executor import TRANSIENT_ERRORS
+
+MAGIC = b"SCJ1"
+HEADER = struct.Struct("<4sII")  # magic, payload length, crc32 of payload
+
+Position = Tuple[int, int]  # segment number, offset within the segment
+
+
+class CommandJournal:
+    """
+    Append-only journal of command batches on local disk
+
+    Each batch is stored as a record with a header containing its length and
+    CRC32 checksum, followed by the pickled commands. Records are appended to
+    numbered segment files of about `segment_size` bytes.
+
+    The position of the first record not yet written to the database is kept
+    in a checkpoint file, so records after it are replayed after a restart.
+    Segments before the checkpoint are deleted. An incomplete record at the
+    end of the last segment (e.g., after a crash while appending) is
+    discarded when the journal is opened.
+
+    Batches that can't be read or written are moved to a `dead_letter` file
+    in the same directory, using the same record format, so they can be
+    inspected and replayed by hand.
+    """
+
+    def __init__(self, directory: str, segment_size: int, fsync: bool = True):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self.checkpoint = self._read_checkpoint()
+        segments = self._segments()
+        segment = segments[-1] if segments else self.checkpoint[0]
+        self._file = open(self._path(segment), "ab")
+        self._segment = segment
+        self.end = (segment, self._recover(segment))
+        if self.end[1] >= segment_size:
+            self._rotate()
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:012d}.log")
+
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(name[:-4])
+            for name in os.listdir(self.directory)
+            if name.endswith(".log")
+        )
+
+    def _read_checkpoint(self) -> Position:
+        try:
+            with open(os.path.join(self.directory, "checkpoint")) as f:
+                segment, offset = f.read().split()
+                return int(segment), int(offset)
+        except FileNotFoundError:
+            return 0, 0
+
+    def _recover(self, segment: int) -> int:
+        """
+        Returns the end of the last valid record in a segment, truncating
+        anything after it
+        """
+        offset = 0
+        with open(self._path(segment), "rb") as f:
+            for _, offset in self._records(f, offset):
+                pass
+            size = f.seek(0, os.SEEK_END)
+        if size != offset:
+            logging.warning(
+                f"Discarding {size - offset} bytes at the end of journal "
+                f"segment {segment}"
+            )
+            self._file.truncate(offset)
+        return offset
+
+    @staticmethod
+    def _records(
+        f, offset: int, end: int = None
+    ) -> Iterator[Tuple[bytes, int]]:
+        """
+        Yields each valid record payload and the offset after it
+        """
+        f.seek(offset)
+        while end is None or offset < end:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            magic, length, checksum = HEADER.unpack(header)
+            payload = f.read(length)
+            if (
+                magic != MAGIC
+                or len(payload) < length
+                or zlib.crc32(payload) != checksum
+            ):
+                return
+            offset += HEADER.size + length
+            yield payload, offset
+
+    @staticmethod
+    def _record(payload: bytes) -> bytes:
+        return HEADER.pack(MAGIC, len(payload), zlib.crc32(payload)) + payload
+
+    def append(self, commands: List[Command]):
+        """
+        Writes a batch of commands. It is on disk when this method returns
+        """
+        payload = pickle.dumps(commands, protocol=pickle.HIGHEST_PROTOCOL)
+        record = self._record(payload)
+        with self._lock:
+            self._file.write(record)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            offset = self._file.tell()
+            if offset >= self.segment_size:
+                self._rotate()
+            else:
+                self.end = (self._segment, offset)
+
+    def _dead_letter(self, payload: bytes):
+        path = os.path.join(self.directory, "dead_letter")
+        with open(path, "ab") as f:
+            f.write(self._record(payload))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def dead_letter(self, commands: List[Command]):
+        """
+        Moves a batch of commands that can't be written to the dead-letter
+        file
+        """
+        self._dead_letter(
+            pickle.dumps(commands, protocol=pickle.HIGHEST_PROTOCOL)
+        )
+
+    def _rotate(self):
+        self._file.close()
+        self._segment += 1
+        self._file = open(self._path(self._segment), "ab")
+        self.end = (self._segment, 0)
+
+    def read(
+        self, position: Position
+    ) -> Iterator[Tuple[List[Command], Position]]:
+        """
+        Yields the batches written after `position` and the position after
+        each one, up to the end of the journal at the time of the call
+
+        Records that can't be unpickled are moved to the dead-letter file
+        and yielded as empty batches, so the checkpoint can move past them
+        """
+        end = self.end
+        segment, offset = position
+        while (segment, offset) < end:
+            limit = end[1] if segment == end[0] else None
+            try:
+                with open(self._path(segment), "rb") as f:
+                    for payload, offset in self._records(f, offset, limit):
+                        # A segment is full after the record crossing its size
+                        if offset >= self.segment_size:
+                            next_position = (segment + 1, 0)
+                        else:
+                            next_position = (segment, offset)
+                        try:
+                            batch = pickle.loads(payload)
+                        except Exception:
+                            logging.exception(
+                                f"Moving unreadable record in journal "
+                                f"segment {segment} to the dead-letter file"
+                            )
+                            self._dead_letter(payload)
+                            batch = []
+                        yield batch, next_position
+            except FileNotFoundError:
+                pass
+            if segment == end[0]:
+                return
+            if limit is None and offset < os.path.getsize(self._path(segment)):
+                logging.error(
+                    f"Corrupted record in journal segment {segment} at offset "
+                    f"{offset}, skipping the rest of the segment"
+                )
+            segment, offset = segment + 1, 0
+
+    def commit(self, position: Position):
+        """
+        Marks every record before `position` as written and deletes the
+        segments that are no longer needed
+        """
+        path = os.path.join(self.directory, "checkpoint")
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{position[0]} {position[1]}")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self.checkpoint = position
+        for segment in self._segments():
+            if segment >= position[0]:
+                break
+            os.remove(self._path(segment))
+
+    def backlog(self) -> int:
+        """
+        Approximate number of bytes journaled but not yet written
+        """
+        (segment, offset), (end_segment, end_offset) = (
+            self.checkpoint,
+            self.end,
+        )
+        if segment == end_segment:
+            return end_offset - offset
+        return (
+            (end_segment - segment) * self.segment_size + end_offset - offset
+        )
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class JournaledCommandExecutor:
+    """
+    Journals the commands and writes them to the database in the background
+
+    `bulk_execute` returns as soon as the commands are safely on disk, so the
+    offsets can be committed even while the database is slow or unavailable.
+    A background thread drains the journal through the wrapped `executor`,
+    joining up to `drain_size` commands per write. Writes failing because the
+    database is unreachable are retried with exponential backoff until they
+    succeed or the executor is closed, resuming from the chunk that failed.
+    Other errors are retried `max_attempts` times, then the commands not yet
+    written are moved to the dead-letter file of the journal. The checkpoint
+    never moves past commands that were neither written nor dead-lettered.
+    Commands left in the journal when the process stops are written when it
+    starts again.
+
+    If the background thread stops because of an unexpected error (e.g.,
+    the journal can't be read), `bulk_execute` and `flush` raise it, so the
+    step fails instead of waiting for a backlog that never goes down.
+
+    The wrapped executor must not use a write-behind buffer, since the
+    journal is checkpointed as soon as `bulk_execute` returns.
+
+    When the backlog exceeds `max_backlog` bytes, `bulk_execute` blocks until
+    it goes down, so the lag stays in Kafka instead of filling the disk.
+    """
+
+    def __init__(
+        self,
+        executor,
+        journal: CommandJournal,
+        max_backlog: int,
+        drain_size: int = 10000,
+        max_backoff: float = 60,
+        max_attempts: int = 5,
+    ):
+        self.executor = executor
+        self.journal = journal
+        self.max_backlog = max_backlog
+        self.drain_size = drain_size
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def warm_up(self):
+        try:
+            self.executor.warm_up()
+        except Exception as exc:
+            logging.warning(f"Database unavailable, journaling only: {exc}")
+
+    def _write(self, commands: List[Command]) -> bool:
+        """
+        Writes the commands, retrying until they are written or moved to the
+        dead-letter file. Returns `False` if the executor is closed first,
+        leaving them in the journal
+        """
+        backoff, attempts = min(0.5, self.max_backoff), 0
+        write = functools.partial(self.executor.bulk_execute, commands)
+        while True:
+            try:
+                write()
+                return True
+            except TRANSIENT_ERRORS as exc:
+                logging.warning(
+                    f"Database unavailable ({exc}), retrying in {backoff}s"
+                )
+            except Exception:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    failed = self.executor.discard()
+                    logging.exception(
+                        f"Moving {len(failed)} journaled commands to the "
+                        f"dead-letter file after {attempts} failed attempts"
+                    )
+                    self.journal.dead_letter(failed)
+                    return True
+                logging.exception(
+                    f"Error writing journaled commands, retrying in {backoff}s"
+                )
+            if self._stopped.wait(backoff):
+                return False
+            backoff = min(backoff * 2, self.max_backoff)
+            # Retries continue from the chunk that failed
+            write = self.executor.resume
+
+    def _drain(self):
+        try:
+            while not self._stopped.is_set():
+                commands, position = [], None
+                for batch, position in self.journal.read(
+                    self.journal.checkpoint
+                ):
+                    commands.extend(batch)
+                    if len(commands) >= self.drain_size:
+                        break
+                if position is None:
+                    with self._condition:
+                        self._condition.wait(timeout=1)
+                    continue
+                if commands and not self._write(commands):
+                    return
+                self.journal.commit(position)
+                with self._condition:
+                    self._condition.notify_all()
+        except Exception as exc:
+            logging.exception("Journal writer stopped")
+            with self._condition:
+                self._error = exc
+                self._condition.notify_all()
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError("Journal writer stopped") from self._error
+
+    def has_pending_writes(self) -> bool:
+        return False
+
+    def bulk_execute(self, commands: List[Command]) -> int:
+        """
+        Journals the commands. Returns 0, since nothing is written to the
+        database yet
+        """
+        with self._condition:
+            self._check()
+            while self.journal.backlog() > self.max_backlog:
+                logging.warning("Journal backlog is full, waiting for writes")
+                self._condition.wait(timeout=1)
+                self._check()
+        self.journal.append(commands)
+        with self._condition:
+            self._condition.notify_all()
+        return 0
+
+    def flush(self, timeout: float = 30) -> int:
+        """
+        Waits up to `timeout` seconds for the journal to be drained
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self.journal.checkpoint < self.journal.end:
+                self._check()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(timeout=remaining)
+        return 0
+
+    def close(self, timeout: float = 10):
+        """
+        Stops the background thread, waiting up to `timeout` seconds for a
+        write in progress. Commands not yet written stay in the journal and
+        are written when the executor starts again
+        """
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning(
+                f"Journal writer still busy after {timeout}s, leaving its "
+                "commands in the journal"
+            )
+        self.journal.close()
@@ -0,0 +1,95 @@
+from collections import OrderedDict
+from typing import List, Tuple
+
+from ..command.commands import Command, UpdateCommand
+from .buffer import _criteria_key
+
+
+def _same(a, b) -> bool:
+    return type(a) is type(b) and a == b
+
+
+class LastWrittenCache:
+    """
+    Remembers the last value set in each field of recently updated documents
+    to drop `$set` updates that wouldn't change anything
+
+    Only plain `update` commands without `set_on_insert` are pruned, and
+    documents are only cached after an upsert, when they surely exist. Fields
+    whose cached value is equal (including its type) are removed from the
+    command, and commands left without fields are dropped. Any other command
+    with the same criteria forgets the cached values of the document, and
+    setting a nested (dotted) field forgets the value of its parent.
+
+    At most `max_documents` documents are kept, evicting the least recently
+    updated ones. The cache assumes that every update of a document goes
+    through the same process (e.g., a single worker or partitioning by key)
+    and that documents are not deleted by others while cached.
+    """
+
+    def __init__(self, max_documents: int):
+        self.max_documents = max_documents
+        self.documents = OrderedDict()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def clear(self):
+        self.documents.clear()
+
+    @staticmethod
+    def _prunable(command: Command) -> bool:
+        return (
+            type(command) is UpdateCommand
+            and not command.options.set_on_insert
+        )
+
+    def prune(self, commands: List[Command]) -> Tuple[List[Command], dict]:
+        """
+        Removes unchanged fields from the commands and records the new
+        values as written. Returns the remaining commands and, for each
+        collection, the number of fields and of whole updates dropped
+        """
+        remaining, dropped = [], {}
+        for command in commands:
+            if not command.criteria:
+                remaining.append(command)
+                continue
+            key = (command.collection, _criteria_key(command))
+            if not self._prunable(command):
+                self.documents.pop(key, None)
+                remaining.append(command)
+                continue
+
+            cached = self.documents.get(key)
+            if cached is None:
+                # Without upsert, the document might not exist
+                if not command.options.upsert:
+                    remaining.append(command)
+                    continue
+                cached = self.documents[key] = {}
+            self.documents.move_to_end(key)
+
+            data = {}
+            for field, value in command.data.items():
+                if "." in field:
+                    cached.pop(field.split(".", 1)[0], None)
+                    data[field] = value
+                elif field in cached and _same(cached[field], value):
+                    continue
+                else:
+                    cached[field] = value
+                    data[field] = value
+
+            n_dropped = len(command.data) - len(data)
+            if n_dropped:
+                counts = dropped.setdefault(command.collection, [0, 0])
+                counts[0] += n_dropped
+                counts[1] += not data
+            if data:
+                command.data = data
+                remaining.append(command)
+
+        while len(self.documents) > self.max_documents:
+            self.documents.popitem(last=False)
+        return remaining, dropped
@@ -0,0 +1,168 @@
+import logging
+import multiprocessing
+import os
+import zlib
+from queue import Empty
+from typing import List
+
+from ..command.commands import Command
+from ..command.exceptions import PartitionWorkerException
+from .executor import ScribeCommandExecutor
+
+
+def partition_index(key, n_partitions: int) -> int:
+    """
+    Returns the partition for a document key. Unlike `hash`, the result is
+    the same in every process
+    """
+    return zlib.crc32(repr(key).encode()) % n_partitions
+
+
+def _partition_worker(idx, config, commands_queue, results_queue):
+    """
+    Writes every batch of commands received until it gets `None` or its
+    reader dies, replying with the sequence number of the batch
+
+    Workers don't use a write-behind buffer, since the reader commits the
+    offsets as soon as every worker acknowledges its commands
+    """
+    config = {
+        key: value for key, value in config.items() if key != "WRITE_BEHIND"
+    }
+    executor = ScribeCommandExecutor(config)
+    executor.warm_up()
+    reader = os.getppid()
+    while True:
+        try:
+            batch = commands_queue.get(timeout=5)
+        except Empty:
+            if os.getppid() != reader:
+                logging.warning(f"Partition worker {idx} lost its reader")
+                break
+            continue
+        if batch is None:
+            break
+        sequence, commands = batch
+        try:
+            n_operations = executor.bulk_execute(commands)
+            results_queue.put((sequence, idx, n_operations, None))
+        except Exception as exc:
+            logging.exception(f"Partition worker {idx} failed")
+            results_queue.put((sequence, idx, 0, repr(exc)))
+
+
+class PartitionedCommandExecutor:
+    """
+    Distributes commands to worker processes according to their document key
+
+    All commands for the same document (as given by `key_fields`) are written
+    by the same worker, so they end up in the same batch and are never
+    written concurrently by different processes. Commands without a key are
+    spread evenly among workers.
+
+    Has the same interface as `ScribeCommandExecutor`. Each call to
+    `bulk_execute` waits for every worker involved, so the batch is fully
+    written (and the offsets can be committed) when it returns.
+    """
+
+    def __init__(self, config, n_workers: int, key_fields=("_id", "aid")):
+        self.config = config
+        self.key_fields = key_fields
+        self.context = multiprocessing.get_context()
+        self.results = self.context.Queue()
+        self.sequence = 0
+        self.queues = [None] * n_workers
+        self.workers = [None] * n_workers
+        for idx in range(n_workers):
+            self._start(idx)
+
+    def _start(self, idx: int):
+        """
+        Starts the worker of a partition. A new queue is used, since one
+        left by a dead worker could be corrupted
+        """
+        self.queues[idx] = self.context.Queue()
+        self.workers[idx] = self.context.Process(
+            target=_partition_worker,
+            args=(idx, self.config, self.queues[idx], self.results),
+            daemon=True,
+        )
+        self.workers[idx].start()
+
+    def _restart_dead_workers(self, indexes) -> dict:
+        errors = {}
+        for idx in indexes:
+            if not self.workers[idx].is_alive():
+                logging.warning(f"Partition worker {idx} died, restarting it")
+                errors[idx] = "worker is not running"
+                self._start(idx)
+        return errors
+
+    def partition(self, commands: List[Command]) -> List[List[Command]]:
+        n_partitions = len(self.queues)
+        partitions = [[] for _ in range(n_partitions)]
+        for i, command in enumerate(commands):
+            key = command.document_key(self.key_fields)
+            if key is None:
+                idx = i % n_partitions
+            else:
+                idx = partition_index(key, n_partitions)
+            partitions[idx].append(command)
+        return partitions
+
+    def warm_up(self):
+        """
+        Does nothing, each worker connects on its own when it starts
+        """
+
+    def has_pending_writes(self) -> bool:
+        return False
+
+    def flush(self) -> int:
+        return 0
+
+    def bulk_execute(self, commands: List[Command]):
+        """
+        Sends each partition to its worker and waits until all are written.
+        Returns the total number of operations written
+
+        Results are tagged with the sequence number of their batch, so those
+        left by a failed batch are dropped. Dead workers are restarted, and
+        the batch fails if any of its partitions was lost.
+        """
+        self._restart_dead_workers(range(len(self.workers)))
+        self.sequence += 1
+        pending = set()
+        for idx, partition in enumerate(self.partition(commands)):
+            if partition:
+                self.queues[idx].put((self.sequence, partition))
+                pending.add(idx)
+
+        errors, n_operations = {}, 0
+        while pending:
+            try:
+                sequence, idx, written, error = self.results.get(timeout=1)
+            except Empty:
+                errors.update(self._restart_dead_workers(pending))
+                if errors:
+                    raise PartitionWorkerException(errors)
+                continue
+            if sequence != self.sequence:
+                continue
+            pending.discard(idx)
+            n_operations += written
+            if error:
+                errors[idx] = error
+
+        if errors:
+            raise PartitionWorkerException(errors)
+        return n_operations
+
+    def close(self):
+        """
+        Stops the workers after they finish their pending commands
+        """
+        for queue in self.queues:
+            queue.put(None)
+        for worker in self.workers:
+            worker.join()
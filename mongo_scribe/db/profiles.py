@@ -0,0 +1,68 @@
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from pymongo.write_concern import WriteConcern
+
+
+@dataclass
+class WriteProfile:
+    """
+    Options used to write the collections of a profile
+
+    Only the write concern options that are set override the defaults of
+    the client. `ordered` and `bypass_document_validation` are passed to
+    `bulk_write`, and `chunk_size` replaces the chunk size of the executor.
+    Unordered writes are only safe for collections whose operations don't
+    depend on each other, since the server may apply them in any order.
+    """
+
+    name: str
+    write_concern: Optional[WriteConcern] = None
+    ordered: bool = True
+    bypass_document_validation: bool = False
+    chunk_size: Optional[int] = None
+
+    @classmethod
+    def from_config(cls, name: str, config: dict) -> "WriteProfile":
+        concern = {
+            key: config[option]
+            for key, option in (
+                ("w", "W"),
+                ("j", "J"),
+                ("wtimeout", "WTIMEOUT"),
+            )
+            if config.get(option) is not None
+        }
+        return cls(
+            name,
+            WriteConcern(**concern) if concern else None,
+            config.get("ORDERED", True),
+            config.get("BYPASS_DOCUMENT_VALIDATION", False),
+            config.get("CHUNK_SIZE"),
+        )
+
+    def collection(self, database, collection_name: str):
+        collection = database[collection_name]
+        if self.write_concern is None:
+            return collection
+        return collection.with_options(write_concern=self.write_concern)
+
+    def bulk_write(self, database, collection_name: str, chunk: list):
+        return self.collection(database, collection_name).bulk_write(
+            chunk,
+            ordered=self.ordered,
+            bypass_document_validation=self.bypass_document_validation,
+        )
+
+
+def write_profiles(config: Dict[str, dict]) -> Dict[str, WriteProfile]:
+    """
+    Maps each collection to its write profile, given the profiles by name,
+    each with the `COLLECTIONS` it applies to
+    """
+    profiles = {}
+    for name, options in config.items():
+        profile = WriteProfile.from_config(name, options)
+        for collection in options["COLLECTIONS"]:
+            profiles[collection] = profile
+    return profiles
@@ -0,0 +1,205 @@
+from bisect import bisect_right
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from bson import ObjectId
+from pymongo import InsertOne
+
+_ORDERABLE = (str, int, float, datetime, ObjectId, bytes)
+
+
+def _typed(value) -> tuple:
+    """
+    Sort key of a value, ordering values by type first as MongoDB does
+    """
+    if isinstance(value, (int, float)):
+        return ("number", value)
+    return (type(value).__name__, value)
+
+
+def _field(document, field: str):
+    """
+    Value of a field in a document or filter, following dotted paths
+    """
+    if field in document:
+        return document[field]
+    value = document
+    for part in field.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def operation_key(operation, fields: Sequence[str]) -> Optional[tuple]:
+    """
+    Returns the values of `fields` matched by an operation, or `None` if any
+    of them is missing or isn't an orderable equality match
+    """
+    document = operation._doc if isinstance(operation, InsertOne) else None
+    if document is None:
+        document = getattr(operation, "_filter", None)
+    if document is None:
+        return None
+    key = []
+    for field in fields:
+        value = _field(document, field)
+        if isinstance(value, dict) and set(value) == {"$eq"}:
+            value = value["$eq"]
+        if not isinstance(value, _ORDERABLE):
+            return None
+        key.append(_typed(value))
+    return tuple(key)
+
+
+def sort_operations(operations: list, keys: List[Optional[tuple]]):
+    """
+    Stably sorts the operations by key. Operations without a key stay in
+    place and nothing is moved across them, since they could target any
+    document. Operations on the same document keep their relative order.
+
+    Returns the sorted operations and their keys.
+    """
+    result, result_keys = [], []
+    segment = []
+
+    def flush():
+        try:
+            segment.sort(key=lambda pair: pair[0])
+        except TypeError:
+            pass  # e.g., naive and aware datetimes, left in arrival order
+        result.extend(operation for _, operation in segment)
+        result_keys.extend(key for key, _ in segment)
+        segment.clear()
+
+    for operation, key in zip(operations, keys):
+        if key is None:
+            flush()
+            result.append(operation)
+            result_keys.append(None)
+        else:
+            segment.append((key, operation))
+    flush()
+    return result, result_keys
+
+
+def _sorted_windows(
+    operations: Iterable, fields: Sequence[str], window: Optional[int]
+) -> Iterator[Tuple[object, Optional[tuple]]]:
+    """
+    Yields the operations sorted by key, with their keys, sorting
+    consecutive groups of at most `window` operations (all of them when
+    `window` is `None`)
+    """
+    iterator = iter(operations)
+    while True:
+        group = list(islice(iterator, window))
+        if not group:
+            return
+        keys = [operation_key(operation, fields) for operation in group]
+        yield from zip(*sort_operations(group, keys))
+        if window is None:
+            return
+
+
+def sort_by_key(
+    operations: Iterable, fields: Sequence[str], window: int = None
+) -> Iterator:
+    """
+    Stably sorts the operations by the values of `fields`, so consecutive
+    writes touch neighbouring index entries
+
+    With a `window`, the operations are sorted in consecutive groups of at
+    most `window` operations, so only that many are held in memory.
+    Operations are not moved across groups.
+    """
+    for operation, _ in _sorted_windows(operations, fields, window):
+        yield operation
+
+
+class ShardRouter:
+    """
+    Sorts the operations of each collection by its shard key and splits
+    them in chunks that don't cross shard ranges
+
+    `shard_keys` maps each collection to its shard key fields, which are
+    read from the criteria of updates and the documents of inserts.
+    `boundaries` optionally maps a collection to the sorted split points of
+    its chunk ranges (values of the shard key, or lists of values for
+    compound keys), e.g. taken from `config.chunks`.
+
+    Each chunk is labelled `targeted` when it surely hits a single range,
+    `scattered` when it spans several ranges or has operations without a
+    shard key, and `unknown` when there are no boundaries and it has
+    operations with different keys.
+    """
+
+    def __init__(
+        self,
+        shard_keys: Dict[str, Sequence[str]],
+        boundaries: Dict[str, list] = None,
+    ):
+        self.shard_keys = shard_keys
+        self.boundaries = {
+            collection: [self._boundary(value) for value in values]
+            for collection, values in (boundaries or {}).items()
+        }
+
+    def __contains__(self, collection: str) -> bool:
+        return collection in self.shard_keys
+
+    @staticmethod
+    def _boundary(value) -> tuple:
+        values = value if isinstance(value, (list, tuple)) else [value]
+        return tuple(_typed(v) for v in values)
+
+    def _range(self, collection: str, key: Optional[tuple]) -> Optional[int]:
+        boundaries = self.boundaries.get(collection)
+        if boundaries is None or key is None:
+            return None
+        try:
+            return bisect_right(boundaries, key)
+        except TypeError:
+            return None
+
+    def _routing(self, collection: str, keys: list, ranges: set) -> str:
+        if None in keys:
+            return "scattered"
+        if collection in self.boundaries:
+            return "targeted" if len(ranges) == 1 else "scattered"
+        return "targeted" if len(set(keys)) == 1 else "unknown"
+
+    def route(
+        self,
+        collection: str,
+        operations: Iterable,
+        chunk_size: int,
+        window: int = None,
+    ) -> Iterator[Tuple[list, str]]:
+        """
+        Yields the sorted operations of a collection in chunks of at most
+        `chunk_size`, starting a new chunk when the shard range changes,
+        along with the routing label of each chunk
+
+        With a `window`, operations are sorted in groups of at most `window`
+        operations, as in `sort_by_key`, so only that many are held in
+        memory. Operations of different groups aren't sorted together, so a
+        smaller window gives more (and smaller) chunks.
+        """
+        fields = self.shard_keys[collection]
+        chunk, chunk_keys, ranges = [], [], set()
+        for operation, key in _sorted_windows(operations, fields, window):
+            range_index = self._range(collection, key)
+            if chunk and (
+                len(chunk) >= chunk_size
+                or (range_index is not None and ranges - {range_index})
+            ):
+                yield chunk, self._routing(collection, chunk_keys, ranges)
+                chunk, chunk_keys, ranges = [], [], set()
+            chunk.append(operation)
+            chunk_keys.append(key)
+            if range_index is not None:
+                ranges.add(range_index)
+        if chunk:
+            yield chunk, self._routing(collection, chunk_keys, ranges)
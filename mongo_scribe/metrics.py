@@ -0,0 +1,145 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+DECODE_TIME = Histogram(
+    "scribe_decode_seconds",
+    "Time spent decoding and validating a batch of messages",
+)
+BUILD_TIME = Histogram(
+    "scribe_build_seconds",
+    "Time spent building the operations of a single command",
+    ["command_type"],
+    buckets=(1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2),
+)
+WRITE_TIME = Histogram(
+    "scribe_bulk_write_seconds",
+    "Time spent in a single bulk_write call",
+    ["collection"],
+)
+PROFILE_WRITE_TIME = Histogram(
+    "scribe_profile_bulk_write_seconds",
+    "Time spent in a single bulk_write call, by write profile",
+    ["profile"],
+)
+PROFILE_OPERATIONS = Counter(
+    "scribe_profile_operations",
+    "Number of operations written, by write profile",
+    ["profile"],
+)
+AMPLIFICATION = Histogram(
+    "scribe_operations_per_command",
+    "Mean number of operations generated per command in a batch",
+    ["collection"],
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100),
+)
+NOOP_FIELDS = Counter(
+    "scribe_noop_fields_dropped",
+    "Fields removed from updates because they were written with that value",
+    ["collection"],
+)
+NOOP_UPDATES = Counter(
+    "scribe_noop_updates_dropped",
+    "Updates dropped because none of their fields would change",
+    ["collection"],
+)
+UNINDEXED_WRITES = Counter(
+    "scribe_unindexed_write_shapes",
+    "Sets of criteria fields whose updates need a collection scan",
+    ["collection"],
+)
+ROUTED_CHUNKS = Counter(
+    "scribe_routed_chunks",
+    "Chunks written to sharded collections, by how they were routed",
+    ["collection", "routing"],
+)
+UPSERT_CONFLICTS = Counter(
+    "scribe_upsert_conflicts",
+    "Upserts retried as updates after another process inserted the document",
+    ["collection"],
+)
+INVALID_MESSAGES = Counter(
+    "scribe_invalid_messages",
+    "Number of messages that couldn't be decoded into a valid command",
+    ["exception"],
+)
+DUPLICATE_CHECKS = Counter(
+    "scribe_duplicate_payload_checks",
+    "Lookups in the cache of written payloads, by result (hit or miss)",
+    ["result"],
+)
+END_TO_END_LATENCY = Histogram(
+    "scribe_end_to_end_seconds",
+    "Time from the Kafka timestamp of a message until its command is written",
+    ["collection", "command_type"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600),
+)
+BREAKER_STATE = Gauge(
+    "scribe_circuit_breaker_state",
+    "State of the circuit breaker: 0 closed, 1 open, 2 half-open",
+)
+LAG = Gauge(
+    "scribe_lag_seconds",
+    "Age of the oldest message of the last batch when it finished writing",
+)
+
+
+class ScribeMetrics:
+    """
+    Prometheus instrumentation for each stage of the scribe
+
+    Components receive an instance of this class when metrics are enabled and
+    `None` otherwise, so that disabled metrics only cost a single check.
+    """
+
+    def observe_decode(self, seconds: float):
+        DECODE_TIME.observe(seconds)
+
+    def observe_build(self, command_type: str, seconds: float):
+        BUILD_TIME.labels(command_type=command_type).observe(seconds)
+
+    def observe_write(self, collection: str, seconds: float):
+        WRITE_TIME.labels(collection=collection).observe(seconds)
+
+    def observe_profile_write(
+        self, profile: str, n_operations: int, seconds: float
+    ):
+        PROFILE_WRITE_TIME.labels(profile=profile).observe(seconds)
+        PROFILE_OPERATIONS.labels(profile=profile).inc(n_operations)
+
+    def observe_amplification(
+        self, collection: str, n_commands: int, n_operations: int
+    ):
+        AMPLIFICATION.labels(collection=collection).observe(
+            n_operations / n_commands
+        )
+
+    def observe_latency(
+        self, collection: str, command_type: str, seconds: float
+    ):
+        END_TO_END_LATENCY.labels(
+            collection=collection, command_type=command_type
+        ).observe(seconds)
+
+    def count_noop(self, collection: str, n_fields: int, n_updates: int):
+        NOOP_FIELDS.labels(collection=collection).inc(n_fields)
+        NOOP_UPDATES.labels(collection=collection).inc(n_updates)
+
+    def count_unindexed(self, collection: str):
+        UNINDEXED_WRITES.labels(collection=collection).inc()
+
+    def count_upsert_conflicts(self, collection: str, n_conflicts: int):
+        UPSERT_CONFLICTS.labels(collection=collection).inc(n_conflicts)
+
+    def observe_routing(self, collection: str, routing: str):
+        ROUTED_CHUNKS.labels(collection=collection, routing=routing).inc()
+
+    def set_lag(self, seconds: float):
+        LAG.set(seconds)
+
+    def set_breaker_state(self, state: int):
+        BREAKER_STATE.set(state)
+
+    def count_duplicate_check(self, hit: bool):
+        DUPLICATE_CHECKS.labels(result="hit" if hit else "miss").inc()
+
+    def count_invalid(self, exc: Exception):
+        INVALID_MESSAGES.labels(exception=type(exc).__name__).inc()
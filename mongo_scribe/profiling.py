@@ -0,0 +1,131 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+from .tracing import NULL_SPAN
+
+_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+)
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces(_FILTERS)
+
+
+class _Stage:
+    def __init__(self, profiler: "BatchProfiler", name: str):
+        self.profiler = profiler
+        self.name = name
+        self.snapshot = None
+
+    def __enter__(self):
+        self.snapshot = _snapshot()
+        self.profiler.profiles[self.name].enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.profiles[self.name].disable()
+        diff = _snapshot().compare_to(self.snapshot, "lineno")
+        allocations = self.profiler.allocations[self.name]
+        for stat in diff:
+            frame = stat.traceback[0]
+            allocations[(frame.filename, frame.lineno)] += stat.size_diff
+        self.snapshot = None
+        return False
+
+
+class BatchProfiler:
+    """
+    Profiles CPU (cProfile) and memory (tracemalloc) of the next batches
+    when triggered
+
+    The profiler is triggered by sending `signum` to the process (SIGUSR1 by
+    default) or by calling `trigger`. From the following batch on, the next
+    `n_batches` batches are profiled and a report is written to `output_dir`
+    for each stage:
+
+    - `<prefix>-<stage>.prof`: cProfile stats, readable with `pstats` or snakeviz
+    - `<prefix>-<stage>.txt`: top functions by cumulative time
+    - `<prefix>-<stage>-memory.txt`: lines that allocated the most memory
+
+    While inactive, `stage` returns a shared no-op context.
+    """
+
+    def __init__(self, output_dir: str, n_batches: int, signum=signal.SIGUSR1):
+        self.output_dir = output_dir
+        self.n_batches = n_batches
+        self.requested = 0
+        self.remaining = 0
+        self.profiles = {}
+        self.allocations = {}
+        self._started_tracemalloc = False
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signum, lambda *args: self.trigger())
+
+    @property
+    def active(self) -> bool:
+        return self.remaining > 0
+
+    def trigger(self, n_batches: int = None):
+        """
+        Requests profiling of the next `n_batches` batches. Only sets a flag,
+        so it is safe to call from a signal handler
+        """
+        self.requested = n_batches or self.n_batches
+
+    def start_batch(self):
+        if self.requested and not self.active:
+            logging.info(f"Profiling the next {self.requested} batches")
+            self.remaining = self.requested
+            self.requested = 0
+            self.profiles = defaultdict(cProfile.Profile)
+            self.allocations = defaultdict(lambda: defaultdict(int))
+            self._started_tracemalloc = not tracemalloc.is_tracing()
+            if self._started_tracemalloc:
+                tracemalloc.start()
+
+    def stage(self, name: str):
+        if not self.active:
+            return NULL_SPAN
+        return _Stage(self, name)
+
+    def end_batch(self):
+        if not self.active:
+            return
+        self.remaining -= 1
+        if self.remaining == 0:
+            self._write_reports()
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+            self.profiles, self.allocations = {}, {}
+
+    def _write_reports(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(
+            self.output_dir,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}",
+        )
+        for stage, profile in self.profiles.items():
+            profile.dump_stats(f"{prefix}-{stage}.prof")
+            output = io.StringIO()
+            stats = pstats.Stats(profile, stream=output)
+            stats.sort_stats("cumulative").print_stats(50)
+            with open(f"{prefix}-{stage}.txt", "w") as f:
+                f.write(output.getvalue())
+
+        for stage, allocations in self.allocations.items():
+            top = sorted(allocations.items(), key=lambda x: -x[1])[:50]
+            with open(f"{prefix}-{stage}-memory.txt", "w") as f:
+                f.write(f"Net allocated bytes by line in stage {stage}\n")
+                for (filename, lineno), size in top:
+                    f.write(f"{size:>12} {filename}:{lineno}\n")
+        logging.info(f"Profiling reports written to {prefix}-*")
@@ -1,7 +1,38 @@
+import functools
 import logging
+import time
 from apf.core.step import GenericStep
-from .command.decode import db_command_factory
-from .db.executor import ScribeCommandExecutor
+from confluent_kafka import TopicPartition
+from .breaker import CircuitBreaker
+from .command.compression import DEFAULT_MAX_DECOMPRESSED_SIZE
+from .command.decode import build_commands, db_commands_factory, decode_payload
+from .command.dedup import DuplicatePayloadFilter
+from .db.executor import TRANSIENT_ERRORS, ScribeCommandExecutor
+from .db.journal import CommandJournal, JournaledCommandExecutor
+from .metrics import ScribeMetrics
+from .profiling import BatchProfiler
+from .supervisor import WorkerShutdown
+from .tracing import NULL_SPAN, Tracer
+
+
+class _IdleHookConsumer:
+    """
+    Wraps a Kafka consumer to call `on_idle` whenever a poll returns no
+    messages. At that point, every message consumed has been processed.
+    """
+
+    def __init__(self, consumer, on_idle):
+        self._consumer = consumer
+        self._on_idle = on_idle
+
+    def consume(self, *args, **kwargs):
+        messages = self._consumer.consume(*args, **kwargs)
+        if not messages:
+            self._on_idle()
+        return messages
+
+    def __getattr__(self, name):
+        return getattr(self._consumer, name)
 
 
 class MongoScribe(GenericStep):
@@ -11,11 +42,234 @@ class MongoScribe(GenericStep):
     ----------
     consumer : GenericConsumer
         Description of parameter `consumer`.
+    db_client : ScribeCommandExecutor, optional
+        Executor used to write the commands. By default, a new
+        `ScribeCommandExecutor` is created from `DB_CONFIG`, wrapped in a
+        `JournaledCommandExecutor` when `DB_CONFIG` has a `JOURNAL` section.
+    config : dict
+        Step configuration. With a `CIRCUIT_BREAKER` section, writes failing
+        because the database is unavailable are retried while the consumer
+        is paused, instead of stopping the step. Compressed payloads larger
+        than `MAX_PAYLOAD_SIZE` bytes once decompressed are rejected.
+    stats : WorkerStats, optional
+        Shared counters where the throughput of the step is recorded when
+        running under a `WorkerSupervisor`.
     """
 
-    def __init__(self, consumer=None, config=None, **step_args):
+    def __init__(
+        self,
+        consumer=None,
+        config=None,
+        db_client=None,
+        stats=None,
+        **step_args,
+    ):
         super().__init__(consumer, config=config, **step_args)
-        self.db_client = ScribeCommandExecutor(config["DB_CONFIG"])
+        self.stage_metrics = (
+            ScribeMetrics() if config.get("PROMETHEUS") else None
+        )
+        tracing = config.get("TRACING", {})
+        self.tracer = None
+        if tracing.get("SAMPLE_RATE"):
+            self.tracer = Tracer(tracing["PATH"], tracing["SAMPLE_RATE"])
+        profiling = config.get("BATCH_PROFILING")
+        self.profiler = None
+        if profiling:
+            self.profiler = BatchProfiler(
+                profiling["OUTPUT_DIR"], profiling["BATCHES"]
+            )
+            if profiling.get("ON_START"):
+                self.profiler.trigger()
+        self.db_client = db_client or self._create_executor(
+            config["DB_CONFIG"]
+        )
+        breaker = config.get("CIRCUIT_BREAKER")
+        self.breaker = None
+        if breaker:
+            on_change = None
+            if self.stage_metrics is not None:
+                on_change = self.stage_metrics.set_breaker_state
+            self.breaker = CircuitBreaker(
+                **{key.lower(): value for key, value in breaker.items()},
+                on_change=on_change,
+            )
+        dedup = config.get("DEDUPLICATION")
+        self.dedup = None
+        if dedup:
+            self.dedup = DuplicatePayloadFilter(
+                dedup["MAX_ENTRIES"],
+                dedup["TTL"],
+                dedup.get("EXEMPT_TYPES", ()),
+            )
+        self.stats = stats
+        self.max_payload_size = config.get(
+            "MAX_PAYLOAD_SIZE", DEFAULT_MAX_DECOMPRESSED_SIZE
+        )
+        self.commit_enabled = self.commit
+        self.busy = False
+        self.stopping = False
+        self.interrupted = False
+
+    def _create_executor(self, db_config):
+        journal = db_config.get("JOURNAL")
+        if journal:
+            # The journal is checkpointed after every write, so commands
+            # can't be held back by a write-behind buffer
+            db_config = {
+                key: value
+                for key, value in db_config.items()
+                if key != "WRITE_BEHIND"
+            }
+        executor = ScribeCommandExecutor(
+            db_config,
+            metrics=self.stage_metrics,
+            tracer=self.tracer,
+            profiler=self.profiler,
+        )
+        if not journal:
+            return executor
+        return JournaledCommandExecutor(
+            executor,
+            CommandJournal(
+                journal["DIRECTORY"],
+                journal.get("SEGMENT_SIZE", 64 * 1024 * 1024),
+                fsync=journal.get("FSYNC", True),
+            ),
+            journal.get("MAX_BACKLOG", 1024 * 1024 * 1024),
+        )
+
+    def pre_consume(self):
+        self.db_client.warm_up()
+        consumer = getattr(self.consumer, "consumer", None)
+        if consumer is not None and not isinstance(
+            consumer, _IdleHookConsumer
+        ):
+            self.consumer.consumer = _IdleHookConsumer(
+                consumer, self._flush_idle
+            )
+
+    def _flush_idle(self):
+        """
+        Writes the buffered commands when no messages arrive, so they don't
+        wait for the next batch to be written and committed
+        """
+        if not self.db_client.has_pending_writes():
+            return
+        logging.info("No messages received, flushing buffered commands")
+        if self._write(self.db_client.flush) and self.commit_enabled:
+            self.consumer.commit()
+
+    def stop(self, *args):
+        """
+        Stops the step once the current batch is written and committed, or
+        right away when it is waiting for messages. Meant to be used as the
+        SIGTERM handler, followed by `tear_down` when `WorkerShutdown` is
+        raised.
+        """
+        self.stopping = True
+        if not self.busy:
+            # Messages could have been consumed without being written yet
+            self.interrupted = True
+            raise WorkerShutdown()
+
+    def pre_execute(self, messages):
+        self.busy = True
+        return messages
+
+    def post_produce(self):
+        self.busy = False
+        if self.stopping:
+            raise WorkerShutdown()
+
+    def tear_down(self):
+        # After an interruption, the offsets of consumed messages that
+        # weren't written would be committed too
+        if (
+            self.db_client.flush()
+            and self.commit_enabled
+            and not self.interrupted
+        ):
+            self.consumer.commit()
+        if isinstance(self.db_client, JournaledCommandExecutor):
+            self.db_client.close()
+        if self.tracer:
+            self.tracer.close()
+
+    def _profile(self, name):
+        if self.profiler is None:
+            return NULL_SPAN
+        return self.profiler.stage(name)
+
+    def _build_commands(self, payload, trace):
+        if trace is None:
+            return db_commands_factory(payload, self.max_payload_size)
+        with trace.span("decode"):
+            decoded = decode_payload(payload, self.max_payload_size)
+        with trace.span("validate"):
+            return build_commands(decoded)
+
+    def _is_duplicate(self, key, batch_keys):
+        """
+        Whether a payload was already written or is earlier in the batch
+        """
+        duplicate = key in batch_keys or self.dedup.seen(key)
+        if self.stage_metrics is not None:
+            self.stage_metrics.count_duplicate_check(duplicate)
+        return duplicate
+
+    def _observe_lag(self, messages):
+        timestamps = [
+            message["timestamp"]
+            for message in messages
+            if message.get("timestamp", 0) > 0
+        ]
+        if timestamps:
+            self.stage_metrics.set_lag(time.time() - min(timestamps) / 1000)
+
+    def _pause_consumer(self):
+        """
+        Pauses the assigned partitions until the circuit breaker allows a
+        probe write, polling so the consumer stays in its group
+        """
+        consumer = getattr(self.consumer, "consumer", None)
+        if consumer is None:
+            time.sleep(self.breaker.remaining())
+            return
+        logging.warning("Pausing consumption while the database is failing")
+        consumer.pause(consumer.assignment())
+        while not self.breaker.allow():
+            message = consumer.poll(min(self.breaker.remaining(), 1))
+            if message is not None and not message.error():
+                # Partitions assigned by a rebalance aren't paused yet
+                consumer.seek(
+                    TopicPartition(
+                        message.topic(), message.partition(), message.offset()
+                    )
+                )
+                consumer.pause(consumer.assignment())
+        consumer.resume(consumer.assignment())
+
+    def _write(self, write):
+        """
+        Writes commands by calling `write`, retrying through the circuit
+        breaker when the database is unavailable. Retries resume the write
+        from the chunk that failed. Returns the number of operations written
+        """
+        if self.breaker is None:
+            return write()
+        while True:
+            if not self.breaker.allow():
+                self._pause_consumer()
+            start = time.perf_counter()
+            try:
+                n_operations = write()
+            except TRANSIENT_ERRORS as exc:
+                logging.error(f"Error writing commands: {exc}")
+                self.breaker.record(time.perf_counter() - start, failed=True)
+                write = self.db_client.resume
+                continue
+            self.breaker.record(time.perf_counter() - start)
+            return n_operations
 
     def execute(self, messages):
         """
@@ -24,22 +278,75 @@ class MongoScribe(GenericStep):
         NOTE: WE'RE ASSUMING THAT EVERY MESSAGE FROM THE BATCH GOES INTO THE SAME COLLECTION
         """
         logging.info("Processing messages...")
-        valid_commands, n_invalid_commands = [], 0
-        for message in messages:
-            try:
-                new_command = db_command_factory(message["payload"])
-                valid_commands.append(new_command)
-            except Exception as exc:
-                logging.error(f"Error processing message: {exc}")
-                n_invalid_commands += 1
+        valid_commands, n_invalid_commands, n_duplicates = [], 0, 0
+        batch_keys = {}
+        trace = self.tracer.start_batch() if self.tracer else None
+        if self.profiler:
+            self.profiler.start_batch()
+        decode_start = time.perf_counter()
+        with self._profile("decode"):
+            for message in messages:
+                key = None
+                if self.dedup is not None:
+                    key = self.dedup.key(message["payload"])
+                    if self._is_duplicate(key, batch_keys):
+                        n_duplicates += 1
+                        continue
+                try:
+                    new_commands = self._build_commands(
+                        message["payload"], trace
+                    )
+                    timestamp = message.get("timestamp")
+                    for new_command in new_commands:
+                        new_command.timestamp = timestamp
+                    valid_commands.extend(new_commands)
+                    if key is not None and not any(
+                        command.type in self.dedup.exempt_types
+                        for command in new_commands
+                    ):
+                        batch_keys[key] = None
+                except Exception as exc:
+                    logging.error(f"Error processing message: {exc}")
+                    n_invalid_commands += 1
+                    if self.stage_metrics is not None:
+                        self.stage_metrics.count_invalid(exc)
+        if self.stage_metrics is not None:
+            self.stage_metrics.observe_decode(
+                time.perf_counter() - decode_start
+            )
 
         logging.info(
-            f"Processed {len(valid_commands)} messages successfully. Found {n_invalid_commands} invalid messages."
+            f"Processed {len(messages) - n_invalid_commands - n_duplicates} messages successfully ({len(valid_commands)} commands). Found {n_invalid_commands} invalid messages."
         )
+        if n_duplicates:
+            logging.info(f"Skipped {n_duplicates} duplicate messages")
 
+        n_operations, write_time = 0, 0.0
         if len(valid_commands) > 0:
             logging.info("Writing commands into database")
             # collection = valid_commands[0].collection
-            self.db_client.bulk_execute(valid_commands)
+            start = time.perf_counter()
+            n_operations = self._write(
+                functools.partial(self.db_client.bulk_execute, valid_commands)
+            )
+            write_time = time.perf_counter() - start
+        if batch_keys:
+            self.dedup.add(batch_keys)
+
+        # Offsets can only be committed when nothing is left in the buffer
+        self.commit = (
+            self.commit_enabled and not self.db_client.has_pending_writes()
+        )
+
+        if self.stats:
+            self.stats.record(len(messages), n_operations, write_time)
+        if self.stage_metrics is not None:
+            self._observe_lag(messages)
+        if self.tracer:
+            self.tracer.end_batch(
+                n_messages=len(messages), n_operations=n_operations
+            )
+        if self.profiler:
+            self.profiler.end_batch()
 
         return []
@@ -0,0 +1,263 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from typing import Callable, List, Optional
+
+from prometheus_client import Counter, Gauge, start_http_server
+
+WORKER_RESTARTS = Counter(
+    "scribe_worker_restarts",
+    "Number of times a worker process was restarted",
+    ["worker"],
+)
+WORKER_MESSAGES_RATE = Gauge(
+    "scribe_worker_messages_per_second",
+    "Messages processed per second",
+    ["worker"],
+)
+WORKER_OPERATIONS_RATE = Gauge(
+    "scribe_worker_operations_per_second",
+    "Database operations written per second",
+    ["worker"],
+)
+WORKER_WRITE_LATENCY = Gauge(
+    "scribe_worker_write_latency_seconds",
+    "Mean time spent writing a batch",
+    ["worker"],
+)
+
+
+class WorkerStats:
+    """
+    Throughput counters written by a worker process and read by the supervisor
+
+    The counters live in shared memory, so they survive the restart of the
+    worker that owns them.
+    """
+
+    fields = ("messages", "operations", "write_seconds", "writes")
+
+    def __init__(self):
+        self.values = multiprocessing.Array("d", len(self.fields))
+
+    def record(self, n_messages: int, n_operations: int, write_seconds: float):
+        with self.values.get_lock():
+            self.values[0] += n_messages
+            self.values[1] += n_operations
+            self.values[2] += write_seconds
+            self.values[3] += 1 if n_operations else 0
+
+    def snapshot(self) -> dict:
+        with self.values.get_lock():
+            return dict(zip(self.fields, self.values[:]))
+
+
+class WorkerShutdown(BaseException):
+    """
+    Raised in a worker process when the supervisor asks it to stop
+    """
+
+
+def _shutdown(signum, frame):
+    raise WorkerShutdown()
+
+
+def _run_worker(target, idx, stats, cpu):
+    # The supervisor handles SIGINT and asks the workers to stop with
+    # SIGTERM. Targets can install their own handler to stop at a safe point
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+    try:
+        target(idx, stats)
+    except WorkerShutdown:
+        logging.info(f"Worker {idx} stopped")
+
+
+class WorkerSupervisor:
+    """
+    Runs `n_workers` processes executing `target(idx, stats)` and restarts
+    them when they die
+
+    Workers that exit with an error are restarted after an exponential
+    backoff, which is reset once the worker runs for `healthy_after` seconds.
+    Workers that exit cleanly are not restarted.
+
+    Every `interval` seconds the supervisor reads the `WorkerStats` of each
+    worker and publishes messages and operations per second, and the mean
+    write latency, per worker and for the whole pool.
+
+    Parameters
+    ----------
+    target : callable
+        Worker entry point. Receives the worker index and its `WorkerStats`.
+    n_workers : int
+        Number of worker processes.
+    cpus : list of int, optional
+        CPUs to pin the workers to, assigned round-robin.
+    backoff : float
+        Seconds to wait before the first restart of a worker.
+    max_backoff : float
+        Maximum seconds to wait before restarting a worker.
+    healthy_after : float
+        Seconds a worker must run before its backoff is reset.
+    metrics_port : int, optional
+        Port for the Prometheus endpoint. No endpoint is started when `None`.
+    interval : float
+        Seconds between throughput reports.
+    shutdown_timeout : float
+        Seconds to wait for the workers to stop after SIGTERM before killing
+        them.
+    """
+
+    def __init__(
+        self,
+        target: Callable,
+        n_workers: int,
+        cpus: Optional[List[int]] = None,
+        backoff: float = 1,
+        max_backoff: float = 60,
+        healthy_after: float = 60,
+        metrics_port: Optional[int] = None,
+        interval: float = 5,
+        shutdown_timeout: float = 30,
+    ):
+        self.target = target
+        self.n_workers = n_workers
+        self.cpus = cpus
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.healthy_after = healthy_after
+        self.metrics_port = metrics_port
+        self.interval = interval
+        self.shutdown_timeout = shutdown_timeout
+
+        self.stats = [WorkerStats() for _ in range(n_workers)]
+        self.processes = [None] * n_workers
+        self.started_at = [0.0] * n_workers
+        self.failures = [0] * n_workers
+        self.restart_at = [None] * n_workers
+        self.finished = [False] * n_workers
+        self._last = [stats.snapshot() for stats in self.stats]
+        self._running = False
+
+    def _cpu(self, idx: int) -> Optional[int]:
+        if not self.cpus:
+            return None
+        return self.cpus[idx % len(self.cpus)]
+
+    def _start(self, idx: int):
+        process = multiprocessing.Process(
+            target=_run_worker,
+            args=(self.target, idx, self.stats[idx], self._cpu(idx)),
+        )
+        process.start()
+        self.processes[idx] = process
+        self.started_at[idx] = time.monotonic()
+        self.restart_at[idx] = None
+        logging.info(f"Started worker {idx} (pid {process.pid})")
+
+    def _check(self, idx: int):
+        process = self.processes[idx]
+        now = time.monotonic()
+        if self.restart_at[idx] is not None:
+            if now >= self.restart_at[idx]:
+                WORKER_RESTARTS.labels(worker=str(idx)).inc()
+                self._start(idx)
+            return
+        if self.finished[idx] or process.is_alive():
+            return
+        if process.exitcode == 0:
+            logging.info(f"Worker {idx} finished")
+            self.finished[idx] = True
+            return
+
+        if now - self.started_at[idx] >= self.healthy_after:
+            self.failures[idx] = 0
+        delay = min(self.backoff * 2 ** self.failures[idx], self.max_backoff)
+        self.failures[idx] += 1
+        self.restart_at[idx] = now + delay
+        logging.error(
+            f"Worker {idx} died with exit code {process.exitcode}. "
+            f"Restarting in {delay} seconds"
+        )
+
+    def _report(self, elapsed: float):
+        totals = dict.fromkeys(WorkerStats.fields, 0.0)
+        for idx, stats in enumerate(self.stats):
+            current = stats.snapshot()
+            delta = {
+                field: current[field] - self._last[idx][field]
+                for field in WorkerStats.fields
+            }
+            self._last[idx] = current
+            for field in WorkerStats.fields:
+                totals[field] += delta[field]
+            self._publish(str(idx), delta, elapsed)
+        self._publish("all", totals, elapsed)
+        logging.info(
+            f"Pool throughput: {totals['messages'] / elapsed:.1f} messages/s, "
+            f"{totals['operations'] / elapsed:.1f} operations/s"
+        )
+
+    def _publish(self, worker: str, delta: dict, elapsed: float):
+        WORKER_MESSAGES_RATE.labels(worker=worker).set(
+            delta["messages"] / elapsed
+        )
+        WORKER_OPERATIONS_RATE.labels(worker=worker).set(
+            delta["operations"] / elapsed
+        )
+        if delta["writes"]:
+            WORKER_WRITE_LATENCY.labels(worker=worker).set(
+                delta["write_seconds"] / delta["writes"]
+            )
+
+    def stop(self, *args):
+        self._running = False
+
+    def run(self):
+        """
+        Starts the workers and supervises them until all of them finish or
+        the supervisor receives SIGTERM/SIGINT
+        """
+        if self.metrics_port is not None:
+            start_http_server(self.metrics_port)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for idx in range(self.n_workers):
+            self._start(idx)
+
+        self._running = True
+        last_report = time.monotonic()
+        while self._running and not all(self.finished):
+            time.sleep(min(1, self.interval))
+            for idx in range(self.n_workers):
+                self._check(idx)
+            now = time.monotonic()
+            if now - last_report >= self.interval:
+                self._report(now - last_report)
+                last_report = now
+
+        self.shutdown()
+
+    def shutdown(self):
+        """
+        Sends SIGTERM to the workers so they stop after their current batch,
+        and kills those still running after `shutdown_timeout` seconds
+        """
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for idx, process in enumerate(self.processes):
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logging.warning(
+                    f"Worker {idx} didn't stop in time, killing it"
+                )
+                process.kill()
+                process.join()
@@ -0,0 +1,127 @@
+import json
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    def __init__(self, trace: "BatchTrace", name: str, args: dict):
+        self.trace = trace
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter_ns()
+        self.trace.add(self.name, self.start, end, self.args)
+        return False
+
+
+class BatchTrace:
+    """
+    Spans recorded while processing a single sampled batch
+    """
+
+    def __init__(self):
+        self.events = []
+        self.tid = threading.get_ident()
+
+    def span(self, name: str, **args) -> Span:
+        return Span(self, name, args)
+
+    def add(self, name: str, start: int, end: int, args: dict):
+        self.events.append(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": start / 1000,
+                "dur": (end - start) / 1000,
+                "tid": self.tid,
+                "args": args,
+            }
+        )
+
+
+class Tracer:
+    """
+    Records spans for a random sample of batches
+
+    Spans are written in the Chrome trace event format (JSON array), which
+    can be opened with Perfetto or `chrome://tracing`. Events are appended at
+    the end of each sampled batch, so the array is never closed, which is
+    allowed by the format.
+
+    The `path` can contain `{pid}`, so that each process writes its own file.
+    When a batch isn't sampled, `batch` is `None` and `span` returns a shared
+    no-op span, so nothing is recorded or allocated.
+
+    Parameters
+    ----------
+    path : str
+        File where the traces are written.
+    sample_rate : float
+        Fraction of batches to trace, between 0 and 1.
+    """
+
+    def __init__(self, path: str, sample_rate: float):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.batch: Optional[BatchTrace] = None
+        self._file = None
+        self._start = 0
+
+    def start_batch(self) -> Optional[BatchTrace]:
+        if random.random() < self.sample_rate:
+            self.batch = BatchTrace()
+            self._start = time.perf_counter_ns()
+        else:
+            self.batch = None
+        return self.batch
+
+    def end_batch(self, **args):
+        """
+        Writes the spans of the current batch, if it was sampled
+        """
+        if self.batch is None:
+            return
+        self.batch.add("batch", self._start, time.perf_counter_ns(), args)
+        self._write(self.batch.events)
+        self.batch = None
+
+    def span(self, name: str, **args):
+        if self.batch is None:
+            return NULL_SPAN
+        return self.batch.span(name, **args)
+
+    def _write(self, events: list):
+        if self._file is None:
+            self._file = open(self.path.format(pid=os.getpid()), "a")
+            if self._file.tell() == 0:
+                self._file.write("[\n")
+        pid = os.getpid()
+        for event in events:
+            event["pid"] = pid
+            self._file.write(json.dumps(event, default=str) + ",\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,125 @@
+"""
+Compares the compression ratio of each payload codec with the decode
+throughput of the scribe (decompression, JSON parsing and validation).
+
+Usage: python scripts/benchmark_compression.py [--messages N] [--features N]
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from base64 import b64encode
+
+SCRIPT_PATH = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_PATH = os.path.abspath(os.path.join(SCRIPT_PATH, ".."))
+sys.path.append(PACKAGE_PATH)
+
+from mongo_scribe.command.decode import db_commands_factory
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+CLASSES = ["SNIa", "SNIbc", "SNII", "SLSN", "QSO", "AGN", "Blazar", "CV/Nova"]
+
+
+def features_payload(idx: int, n_features: int) -> str:
+    features = [
+        {
+            "name": f"feature_{i}",
+            "value": random.gauss(0, 1) if i % 7 else None,
+            "fid": i % 3,
+        }
+        for i in range(n_features)
+    ]
+    return json.dumps(
+        {
+            "collection": "object",
+            "type": "update_features",
+            "criteria": {"_id": f"AL{idx:010d}"},
+            "data": {
+                "features_version": "lc_classifier_1.2.1-P",
+                "features_group": "ztf_features",
+                "features": features,
+            },
+            "options": {"upsert": True},
+        }
+    )
+
+
+def probabilities_payload(idx: int) -> str:
+    probabilities = [random.random() for _ in CLASSES]
+    total = sum(probabilities)
+    data = {
+        "classifier_name": "lc_classifier",
+        "classifier_version": "1.1.13",
+        **{name: p / total for name, p in zip(CLASSES, probabilities)},
+    }
+    return json.dumps(
+        {
+            "collection": "object",
+            "type": "update_probabilities",
+            "criteria": {"_id": f"AL{idx:010d}"},
+            "data": data,
+            "options": {"upsert": True},
+        }
+    )
+
+
+def codecs():
+    yield "none", lambda raw: raw.decode()
+    yield "gzip-6", lambda raw: gzip.compress(raw, 6)
+    if zstandard is not None:
+        for level in (1, 3, 9):
+            compressor = zstandard.ZstdCompressor(level=level)
+            yield f"zstd-{level}", compressor.compress
+        compressor = zstandard.ZstdCompressor(level=3)
+        yield "zstd-3-base64", lambda raw: "zstd:" + b64encode(
+            compressor.compress(raw)
+        ).decode()
+    if lz4 is not None:
+        yield "lz4", lz4.frame.compress
+
+
+def run(name: str, payloads: list):
+    raw = [payload.encode() for payload in payloads]
+    raw_size = sum(len(payload) for payload in raw)
+    print(f"\n{name}: {len(raw)} messages, {raw_size / len(raw):.0f} B each")
+    print(f"{'codec':<16}{'ratio':>8}{'msg/s':>12}{'MB/s (raw)':>12}")
+    for codec, compress in codecs():
+        messages = [compress(payload) for payload in raw]
+        size = sum(len(message) for message in messages)
+        start = time.perf_counter()
+        for message in messages:
+            db_commands_factory(message)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{codec:<16}{raw_size / size:>8.2f}"
+            f"{len(messages) / elapsed:>12.0f}"
+            f"{raw_size / elapsed / 1e6:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--features", type=int, default=150)
+    args = parser.parse_args()
+    random.seed(0)
+    run(
+        "update_features",
+        [features_payload(i, args.features) for i in range(args.messages)],
+    )
+    run(
+        "update_probabilities",
+        [probabilities_payload(i) for i in range(args.messages)],
+    )
@@ -0,0 +1,109 @@
+"""
+Compares the latency of bulk writes sent in arrival order with the same
+writes sorted by document key (the SORT_KEYS option of the executor).
+Writes are ordered, as the executor sends them, and sorted within windows
+of `--window` operations (SORT_WINDOW).
+
+It needs a MongoDB server, and drops the database it writes to. The effect
+grows with the size of the collection relative to the WiredTiger cache, so
+use enough documents that the index doesn't fit in memory. With
+`--mongomock`, it runs against an in-memory mongomock database instead,
+which checks the script but says nothing about the latency of MongoDB
+(mongomock 4.3 needs pymongo < 4.11, whose UpdateOne has no `sort`).
+
+Usage: python scripts/benchmark_sorted_writes.py [--uri URI] [--database DB]
+    [--documents N] [--batches N] [--batch-size N] [--window N] [--mongomock]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+from pymongo import MongoClient, UpdateOne
+
+SCRIPT_PATH = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_PATH = os.path.abspath(os.path.join(SCRIPT_PATH, ".."))
+sys.path.append(PACKAGE_PATH)
+
+from mongo_scribe.db.routing import sort_by_key
+
+
+def aid(idx: int) -> str:
+    return f"AL{idx:012d}"
+
+
+def load(collection, documents: int):
+    collection.drop()
+    batch = []
+    for idx in random.sample(range(documents), documents):
+        batch.append({"_id": aid(idx), "ndet": 1, "meanra": random.random()})
+        if len(batch) == 10000:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+
+
+def batches(documents: int, n_batches: int, batch_size: int):
+    for _ in range(n_batches):
+        yield [
+            UpdateOne(
+                {"_id": aid(random.randrange(documents))},
+                {"$inc": {"ndet": 1}, "$set": {"meanra": random.random()}},
+                upsert=True,
+            )
+            for _ in range(batch_size)
+        ]
+
+
+def run(collection, name: str, operations: list, window: int):
+    latencies, sorting = [], 0.0
+    for batch in operations:
+        start = time.perf_counter()
+        if window:
+            batch = list(sort_by_key(batch, ["_id"], window))
+        sorted_at = time.perf_counter()
+        collection.bulk_write(batch)
+        end = time.perf_counter()
+        sorting += sorted_at - start
+        latencies.append(end - start)
+    latencies.sort()
+    print(
+        f"{name:<10}{statistics.median(latencies) * 1000:>10.1f}"
+        f"{latencies[int(len(latencies) * 0.99)] * 1000:>10.1f}"
+        f"{sum(latencies):>10.2f}{sorting * 1000:>12.1f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="scribe_benchmark")
+    parser.add_argument("--documents", type=int, default=2_000_000)
+    parser.add_argument("--batches", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--window", type=int, default=10000)
+    parser.add_argument("--mongomock", action="store_true")
+    args = parser.parse_args()
+    random.seed(0)
+    if args.mongomock:
+        import mongomock
+
+        client = mongomock.MongoClient()
+    else:
+        client = MongoClient(args.uri)
+    collection = client[args.database]["object"]
+    print(f"Loading {args.documents} documents...")
+    load(collection, args.documents)
+    operations = list(batches(args.documents, args.batches, args.batch_size))
+    print(
+        f"{'order':<10}{'p50 ms':>10}{'p99 ms':>10}{'total s':>10}"
+        f"{'sorting ms':>12}"
+    )
+    # Alternate the runs, so both see a similarly warm cache
+    for _ in range(2):
+        run(collection, "arrival", operations, window=0)
+        run(collection, "sorted", operations, window=args.window)
+    client.drop_database(args.database)
@@ -1,8 +1,8 @@
 import os
+import signal
 import sys
 
 import logging
-from multiprocessing import Process
 
 SCRIPT_PATH = os.path.dirname(os.path.abspath(__file__))
 PACKAGE_PATH = os.path.abspath(os.path.join(SCRIPT_PATH, ".."))
@@ -21,6 +21,7 @@ logging.basicConfig(
 )
 
 from mongo_scribe import MongoScribe
+from mongo_scribe.supervisor import WorkerShutdown, WorkerSupervisor
 from apf.core import get_class
 
 if "CLASS" in CONSUMER_CONFIG:
@@ -29,18 +30,65 @@ else:
     from apf.consumers import KafkaConsumer as Consumer
 
 n_process = STEP_CONFIG.get("N_PROCESS", 1)
+partition_by_key = STEP_CONFIG.get("PARTITION_BY_KEY", False)
+supervisor_config = STEP_CONFIG.get("SUPERVISOR_CONFIG", {})
 
 
-def create_and_run(idx, Consumer):
+def run(step):
+    """
+    Runs the step until it finishes or the supervisor stops it, flushing
+    and committing what was written before exiting
+    """
+    signal.signal(signal.SIGTERM, step.stop)
+    try:
+        step.start()
+    except WorkerShutdown:
+        step.tear_down()
+        raise
+
+
+def create_and_run(idx, stats):
     CONSUMER_CONFIG["ID"] = idx
     consumer = Consumer(config=CONSUMER_CONFIG)
-    step = MongoScribe(consumer, config=STEP_CONFIG, level=level)
-    step.start()
+    step = MongoScribe(consumer, config=STEP_CONFIG, stats=stats)
+    run(step)
+
+
+def run_partitioned(idx, stats):
+    """
+    A single consumer decodes the messages and sends the commands to
+    `n_process` writers, partitioned by document key
+    """
+    from mongo_scribe.db.partition import PartitionedCommandExecutor
+
+    executor = PartitionedCommandExecutor(
+        STEP_CONFIG["DB_CONFIG"],
+        n_process,
+        key_fields=tuple(STEP_CONFIG.get("PARTITION_KEYS", ("_id", "aid"))),
+    )
+    consumer = Consumer(config=CONSUMER_CONFIG)
+    step = MongoScribe(
+        consumer, config=STEP_CONFIG, db_client=executor, stats=stats
+    )
+    try:
+        run(step)
+    finally:
+        executor.close()
 
 
-process_list = []
-for i in range(n_process):
-    process_list.append(Process(target=create_and_run, args=(i, Consumer)))
+if partition_by_key:
+    # The reader is the only supervised process, it manages its own writers
+    target, n_supervised = run_partitioned, 1
+else:
+    target, n_supervised = create_and_run, n_process
 
-[p.start() for p in process_list]
-[p.join() for p in process_list]
+supervisor = WorkerSupervisor(
+    target,
+    n_supervised,
+    cpus=supervisor_config.get("CPUS"),
+    backoff=supervisor_config.get("RESTART_BACKOFF", 1),
+    max_backoff=supervisor_config.get("MAX_RESTART_BACKOFF", 60),
+    metrics_port=supervisor_config.get("METRICS_PORT"),
+    shutdown_timeout=supervisor_config.get("SHUTDOWN_TIMEOUT", 30),
+)
+supervisor.run()
@@ -27,9 +27,112 @@ if os.getenv("KAFKA_USERNAME") and os.getenv("KAFKA_PASSWORD"):
     CONSUMER_CONFIG["PARAMS"]["sasl.password"] = os.getenv("KAFKA_PASSWORD")
 
 DB_CONFIG = {
-    "MONGO": get_mongodb_credentials()
+    "MONGO": get_mongodb_credentials(),
+    "CHUNK_SIZE": int(os.getenv("CHUNK_SIZE", "1000")),
+    "CLIENT_OPTIONS": {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "serverSelectionTimeoutMS": int(
+            os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000")
+        ),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "20000")),
+        "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0")) or None,
+    },
 }
 
+if os.getenv("WRITE_BEHIND_COLLECTIONS"):
+    DB_CONFIG["WRITE_BEHIND"] = {
+        "COLLECTIONS": os.getenv("WRITE_BEHIND_COLLECTIONS").split(","),
+        "MAX_SIZE": int(os.getenv("WRITE_BEHIND_MAX_SIZE", "10000")),
+        "MAX_AGE": float(os.getenv("WRITE_BEHIND_MAX_AGE", "5")),
+    }
+
+if os.getenv("NOOP_CACHE_MAX_DOCUMENTS"):
+    DB_CONFIG["NOOP_CACHE"] = {
+        "MAX_DOCUMENTS": int(os.getenv("NOOP_CACHE_MAX_DOCUMENTS")),
+    }
+
+# The indexes needed by the filters of the commands are checked (and
+# created, with CREATE_INDEXES) when first written. REQUIRED_INDEXES adds
+# others, e.g. "object:probabilities.classifier_name;detection:aid,mjd"
+if any(
+    os.getenv(name)
+    for name in (
+        "CHECK_INDEXES",
+        "CREATE_INDEXES",
+        "REQUIRED_INDEXES",
+        "EXPLAIN_SAMPLE_RATE",
+    )
+):
+    required_indexes = {}
+    for index in os.getenv("REQUIRED_INDEXES", "").split(";"):
+        if index:
+            collection, fields = index.split(":")
+            required_indexes.setdefault(collection, []).append(fields.split(","))
+    DB_CONFIG["INDEXES"] = {
+        "REQUIRED": required_indexes,
+        "CREATE": os.getenv("CREATE_INDEXES", "").lower() == "true",
+        "EXPLAIN_SAMPLE_RATE": float(os.getenv("EXPLAIN_SAMPLE_RATE", "0")),
+    }
+
+# Fields to sort the writes of each collection by, or to route them by shard
+# key, e.g. "object:_id;detection:aid,candid"
+for name in ("SHARD_KEYS", "SORT_KEYS"):
+    if os.getenv(name):
+        DB_CONFIG[name] = {
+            collection: fields.split(",")
+            for collection, fields in (
+                item.split(":") for item in os.getenv(name).split(";") if item
+            )
+        }
+
+if os.getenv("SORT_WINDOW"):
+    DB_CONFIG["SORT_WINDOW"] = int(os.getenv("SORT_WINDOW"))
+
+if os.getenv("WRITE_PROFILES"):
+    # e.g. "rebuildable:non_detection,forced_photometry;durable:object", with
+    # the options of each profile in WRITE_PROFILE_<NAME>_<OPTION>
+    DB_CONFIG["WRITE_PROFILES"] = {}
+    for profile in os.getenv("WRITE_PROFILES").split(";"):
+        if not profile:
+            continue
+        name, collections = profile.split(":")
+        prefix = f"WRITE_PROFILE_{name.upper()}_"
+        w = os.getenv(prefix + "W")
+        j = os.getenv(prefix + "J")
+        wtimeout = os.getenv(prefix + "WTIMEOUT")
+        chunk_size = os.getenv(prefix + "CHUNK_SIZE")
+        DB_CONFIG["WRITE_PROFILES"][name] = {
+            "COLLECTIONS": collections.split(","),
+            "W": int(w) if w and w.isdigit() else w,
+            "J": j.lower() == "true" if j else None,
+            "WTIMEOUT": int(wtimeout) if wtimeout else None,
+            "ORDERED": os.getenv(prefix + "ORDERED", "true").lower() == "true",
+            "BYPASS_DOCUMENT_VALIDATION": os.getenv(
+                prefix + "BYPASS_DOCUMENT_VALIDATION", "false"
+            ).lower()
+            == "true",
+            "CHUNK_SIZE": int(chunk_size) if chunk_size else None,
+        }
+
+if os.getenv("BUCKET_COLLECTIONS"):
+    DB_CONFIG["BUCKETS"] = {
+        "COLLECTIONS": os.getenv("BUCKET_COLLECTIONS").split(","),
+        "MAX_SIZE": int(os.getenv("BUCKET_MAX_SIZE", "100")),
+        "WINDOW": float(os.getenv("BUCKET_WINDOW", "30")),
+    }
+
+if os.getenv("JOURNAL_DIR"):
+    DB_CONFIG["JOURNAL"] = {
+        "DIRECTORY": os.getenv("JOURNAL_DIR"),
+        "SEGMENT_SIZE": int(os.getenv("JOURNAL_SEGMENT_SIZE", "67108864")),
+        "MAX_BACKLOG": int(os.getenv("JOURNAL_MAX_BACKLOG", "1073741824")),
+        "FSYNC": os.getenv("JOURNAL_FSYNC", "true").lower() == "true",
+    }
+
+if os.getenv("MONGO_COMPRESSORS"):
+    DB_CONFIG["CLIENT_OPTIONS"]["compressors"] = os.getenv("MONGO_COMPRESSORS")
+
 METRICS_CONFIG = {
     "CLASS": "apf.metrics.KafkaMetricsProducer",
     "PARAMS": {
@@ -93,5 +196,48 @@ STEP_CONFIG = {
     "RETRIES": int(os.getenv("RETRIES", "3")),
     "RETRY_INTERVAL": int(os.getenv("RETRY_INTERVAL", "1")),
     "USE_PROFILING": bool(os.getenv("USE_PROFILING", True)),
-    "PYROSCOPE_SERVER": os.getenv("PYROSCOPE_SERVER", "http://pyroscope.pyroscope:4040")
+    "PYROSCOPE_SERVER": os.getenv("PYROSCOPE_SERVER", "http://pyroscope.pyroscope:4040"),
+    "N_PROCESS": int(os.getenv("N_PROCESS", "1")),
+    "MAX_PAYLOAD_SIZE": int(os.getenv("MAX_PAYLOAD_SIZE", "67108864")),
+    "PARTITION_BY_KEY": os.getenv("PARTITION_BY_KEY", "").lower() == "true",
+    "PARTITION_KEYS": os.getenv("PARTITION_KEYS", "_id,aid").split(","),
+    "TRACING": {
+        "PATH": os.getenv("TRACE_FILE", "scribe-trace-{pid}.json"),
+        "SAMPLE_RATE": float(os.getenv("TRACE_SAMPLE_RATE", "0")),
+    },
+    "BATCH_PROFILING": {
+        "OUTPUT_DIR": os.getenv("PROFILE_DIR", "profiles"),
+        "BATCHES": int(os.getenv("PROFILE_BATCHES", "10")),
+        "ON_START": os.getenv("PROFILE_ON_START", "").lower() == "true",
+    },
+    "SUPERVISOR_CONFIG": {
+        "CPUS": [
+            int(cpu) for cpu in os.getenv("WORKER_CPUS", "").split(",") if cpu
+        ],
+        "RESTART_BACKOFF": float(os.getenv("RESTART_BACKOFF", "1")),
+        "MAX_RESTART_BACKOFF": float(os.getenv("MAX_RESTART_BACKOFF", "60")),
+        "METRICS_PORT": int(os.getenv("METRICS_PORT", "8000")),
+        "SHUTDOWN_TIMEOUT": float(os.getenv("SHUTDOWN_TIMEOUT", "30")),
+    },
 }
+
+if os.getenv("CIRCUIT_BREAKER"):
+    STEP_CONFIG["CIRCUIT_BREAKER"] = {
+        "WINDOW": int(os.getenv("BREAKER_WINDOW", "20")),
+        "MIN_CALLS": int(os.getenv("BREAKER_MIN_CALLS", "5")),
+        "ERROR_RATE": float(os.getenv("BREAKER_ERROR_RATE", "0.5")),
+        "SLOW_CALL": float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "10")),
+        "OPEN_TIME": float(os.getenv("BREAKER_OPEN_SECONDS", "5")),
+        "MAX_OPEN_TIME": float(os.getenv("BREAKER_MAX_OPEN_SECONDS", "120")),
+    }
+
+if os.getenv("DEDUP_MAX_ENTRIES"):
+    STEP_CONFIG["DEDUPLICATION"] = {
+        "MAX_ENTRIES": int(os.getenv("DEDUP_MAX_ENTRIES")),
+        "TTL": float(os.getenv("DEDUP_TTL", "3600")),
+        "EXEMPT_TYPES": [
+            command_type
+            for command_type in os.getenv("DEDUP_EXEMPT_TYPES", "").split(",")
+            if command_type
+        ],
+    }
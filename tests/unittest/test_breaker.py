@@ -0,0 +1,70 @@
+import unittest
+from unittest import mock
+
+from mongo_scribe.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        patcher = mock.patch(
+            "mongo_scribe.breaker.time.monotonic", lambda: self.now
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(
+            window=4,
+            min_calls=2,
+            error_rate=0.5,
+            slow_call=1,
+            open_time=5,
+            max_open_time=8,
+        )
+
+    def test_opens_when_error_rate_is_reached(self):
+        self.breaker.record(0.1)
+        self.breaker.record(0.1)
+        self.breaker.record(0.1, failed=True)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.record(0.1, failed=True)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.remaining(), 5)
+
+    def test_slow_writes_count_as_failures(self):
+        self.breaker.record(2)
+        self.breaker.record(2)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_successful_probe_closes_circuit(self):
+        self.breaker.record(0, failed=True)
+        self.breaker.record(0, failed=True)
+        self.now = 5
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.breaker.record(0.1)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.record(0, failed=True)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_failed_probe_reopens_for_longer(self):
+        self.breaker.record(0, failed=True)
+        self.breaker.record(0, failed=True)
+        self.now = 5
+        self.breaker.allow()
+        self.breaker.record(0, failed=True)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.remaining(), 8)
+        self.now = 13
+        self.assertTrue(self.breaker.allow())
+
+    def test_state_changes_are_reported(self):
+        on_change = mock.MagicMock()
+        self.breaker.on_change = on_change
+        self.breaker.record(0, failed=True)
+        self.breaker.record(0, failed=True)
+        self.now = 5
+        self.breaker.allow()
+        self.assertEqual(
+            on_change.call_args_list, [mock.call(OPEN), mock.call(HALF_OPEN)]
+        )
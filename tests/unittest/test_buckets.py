@@ -0,0 +1,82 @@
+import unittest
+from unittest import mock
+
+from pymongo import InsertOne, UpdateOne
+
+from mongo_scribe.db.buckets import BucketStrategy, flatten_buckets
+from mongo_scribe.db.executor import ScribeCommandExecutor
+from mongo_scribe.command.commands import InsertCommand
+
+
+class TestBucketStrategy(unittest.TestCase):
+    def setUp(self):
+        self.buckets = BucketStrategy(["detection"], max_size=2, window=30)
+
+    def test_entries_are_pushed_into_buckets(self):
+        entry = {"_id": 1, "aid": "AL1", "mjd": 60001.5}
+        self.assertEqual(
+            self.buckets.operation(entry),
+            UpdateOne(
+                {"aid": "AL1", "window": 2000, "count": {"$lt": 2}},
+                {
+                    "$push": {"entries": entry},
+                    "$inc": {"count": 1},
+                    "$min": {"first": 60001.5},
+                    "$max": {"last": 60001.5},
+                },
+                upsert=True,
+            ),
+        )
+
+    def test_entries_without_object_or_time_are_inserted(self):
+        entry = {"_id": 1, "aid": "AL1"}
+        self.assertEqual(self.buckets.operation(entry), InsertOne(entry))
+
+    def test_find_reads_entries_between_times(self):
+        collection = mock.MagicMock()
+        collection.find.return_value = [
+            {"entries": [{"_id": 2, "mjd": 20}, {"_id": 3, "mjd": 30}]},
+            {"entries": [{"_id": 1, "mjd": 10}]},
+        ]
+        entries = self.buckets.find(collection, "AL1", since=15)
+        collection.find.assert_called_once_with(
+            {"aid": "AL1", "last": {"$gte": 15}}
+        )
+        self.assertEqual([entry["_id"] for entry in entries], [2, 3])
+
+
+class TestFlattenBuckets(unittest.TestCase):
+    def test_entries_are_sorted_and_deduplicated(self):
+        documents = [
+            {"entries": [{"_id": 2, "mjd": 2}, {"_id": 1, "mjd": 1}]},
+            {"entries": [{"_id": 2, "mjd": 2}]},
+            {"_id": 3, "mjd": 3},
+        ]
+        self.assertEqual(
+            flatten_buckets(documents),
+            [{"_id": 1, "mjd": 1}, {"_id": 2, "mjd": 2}, {"_id": 3, "mjd": 3}],
+        )
+
+
+class TestExecutorBuckets(unittest.TestCase):
+    def test_inserts_of_bucketed_collections_are_bucketed(self):
+        executor = ScribeCommandExecutor(
+            {"MONGO": {}, "BUCKETS": {"COLLECTIONS": ["detection"]}}
+        )
+        executor.connection = mock.MagicMock()
+        executor.bulk_execute(
+            [
+                InsertCommand("detection", {"aid": "AL1", "mjd": 1}),
+                InsertCommand("object", {"_id": "AL1"}),
+            ]
+        )
+        database = executor.connection.database
+        written = {
+            name.args[0]: write.args[0][0]
+            for name, write in zip(
+                database.__getitem__.call_args_list,
+                database.__getitem__.return_value.bulk_write.call_args_list,
+            )
+        }
+        self.assertIsInstance(written["detection"], UpdateOne)
+        self.assertIsInstance(written["object"], InsertOne)
@@ -0,0 +1,184 @@
+import unittest
+from unittest import mock
+
+from pymongo.errors import ConnectionFailure
+
+from mongo_scribe.db.buffer import WriteBehindBuffer
+from mongo_scribe.db.executor import ScribeCommandExecutor
+from mongo_scribe.command.commands import (
+    InsertCommand,
+    UpdateCommand,
+    UpdateProbabilitiesCommand,
+)
+
+from mockdata import valid_probabilities_dict
+
+
+class TestWriteBehindBuffer(unittest.TestCase):
+    def setUp(self):
+        self.buffer = WriteBehindBuffer(["object"], max_size=2, max_age=60)
+
+    def test_accepts_only_updates_on_configured_collections(self):
+        self.assertTrue(
+            self.buffer.accepts(UpdateCommand("object", {"a": 1}, {"_id": 1}))
+        )
+        self.assertFalse(
+            self.buffer.accepts(
+                UpdateCommand("detection", {"a": 1}, {"_id": 1})
+            )
+        )
+        self.assertFalse(
+            self.buffer.accepts(InsertCommand("object", {"a": 1}))
+        )
+        self.assertFalse(
+            self.buffer.accepts(
+                UpdateProbabilitiesCommand(
+                    "object",
+                    valid_probabilities_dict["data"].copy(),
+                    valid_probabilities_dict["criteria"],
+                )
+            )
+        )
+
+    def test_set_updates_are_merged_with_last_value(self):
+        first = UpdateCommand("object", {"a": 1, "b": 1}, {"_id": "AID1"})
+        first.timestamp = 10
+        second = UpdateCommand("object", {"b": 2}, {"_id": "AID1"})
+        second.timestamp = 20
+        self.buffer.add(first)
+        self.buffer.add(second)
+
+        commands = self.buffer.drain()
+        self.assertEqual(len(commands), 1)
+        self.assertEqual(commands[0].data, {"a": 1, "b": 2})
+        self.assertEqual(commands[0].timestamp, 10)
+
+    def test_set_on_insert_updates_keep_first_value(self):
+        options = {"set_on_insert": True}
+        self.buffer.add(
+            UpdateCommand("object", {"a": 1}, {"_id": "AID1"}, options)
+        )
+        self.buffer.add(
+            UpdateCommand("object", {"a": 2, "b": 2}, {"_id": "AID1"}, options)
+        )
+        self.assertEqual(self.buffer.drain()[0].data, {"a": 1, "b": 2})
+
+    def test_different_options_are_not_merged(self):
+        self.buffer.add(UpdateCommand("object", {"a": 1}, {"_id": "AID1"}))
+        self.buffer.add(
+            UpdateCommand(
+                "object", {"a": 2}, {"_id": "AID1"}, {"upsert": True}
+            )
+        )
+        self.assertEqual(len(self.buffer), 2)
+
+    def test_updates_with_mixed_options_keep_their_order(self):
+        for value, upsert in ((1, False), (2, True), (3, False)):
+            self.buffer.add(
+                UpdateCommand(
+                    "object", {"x": value}, {"_id": "A"}, {"upsert": upsert}
+                )
+            )
+        self.buffer.add(UpdateCommand("object", {"y": 1}, {"_id": "A"}))
+        self.assertEqual(
+            [command.data for command in self.buffer.drain()],
+            [{"x": 1}, {"x": 2}, {"x": 3, "y": 1}],
+        )
+
+    def test_should_flush_on_size(self):
+        self.buffer.add(UpdateCommand("object", {"a": 1}, {"_id": "AID1"}))
+        self.assertFalse(self.buffer.should_flush())
+        self.buffer.add(UpdateCommand("object", {"a": 1}, {"_id": "AID2"}))
+        self.assertTrue(self.buffer.should_flush())
+
+    def test_should_flush_on_age(self):
+        self.buffer.add(UpdateCommand("object", {"a": 1}, {"_id": "AID1"}))
+        with mock.patch("mongo_scribe.db.buffer.time") as time:
+            time.monotonic.return_value = self.buffer.oldest + 61
+            self.assertTrue(self.buffer.should_flush())
+
+
+class TestExecutorWithBuffer(unittest.TestCase):
+    def setUp(self):
+        self.executor = ScribeCommandExecutor(
+            {
+                "MONGO": {},
+                "WRITE_BEHIND": {
+                    "COLLECTIONS": ["object"],
+                    "MAX_SIZE": 10,
+                    "MAX_AGE": 60,
+                },
+            }
+        )
+        self.executor.connection = mock.MagicMock()
+        self.bulk_write = (
+            self.executor.connection.database.__getitem__.return_value.bulk_write
+        )
+
+    def test_buffered_updates_are_not_written(self):
+        self.executor.bulk_execute(
+            [UpdateCommand("object", {"a": 1}, {"_id": "AID1"})]
+        )
+        self.bulk_write.assert_not_called()
+        self.assertTrue(self.executor.has_pending_writes())
+
+        self.executor.flush()
+        self.bulk_write.assert_called_once()
+        self.assertFalse(self.executor.has_pending_writes())
+
+    def test_pending_updates_are_flushed_before_other_commands(self):
+        probabilities = UpdateProbabilitiesCommand(
+            "object",
+            valid_probabilities_dict["data"].copy(),
+            valid_probabilities_dict["criteria"],
+        )
+        self.executor.bulk_execute(
+            [
+                UpdateCommand("object", {"a": 1}, {"_id": "AID51423"}),
+                UpdateCommand("object", {"a": 2}, {"_id": "AID2"}),
+                probabilities,
+                UpdateCommand("object", {"a": 3}, {"_id": "AID51423"}),
+            ]
+        )
+        self.assertEqual(self.bulk_write.call_count, 2)
+        flushed, direct = [
+            call.args[0] for call in self.bulk_write.call_args_list
+        ]
+        self.assertEqual(len(flushed), 2)
+        self.assertEqual(len(direct), len(probabilities.get_operations()))
+        self.assertEqual(len(self.executor.buffer), 1)
+
+    def test_preceding_commands_are_written_before_pending_updates(self):
+        probabilities = [
+            UpdateProbabilitiesCommand(
+                "object",
+                valid_probabilities_dict["data"].copy(),
+                valid_probabilities_dict["criteria"],
+            )
+            for _ in range(2)
+        ]
+        self.executor.bulk_execute(
+            [
+                probabilities[0],
+                UpdateCommand("object", {"a": 1}, {"_id": "AID51423"}),
+                probabilities[1],
+            ]
+        )
+        written = [call.args[0] for call in self.bulk_write.call_args_list]
+        n_probabilities = len(probabilities[0].get_operations())
+        self.assertEqual(
+            [len(operations) for operations in written],
+            [n_probabilities, 1, n_probabilities],
+        )
+
+    def test_drained_updates_are_kept_when_flush_fails(self):
+        self.executor.bulk_execute(
+            [UpdateCommand("object", {"a": 1}, {"_id": "AID1"})]
+        )
+        self.bulk_write.side_effect = ConnectionFailure("down")
+        with self.assertRaises(ConnectionFailure):
+            self.executor.flush()
+        self.assertTrue(self.executor.has_pending_writes())
+        self.bulk_write.side_effect = None
+        self.assertEqual(self.executor.resume(), 1)
+        self.assertFalse(self.executor.has_pending_writes())
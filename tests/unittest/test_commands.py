@@ -13,6 +13,7 @@ from mongo_scribe.command.commands import (
     UpdateCommand,
     UpdateProbabilitiesCommand,
     UpdateFeaturesCommand,
+    _probabilities_template,
 )
 from mongo_scribe.command.exceptions import (
     NoDataProvidedException,
@@ -396,3 +397,72 @@ class CommandTests(unittest.TestCase):
                 }
             },
         )
+
+    def test_update_probabilities_from_matrix_matches_single_commands(self):
+        import random
+
+        random.seed(1)
+        class_names = [f"class{i}" for i in range(6)]
+        rows = [
+            [round(random.random(), 1) for _ in class_names] for _ in range(20)
+        ]
+        criteria = [{"_id": f"AID{i}"} for i in range(len(rows))]
+        commands = UpdateProbabilitiesCommand.from_matrix(
+            "object", "classifier", "1.0.0", class_names, rows, criteria
+        )
+        for command, row, row_criteria in zip(commands, rows, criteria):
+            single = UpdateProbabilitiesCommand(
+                "object",
+                {
+                    "classifier_name": "classifier",
+                    "classifier_version": "1.0.0",
+                    **dict(zip(class_names, row)),
+                },
+                row_criteria,
+            )
+            self.assertEqual(
+                [op._doc for op in command.get_operations()],
+                [op._doc for op in single.get_operations()],
+            )
+            self.assertEqual(
+                [op._array_filters for op in command.get_operations()],
+                [op._array_filters for op in single.get_operations()],
+            )
+
+    def test_update_probabilities_reuses_operation_templates(self):
+        def command(aid):
+            return UpdateProbabilitiesCommand(
+                valid_probabilities_dict["collection"],
+                valid_probabilities_dict["data"].copy(),
+                {"_id": aid},
+            )
+
+        first = command("AID1").get_operations()
+        second = command("AID2").get_operations()
+        self.assertIs(first[2]._array_filters, second[2]._array_filters)
+        self.assertEqual(
+            first[2]._array_filters,
+            [
+                {
+                    "el.classifier_name": "classifier",
+                    "el.classifier_version": "1.0.0",
+                    "el.class_name": "class2",
+                }
+            ],
+        )
+        self.assertEqual(second[2]._filter, {"_id": "AID2"})
+
+    def test_probabilities_templates_ignore_class_order(self):
+        commands = UpdateProbabilitiesCommand.from_matrix(
+            "object",
+            "classifier",
+            "1.0.0",
+            ["class1", "class2"],
+            [[0.9, 0.1], [0.2, 0.8]],
+            [{"_id": "AID1"}, {"_id": "AID2"}],
+        )
+        _probabilities_template.cache_clear()
+        for command in commands:
+            command.get_operations()
+        info = _probabilities_template.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
@@ -0,0 +1,70 @@
+import gzip
+import unittest
+from base64 import b64encode
+
+import lz4.frame
+import zstandard
+
+from mongo_scribe.command.compression import decompress_payload
+from mongo_scribe.command.exceptions import PayloadTooLargeException
+from mongo_scribe.command.decode import db_command_factory
+from mongo_scribe.command.commands import InsertCommand
+
+from mockdata import valid_data_json
+
+
+class TestDecompressPayload(unittest.TestCase):
+    def setUp(self):
+        self.raw = valid_data_json.encode()
+
+    def test_plain_payloads_are_returned_as_is(self):
+        self.assertIs(decompress_payload(valid_data_json), valid_data_json)
+        self.assertIs(decompress_payload(self.raw), self.raw)
+
+    def test_binary_payloads(self):
+        for compressed in (
+            zstandard.ZstdCompressor().compress(self.raw),
+            gzip.compress(self.raw),
+            lz4.frame.compress(self.raw),
+        ):
+            self.assertEqual(decompress_payload(compressed), self.raw)
+
+    def test_zstd_without_content_size(self):
+        compressor = zstandard.ZstdCompressor(write_content_size=False)
+        compressed = compressor.compress(self.raw)
+        self.assertEqual(decompress_payload(compressed), self.raw)
+
+    def test_base64_payloads_with_codec_prefix(self):
+        compressed = zstandard.ZstdCompressor().compress(self.raw)
+        payload = "zstd:" + b64encode(compressed).decode()
+        self.assertEqual(decompress_payload(payload), self.raw)
+        payload = "gzip:" + b64encode(gzip.compress(self.raw)).decode()
+        self.assertEqual(decompress_payload(payload), self.raw)
+
+    def test_payloads_over_the_limit_are_rejected(self):
+        bomb = b"[" + b" " * (1024 * 1024) + b"]"
+        for compressed in (
+            zstandard.ZstdCompressor().compress(bomb),
+            zstandard.ZstdCompressor(write_content_size=False).compress(bomb),
+            gzip.compress(bomb),
+            lz4.frame.compress(bomb),
+        ):
+            with self.assertRaises(PayloadTooLargeException):
+                decompress_payload(compressed, max_size=1024)
+            self.assertEqual(
+                decompress_payload(compressed, max_size=len(bomb)), bomb
+            )
+        payload = "gzip:" + b64encode(gzip.compress(bomb)).decode()
+        with self.assertRaises(PayloadTooLargeException):
+            decompress_payload(payload, max_size=1024)
+
+    def test_lz4_after_unfinished_frame(self):
+        compressed = lz4.frame.compress(self.raw)
+        decompress_payload(compressed[:-8])
+        self.assertEqual(decompress_payload(compressed), self.raw)
+        self.assertEqual(decompress_payload(compressed), self.raw)
+
+    def test_factory_decodes_compressed_payload(self):
+        msg = b'{"type": "insert", "data": {"field": "value"}, "collection": "object"}'
+        command = db_command_factory(gzip.compress(msg))
+        self.assertTrue(type(command) == InsertCommand)
@@ -0,0 +1,108 @@
+import unittest
+from unittest import mock
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from mongo_scribe.db.conflicts import upsert_conflicts
+from mongo_scribe.db.executor import ScribeCommandExecutor
+from mongo_scribe.command.commands import UpdateCommand
+
+
+def _error(*indexes, code=11000, key="_id", **details):
+    return BulkWriteError(
+        {
+            "writeErrors": [
+                {"index": i, "code": code, "keyPattern": {key: 1}}
+                for i in indexes
+            ],
+            "writeConcernErrors": [],
+            **details,
+        }
+    )
+
+
+CHUNK = [
+    UpdateOne({"_id": "a"}, {"$set": {"n": 1}}, upsert=True),
+    UpdateOne({"_id": "b"}, {"$set": {"n": 2}}, upsert=True),
+    UpdateOne({"_id": "c"}, {"$set": {"n": 3}}, upsert=True),
+]
+
+
+class TestUpsertConflicts(unittest.TestCase):
+    def test_ordered_retries_conflict_and_remaining_operations(self):
+        retry, n_conflicts = upsert_conflicts(CHUNK, _error(1), True)
+        self.assertEqual(n_conflicts, 1)
+        self.assertEqual(retry, [CHUNK[1], CHUNK[2]])
+
+    def test_unordered_retries_only_conflicts(self):
+        retry, n_conflicts = upsert_conflicts(CHUNK, _error(0, 2), False)
+        self.assertEqual(n_conflicts, 2)
+        self.assertEqual(retry, [CHUNK[0], CHUNK[2]])
+
+    def test_options_of_retried_upserts_are_kept(self):
+        operation = UpdateOne(
+            {"_id": "a"}, {"$set": {"n": 1}}, upsert=True, sort={"n": 1}
+        )
+        retry, _ = upsert_conflicts([operation], _error(0), True)
+        self.assertIs(retry[0], operation)
+
+    def test_other_errors_are_not_retried(self):
+        self.assertIsNone(upsert_conflicts(CHUNK, _error(0, code=121)))
+        inserts = [InsertOne({"_id": "a"})]
+        self.assertIsNone(upsert_conflicts(inserts, _error(0)))
+        self.assertIsNone(
+            upsert_conflicts(
+                CHUNK, _error(0, writeConcernErrors=[{"code": 64}])
+            )
+        )
+
+    def test_conflicts_on_other_keys_are_not_retried(self):
+        self.assertIsNone(upsert_conflicts(CHUNK, _error(0, key="oid")))
+        error = BulkWriteError(
+            {"writeErrors": [{"index": 0, "code": 11000, "keyValue": {}}]}
+        )
+        self.assertIsNone(upsert_conflicts(CHUNK, error))
+
+    def test_repeated_conflicts_are_not_retried(self):
+        retried = {id(CHUNK[0])}
+        self.assertIsNone(upsert_conflicts(CHUNK, _error(0), True, retried))
+
+
+class TestExecutorConflicts(unittest.TestCase):
+    def setUp(self):
+        self.metrics = mock.MagicMock()
+        self.executor = ScribeCommandExecutor({"MONGO": {}}, self.metrics)
+        self.executor.connection = mock.MagicMock()
+        self.bulk_write = self.executor.connection.database[
+            "object"
+        ].bulk_write
+
+    def _commands(self):
+        return [
+            UpdateCommand("object", {"n": i}, {"_id": i}, {"upsert": True})
+            for i in range(3)
+        ]
+
+    def test_conflicting_upserts_are_written_again(self):
+        self.bulk_write.side_effect = [_error(1), None]
+        self.executor.bulk_execute(self._commands())
+        self.assertEqual(self.bulk_write.call_count, 2)
+        chunk = self.bulk_write.call_args_list[0].args[0]
+        retry = self.bulk_write.call_args.args[0]
+        self.assertEqual(retry, chunk[1:])
+        self.metrics.count_upsert_conflicts.assert_called_once_with(
+            "object", 1
+        )
+
+    def test_upserts_conflicting_twice_are_raised(self):
+        self.bulk_write.side_effect = [_error(1), _error(0)]
+        with self.assertRaises(BulkWriteError):
+            self.executor.bulk_execute(self._commands())
+        self.assertEqual(self.bulk_write.call_count, 2)
+
+    def test_other_bulk_write_errors_are_raised(self):
+        self.bulk_write.side_effect = _error(1, code=121)
+        with self.assertRaises(BulkWriteError):
+            self.executor.bulk_execute(self._commands())
+        self.metrics.count_upsert_conflicts.assert_not_called()
@@ -0,0 +1,82 @@
+import unittest
+from unittest import mock
+
+from mongo_scribe.db import connection
+from mongo_scribe.db.executor import ScribeCommandExecutor
+
+db_config = {
+    "MONGO": {
+        "DATABASE": "test",
+        "PORT": 27017,
+        "HOST": "localhost",
+        "USERNAME": "user",
+        "PASSWORD": "pass",
+    },
+    "CLIENT_OPTIONS": {"maxPoolSize": 10, "minPoolSize": 2},
+}
+
+
+class TestConnection(unittest.TestCase):
+    def setUp(self):
+        connection._reset_after_fork()
+        patcher = mock.patch("mongo_scribe.db.connection.MongoClient")
+        self.client = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_executor_connects_lazily(self):
+        executor = ScribeCommandExecutor(db_config)
+        self.client.assert_not_called()
+        executor.connection
+        self.client.assert_called_once()
+
+    def test_client_options_are_passed(self):
+        connection.get_connection(db_config)
+        kwargs = self.client.call_args.kwargs
+        self.assertEqual(kwargs["maxPoolSize"], 10)
+        self.assertEqual(kwargs["minPoolSize"], 2)
+        self.assertNotIn("authSource", kwargs)
+        self.assertFalse(kwargs["connect"])
+
+    def test_extra_keys_are_passed_in_camel_case(self):
+        config = {
+            "MONGO": {
+                **db_config["MONGO"],
+                "AUTH_SOURCE": "admin",
+                "replica_set": "rs0",
+            }
+        }
+        connection.get_connection(config)
+        kwargs = self.client.call_args.kwargs
+        self.assertEqual(kwargs["authSource"], "admin")
+        self.assertEqual(kwargs["replicaSet"], "rs0")
+        self.assertNotIn("database", kwargs)
+
+    def test_missing_keys_are_reported(self):
+        with self.assertRaisesRegex(ValueError, "HOST"):
+            connection.MongoConnection({"DATABASE": "test"})
+
+    def test_lower_case_config(self):
+        config = {
+            "MONGO": {
+                key.lower(): value for key, value in db_config["MONGO"].items()
+            }
+        }
+        connection.get_connection(config)
+        self.assertEqual(self.client.call_args.kwargs["host"], "localhost")
+
+    def test_connection_is_shared_by_executors(self):
+        first = ScribeCommandExecutor(db_config).connection
+        second = ScribeCommandExecutor(db_config).connection
+        self.assertIs(first, second)
+        self.client.assert_called_once()
+
+    def test_connection_is_not_shared_after_fork(self):
+        first = connection.get_connection(db_config)
+        connection._reset_after_fork()
+        second = connection.get_connection(db_config)
+        self.assertIsNot(first, second)
+
+    def test_warm_up_pings_server(self):
+        executor = ScribeCommandExecutor(db_config)
+        executor.warm_up()
+        self.client.return_value.admin.command.assert_called_once_with("ping")
@@ -1,7 +1,16 @@
 import unittest
 
-from mongo_scribe.command.decode import decode_message, db_command_factory
-from mongo_scribe.command.exceptions import WrongFormatCommandException
+from mongo_scribe.command.decode import (
+    build_command,
+    decode_message,
+    db_command_factory,
+    db_commands_factory,
+)
+from mongo_scribe.command.exceptions import (
+    EnvelopeLengthMismatchException,
+    ProbabilitiesShapeException,
+    WrongFormatCommandException,
+)
 from mongo_scribe.command.commands import (
     InsertCommand,
     UpdateCommand,
@@ -16,6 +25,10 @@ class DecodeTest(unittest.TestCase):
         decoded = decode_message(valid_data_json)
         self.assertEqual(decoded, valid_data_dict)
 
+    def test_decode_message_with_array(self):
+        decoded = decode_message(f"[{valid_data_json}, {valid_data_json}]")
+        self.assertEqual(decoded, [valid_data_dict, valid_data_dict])
+
 
 # Uses type equals instead of isinstance since there are derived classes
 class TestCommandFactory(unittest.TestCase):
@@ -42,3 +55,68 @@ class TestCommandFactory(unittest.TestCase):
         self.assertTrue(
             type(db_command_factory(msg)) == UpdateProbabilitiesCommand
         )
+
+    def test_build_command_from_decoded_message(self):
+        command = build_command(
+            {
+                "type": "insert",
+                "data": {"field": "value"},
+                "collection": "object",
+            }
+        )
+        self.assertTrue(type(command) == InsertCommand)
+
+
+class TestCommandsFactory(unittest.TestCase):
+    def test_single_command(self):
+        msg = '{"type": "insert", "data": {"field": "value"}, "collection": "object"}'
+        commands = db_commands_factory(msg)
+        self.assertEqual(len(commands), 1)
+        self.assertTrue(type(commands[0]) == InsertCommand)
+
+    def test_array_of_commands(self):
+        msg = '[{"type": "insert", "data": {"field": "value"}, "collection": "object"}, {"type": "update", "criteria": {"_id": "id"}, "data": {"field": "value"}, "collection": "object"}]'
+        commands = db_commands_factory(msg)
+        self.assertEqual(
+            [type(c) for c in commands], [InsertCommand, UpdateCommand]
+        )
+
+    def test_columnar_envelope(self):
+        msg = '{"type": "update", "collection": "object", "options": {"upsert": true}, "criteria": [{"_id": "a"}, {"_id": "b"}], "data": [{"ndet": 1}, {"ndet": 2}]}'
+        commands = db_commands_factory(msg)
+        self.assertEqual(len(commands), 2)
+        self.assertEqual(commands[1].criteria, {"_id": "b"})
+        self.assertEqual(commands[1].data, {"ndet": 2})
+        self.assertTrue(commands[0].options.upsert)
+
+    def test_columnar_envelope_without_criteria(self):
+        msg = '{"type": "insert", "collection": "detection", "data": [{"candid": 1}, {"candid": 2}]}'
+        commands = db_commands_factory(msg)
+        self.assertEqual([c.data["candid"] for c in commands], [1, 2])
+
+    def test_columnar_envelope_with_mismatched_criteria(self):
+        msg = '{"type": "update", "collection": "object", "criteria": [{"_id": "a"}], "data": [{"ndet": 1}, {"ndet": 2}]}'
+        with self.assertRaises(EnvelopeLengthMismatchException):
+            db_commands_factory(msg)
+
+    def test_invalid_command_in_array(self):
+        msg = '[{"type": "insert", "data": {"field": "value"}, "collection": "object"}, {"mock": "val"}]'
+        with self.assertRaises(WrongFormatCommandException):
+            db_commands_factory(msg)
+
+    def test_probabilities_matrix(self):
+        msg = '{"type": "update_probabilities", "collection": "object", "criteria": [{"_id": "a"}, {"_id": "b"}], "data": {"classifier_name": "c", "classifier_version": "1.0", "class_names": ["SN", "AGN", "VS"], "probabilities": [[0.2, 0.5, 0.3], [0.6, 0.2, 0.2]]}}'
+        commands = db_commands_factory(msg)
+        self.assertTrue(
+            all(type(c) == UpdateProbabilitiesCommand for c in commands)
+        )
+        self.assertEqual(commands[1].criteria, {"_id": "b"})
+        self.assertEqual(commands[0].classifier_name, "c")
+        self.assertEqual(
+            commands[1]._sort(), [("SN", 0.6), ("AGN", 0.2), ("VS", 0.2)]
+        )
+
+    def test_probabilities_matrix_with_wrong_shape(self):
+        msg = '{"type": "update_probabilities", "collection": "object", "criteria": [{"_id": "a"}], "data": {"classifier_name": "c", "classifier_version": "1.0", "class_names": ["SN", "AGN"], "probabilities": [[0.2, 0.5, 0.3]]}}'
+        with self.assertRaises(ProbabilitiesShapeException):
+            db_commands_factory(msg)
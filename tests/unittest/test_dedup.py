@@ -0,0 +1,49 @@
+import unittest
+from unittest import mock
+
+from mongo_scribe.command.dedup import DuplicatePayloadFilter
+
+
+class TestDuplicatePayloadFilter(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        patcher = mock.patch(
+            "mongo_scribe.command.dedup.time.monotonic", lambda: self.now
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.filter = DuplicatePayloadFilter(max_entries=2, ttl=10)
+
+    def test_key_is_the_same_for_str_and_bytes(self):
+        self.assertEqual(
+            self.filter.key('{"a": 1}'), self.filter.key(b'{"a": 1}')
+        )
+        self.assertNotEqual(
+            self.filter.key('{"a": 1}'), self.filter.key('{"a": 2}')
+        )
+
+    def test_remembers_added_keys(self):
+        key = self.filter.key("payload")
+        self.assertFalse(self.filter.seen(key))
+        self.filter.add([key])
+        self.assertTrue(self.filter.seen(key))
+
+    def test_evicts_least_recently_seen(self):
+        a, b, c = (self.filter.key(p) for p in ("a", "b", "c"))
+        self.filter.add([a, b])
+        self.filter.seen(a)
+        self.filter.add([c])
+        self.assertEqual(len(self.filter), 2)
+        self.assertTrue(self.filter.seen(a))
+        self.assertFalse(self.filter.seen(b))
+
+    def test_expires_after_ttl(self):
+        key = self.filter.key("payload")
+        self.filter.add([key])
+        self.now = 9
+        self.assertTrue(self.filter.seen(key))
+        self.now = 18
+        self.assertTrue(self.filter.seen(key))
+        self.now = 28
+        self.assertFalse(self.filter.seen(key))
+        self.assertEqual(len(self.filter), 0)
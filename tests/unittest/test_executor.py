@@ -1,6 +1,9 @@
+import time
 import unittest
 from unittest import mock
 
+from pymongo.errors import ConnectionFailure
+
 from mongo_scribe.db.executor import ScribeCommandExecutor
 from mongo_scribe.command.commands import InsertCommand
 
@@ -30,3 +33,95 @@ class TestExecutor(unittest.TestCase):
         command.get_operations = lambda: [mock.MagicMock(), mock.MagicMock()]
         self.executor.bulk_execute([command])
         self.executor.connection.database.__getitem__.return_value.bulk_write.assert_called_once()
+
+    def test_bulk_execute_splits_operations_in_chunks(self):
+        self.executor.chunk_size = 2
+        commands = [
+            InsertCommand("object", {"field": i}, {}) for i in range(5)
+        ]
+        self.executor.bulk_execute(commands)
+        bulk_write = (
+            self.executor.connection.database.__getitem__.return_value.bulk_write
+        )
+        self.assertEqual(bulk_write.call_count, 3)
+        sizes = [len(call.args[0]) for call in bulk_write.call_args_list]
+        self.assertEqual(sizes, [2, 2, 1])
+
+    def test_bulk_execute_writes_before_expanding_all_commands(self):
+        self.executor.chunk_size = 1
+        bulk_write = (
+            self.executor.connection.database.__getitem__.return_value.bulk_write
+        )
+        first = InsertCommand("object", {"field": 1}, {})
+        last = InsertCommand("object", {"field": 2}, {})
+
+        def get_operations():
+            bulk_write.assert_called_once()
+            return []
+
+        last.get_operations = get_operations
+        self.executor.bulk_execute([first, last])
+
+    def test_bulk_execute_records_metrics(self):
+        self.executor.metrics = mock.MagicMock()
+        self.executor.chunk_size = 2
+        commands = [
+            InsertCommand("object", {"field": i}, {}) for i in range(3)
+        ]
+        self.executor.bulk_execute(commands)
+        metrics = self.executor.metrics
+        self.assertEqual(metrics.observe_build.call_count, 3)
+        self.assertEqual(metrics.observe_write.call_count, 2)
+        metrics.observe_amplification.assert_called_once_with("object", 3, 3)
+
+    def test_bulk_execute_records_end_to_end_latency(self):
+        self.executor.metrics = mock.MagicMock()
+        command = InsertCommand("object", {"field": 1}, {})
+        command.timestamp = (time.time() - 10) * 1000
+        self.executor.bulk_execute([command])
+        (
+            collection,
+            command_type,
+            latency,
+        ) = self.executor.metrics.observe_latency.call_args.args
+        self.assertEqual((collection, command_type), ("object", "insert"))
+        self.assertGreaterEqual(latency, 10)
+
+    def test_latency_is_observed_with_the_chunk_of_each_command(self):
+        self.executor.chunk_size = 2
+        self.executor.metrics = mock.MagicMock()
+        commands = [
+            InsertCommand("object", {"field": i}, {}) for i in range(4)
+        ]
+        for command in commands:
+            command.timestamp = time.time() * 1000
+        bulk_write = (
+            self.executor.connection.database.__getitem__.return_value.bulk_write
+        )
+        observed = []
+        bulk_write.side_effect = lambda chunk: observed.append(
+            self.executor.metrics.observe_latency.call_count
+        )
+        self.executor.bulk_execute(commands)
+        self.assertEqual(observed, [0, 2])
+        self.assertEqual(self.executor.metrics.observe_latency.call_count, 4)
+
+    def test_failed_write_is_resumed_from_the_failed_chunk(self):
+        self.executor.chunk_size = 2
+        bulk_write = (
+            self.executor.connection.database.__getitem__.return_value.bulk_write
+        )
+        bulk_write.side_effect = [None, ConnectionFailure("down"), None, None]
+        commands = [
+            InsertCommand("object", {"field": i}, {}) for i in range(5)
+        ]
+        with self.assertRaises(ConnectionFailure):
+            self.executor.bulk_execute(commands)
+        self.assertTrue(self.executor.has_pending_writes())
+        self.assertEqual(self.executor.resume(), 3)
+        written = [
+            [op._doc["field"] for op in call.args[0]]
+            for call in bulk_write.call_args_list
+        ]
+        self.assertEqual(written, [[0, 1], [2, 3], [2, 3], [4]])
+        self.assertFalse(self.executor.has_pending_writes())
@@ -0,0 +1,86 @@
+import json
+import unittest
+from unittest import mock
+
+from bson.binary import Binary
+from pymongo.errors import ConnectionFailure
+
+from mongo_scribe.command import decode
+from mongo_scribe.command.commands import UpdateCommand, UpdateFeaturesCommand
+from mongo_scribe.command.features import (
+    FEATURE_SCHEMA_COLLECTION,
+    feature_schema,
+    unpack_features,
+)
+from mongo_scribe.db.executor import ScribeCommandExecutor
+
+from mockdata import valid_features_dict
+
+
+def _packed_command():
+    return UpdateFeaturesCommand(
+        valid_features_dict["collection"],
+        json.loads(json.dumps(valid_features_dict["data"])),
+        valid_features_dict["criteria"],
+        {"packed": True, "upsert": True},
+    )
+
+
+class TestPackedFeatures(unittest.TestCase):
+    def test_schema_id_depends_on_content(self):
+        features = valid_features_dict["data"]["features"]
+        schema = feature_schema("v1", "group", features)
+        self.assertEqual(schema["names"], ["feature1", "feature2"])
+        self.assertEqual(schema["fids"], ["g", "Y"])
+        self.assertEqual(
+            schema["_id"], feature_schema("v1", "group", features)["_id"]
+        )
+        self.assertNotEqual(
+            schema["_id"], feature_schema("v2", "group", features)["_id"]
+        )
+
+    def test_packed_operation_round_trips(self):
+        command = _packed_command()
+        operation = command.get_operations()[0]
+        group = operation._doc["$set"]["features"]["group"]
+        self.assertEqual(group["version"], "v1")
+        self.assertIsInstance(group["values"], Binary)
+        self.assertEqual(len(group["values"]), 16)
+        schema = command.schema()
+        self.assertEqual(group["schema"], schema["_id"])
+        self.assertEqual(
+            unpack_features(group, schema),
+            valid_features_dict["data"]["features"],
+        )
+
+    def test_schema_command(self):
+        command = _packed_command().schema_command()
+        self.assertTrue(type(command) == UpdateCommand)
+        self.assertEqual(command.collection, FEATURE_SCHEMA_COLLECTION)
+        self.assertTrue(command.options.set_on_insert)
+        self.assertNotIn("_id", command.data)
+
+    def test_schema_is_included_once_per_message(self):
+        message = dict(valid_features_dict, options={"packed": True})
+        payload = json.dumps([message, message])
+        commands = decode.db_commands_factory(payload)
+        self.assertEqual(
+            [c.collection for c in commands],
+            [FEATURE_SCHEMA_COLLECTION, "object", "object"],
+        )
+
+    def test_schema_is_written_until_it_succeeds(self):
+        executor = ScribeCommandExecutor({})
+        executor.connection = mock.MagicMock()
+        bulk_write = executor.connection.database.__getitem__.return_value
+        bulk_write = bulk_write.bulk_write
+        bulk_write.side_effect = [ConnectionFailure("down"), None, None, None]
+        message = dict(valid_features_dict, options={"packed": True})
+        payload = json.dumps(message)
+        with self.assertRaises(ConnectionFailure):
+            executor.bulk_execute(decode.db_commands_factory(payload))
+        executor.discard()
+        executor.bulk_execute(decode.db_commands_factory(payload))
+        self.assertEqual(bulk_write.call_count, 3)
+        executor.bulk_execute(decode.db_commands_factory(payload))
+        self.assertEqual(bulk_write.call_count, 4)
@@ -0,0 +1,70 @@
+import gzip
+import unittest
+
+import bson
+import msgpack
+from bson.raw_bson import RawBSONDocument
+
+from mongo_scribe.command.decode import db_command_factory, db_commands_factory
+from mongo_scribe.command.formats import is_bson, is_msgpack
+from mongo_scribe.command.commands import InsertCommand, UpdateCommand
+
+from mockdata import valid_data_dict, valid_data_json
+
+
+class TestFormatDetection(unittest.TestCase):
+    def test_detects_bson(self):
+        self.assertTrue(is_bson(bson.encode(valid_data_dict)))
+        self.assertFalse(is_bson(valid_data_json.encode()))
+        self.assertFalse(is_bson(msgpack.packb(valid_data_dict)))
+
+    def test_detects_msgpack(self):
+        self.assertTrue(is_msgpack(msgpack.packb(valid_data_dict)))
+        self.assertTrue(is_msgpack(msgpack.packb([valid_data_dict])))
+        self.assertFalse(is_msgpack(valid_data_json.encode()))
+        self.assertFalse(is_msgpack(gzip.compress(b"{}")))
+
+
+class TestBinaryPayloads(unittest.TestCase):
+    def test_bson_insert_keeps_raw_data(self):
+        command = db_command_factory(bson.encode(valid_data_dict))
+        self.assertTrue(type(command) == InsertCommand)
+        self.assertIsInstance(command.data, RawBSONDocument)
+        self.assertEqual(command.data["field1"], "some_field")
+        self.assertEqual(command.criteria, {"_id": "AID51423"})
+        operation = command.get_operations()[0]
+        self.assertIsInstance(operation._doc, RawBSONDocument)
+
+    def test_bson_insert_envelope(self):
+        envelope = {
+            "type": "insert",
+            "collection": "detection",
+            "data": [{"candid": 1}, {"candid": 2}],
+        }
+        commands = db_commands_factory(bson.encode(envelope))
+        self.assertEqual([c.data["candid"] for c in commands], [1, 2])
+        self.assertIsInstance(commands[0].data, RawBSONDocument)
+
+    def test_bson_update_is_decoded(self):
+        message = {
+            "type": "update",
+            "collection": "object",
+            "criteria": {"_id": "AID51423"},
+            "data": {"ndet": 3},
+        }
+        command = db_command_factory(bson.encode(message))
+        self.assertTrue(type(command) == UpdateCommand)
+        self.assertEqual(type(command.data), dict)
+
+    def test_msgpack_payloads(self):
+        command = db_command_factory(msgpack.packb(valid_data_dict))
+        self.assertTrue(type(command) == InsertCommand)
+        commands = db_commands_factory(
+            msgpack.packb([valid_data_dict, valid_data_dict])
+        )
+        self.assertEqual(len(commands), 2)
+
+    def test_compressed_bson(self):
+        payload = gzip.compress(bson.encode(valid_data_dict))
+        command = db_command_factory(payload)
+        self.assertIsInstance(command.data, RawBSONDocument)
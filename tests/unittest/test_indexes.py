@@ -0,0 +1,191 @@
+import unittest
+from unittest import mock
+
+from pymongo import DESCENDING
+
+from mongo_scribe.db.executor import ScribeCommandExecutor
+from mongo_scribe.db.indexes import (
+    IndexChecker,
+    command_indexes,
+    ensure_indexes,
+    filter_key,
+)
+from mongo_scribe.command.commands import (
+    InsertCommand,
+    UpdateCommand,
+    UpdateFeaturesCommand,
+    UpdateProbabilitiesCommand,
+)
+
+
+def _database(indexes):
+    database = mock.MagicMock()
+    database.__getitem__.return_value.index_information.return_value = {
+        "_id_": {"key": [("_id", 1)]},
+        **indexes,
+    }
+    return database
+
+
+class TestEnsureIndexes(unittest.TestCase):
+    def test_existing_index_prefix_covers_required(self):
+        database = _database(
+            {"aid_mjd": {"key": [("aid", 1), ("mjd", DESCENDING)]}}
+        )
+        missing = ensure_indexes(database, {"detection": [["aid"]]}, False)
+        self.assertEqual(missing, {})
+        database["detection"].create_index.assert_not_called()
+
+    def test_reports_missing_indexes(self):
+        database = _database({})
+        missing = ensure_indexes(
+            database, {"object": [["probabilities.classifier_name"]]}, False
+        )
+        self.assertEqual(
+            missing, {"object": [[("probabilities.classifier_name", 1)]]}
+        )
+        database["object"].create_index.assert_not_called()
+
+    def test_creates_missing_indexes(self):
+        database = _database({})
+        missing = ensure_indexes(
+            database, {"detection": [[["aid", 1], ["mjd", -1]]]}, True
+        )
+        self.assertEqual(missing, {})
+        database["detection"].create_index.assert_called_once_with(
+            [("aid", 1), ("mjd", -1)]
+        )
+
+
+class TestCommandIndexes(unittest.TestCase):
+    def test_filters_by_id_need_no_index(self):
+        self.assertIsNone(filter_key({}))
+        self.assertIsNone(filter_key({"_id": "AL1", "a": 1}))
+        self.assertEqual(
+            filter_key({"_id": {"$in": [1]}, "aid": 1}), ("aid", "_id")
+        )
+
+    def test_keys_are_derived_from_command_filters(self):
+        commands = [
+            InsertCommand("detection", {"aid": "AL1"}),
+            UpdateCommand("object", {"a": 1}, {"_id": "AL1"}),
+            UpdateProbabilitiesCommand(
+                "object",
+                {"classifier_name": "c", "classifier_version": "1", "A": 1},
+                {"aid": "AL1"},
+            ),
+            UpdateFeaturesCommand(
+                "object",
+                {
+                    "features_version": "v1",
+                    "features_group": "group",
+                    "features": [],
+                },
+                {"oid": "ZTF1"},
+            ),
+        ]
+        self.assertEqual(
+            command_indexes(commands),
+            {("aid",), ("aid", "probabilities.classifier_name"), ("oid",)},
+        )
+
+
+class TestIndexChecker(unittest.TestCase):
+    def setUp(self):
+        self.metrics = mock.MagicMock()
+        self.checker = IndexChecker(1, metrics=self.metrics)
+        self.database = mock.MagicMock()
+
+    def test_reports_collection_scans_once_per_shape(self):
+        self.database.command.return_value = {
+            "queryPlanner": {
+                "winningPlan": {
+                    "stage": "UPDATE",
+                    "inputStage": {"stage": "COLLSCAN"},
+                }
+            }
+        }
+        commands = [
+            InsertCommand("object", {"a": 1}),
+            UpdateCommand("object", {"a": 1}, {"oid": 1}),
+            UpdateCommand("object", {"a": 2}, {"oid": 2}),
+        ]
+        self.checker.check(self.database, "object", commands)
+        self.checker.check(self.database, "object", commands)
+        self.database.command.assert_called_once()
+        explain = self.database.command.call_args.args[0]
+        self.assertEqual(
+            explain["explain"], {"find": "object", "filter": {"oid": 1}}
+        )
+        self.metrics.count_unindexed.assert_called_once_with("object")
+
+    def test_indexed_updates_are_not_reported(self):
+        self.database.command.return_value = {
+            "queryPlanner": {
+                "winningPlan": {
+                    "stage": "UPDATE",
+                    "inputStage": {"stage": "IDHACK"},
+                }
+            }
+        }
+        self.checker.check(
+            self.database,
+            "object",
+            [UpdateCommand("object", {"a": 1}, {"_id": 1})],
+        )
+        self.metrics.count_unindexed.assert_not_called()
+
+
+class TestExecutorIndexes(unittest.TestCase):
+    def test_warm_up_checks_required_indexes(self):
+        executor = ScribeCommandExecutor(
+            {"MONGO": {}, "INDEXES": {"REQUIRED": {"object": [["aid"]]}}}
+        )
+        executor.connection = mock.MagicMock()
+        with mock.patch(
+            "mongo_scribe.db.executor.ensure_indexes"
+        ) as ensure_indexes:
+            executor.warm_up()
+        ensure_indexes.assert_called_once_with(
+            executor.connection.database, {"object": [["aid"]]}, False
+        )
+
+    def test_warm_up_creates_bucket_indexes_without_index_config(self):
+        executor = ScribeCommandExecutor(
+            {
+                "MONGO": {},
+                "BUCKETS": {"COLLECTIONS": ["detection"]},
+            }
+        )
+        executor.connection = mock.MagicMock()
+        with mock.patch(
+            "mongo_scribe.db.executor.ensure_indexes"
+        ) as ensure_indexes:
+            executor.warm_up()
+        ensure_indexes.assert_called_once_with(
+            executor.connection.database,
+            {"detection": [["aid", "window", "count"]]},
+            True,
+        )
+
+    def test_indexes_of_commands_are_checked_once(self):
+        executor = ScribeCommandExecutor({"MONGO": {}, "INDEXES": {}})
+        executor.connection = mock.MagicMock()
+        commands = [UpdateCommand("object", {"a": 1}, {"oid": 1})]
+        with mock.patch(
+            "mongo_scribe.db.executor.ensure_indexes"
+        ) as ensure_indexes:
+            executor.bulk_execute(commands)
+            executor.bulk_execute(commands)
+        ensure_indexes.assert_called_once_with(
+            executor.connection.database, {"object": [["oid"]]}, False
+        )
+
+    def test_writes_are_sampled_for_explain(self):
+        executor = ScribeCommandExecutor(
+            {"MONGO": {}, "INDEXES": {"EXPLAIN_SAMPLE_RATE": 1}}
+        )
+        executor.connection = mock.MagicMock()
+        executor.index_checker = mock.MagicMock()
+        executor.bulk_execute([UpdateCommand("object", {"a": 1}, {"_id": 1})])
+        executor.index_checker.check.assert_called_once()
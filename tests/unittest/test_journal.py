@@ -0,0 +1,257 @@
+import os
+import pickle
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from pymongo.errors import AutoReconnect
+
+from mongo_scribe.db.journal import CommandJournal, JournaledCommandExecutor
+from mongo_scribe.command.commands import InsertCommand, UpdateCommand
+
+
+def _commands(n, start=0):
+    return [
+        UpdateCommand("object", {"n": i}, {"_id": i})
+        for i in range(start, start + n)
+    ]
+
+
+class TestCommandJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _read_all(self, journal):
+        commands, position = [], journal.checkpoint
+        for batch, position in journal.read(journal.checkpoint):
+            commands.extend(batch)
+        return commands, position
+
+    def test_append_and_read(self):
+        journal = CommandJournal(self.directory, 1024 * 1024, fsync=False)
+        journal.append(_commands(2))
+        journal.append([InsertCommand("detection", {"candid": 1})])
+        commands, position = self._read_all(journal)
+        self.assertEqual(len(commands), 3)
+        self.assertEqual(commands[0].criteria, {"_id": 0})
+        self.assertEqual(commands[2].collection, "detection")
+        self.assertEqual(position, journal.end)
+        journal.close()
+
+    def test_replays_after_checkpoint_on_reopen(self):
+        journal = CommandJournal(self.directory, 1024 * 1024, fsync=False)
+        journal.append(_commands(1))
+        _, position = self._read_all(journal)
+        journal.commit(position)
+        journal.append(_commands(1, start=1))
+        journal.close()
+
+        reopened = CommandJournal(self.directory, 1024 * 1024, fsync=False)
+        commands, _ = self._read_all(reopened)
+        self.assertEqual([c.criteria for c in commands], [{"_id": 1}])
+        reopened.close()
+
+    def test_discards_incomplete_record_on_reopen(self):
+        journal = CommandJournal(self.directory, 1024 * 1024, fsync=False)
+        journal.append(_commands(1))
+        end = journal.end
+        journal.close()
+        with open(os.path.join(self.directory, "000000000000.log"), "ab") as f:
+            f.write(b"SCJ1\x10\x00")
+
+        reopened = CommandJournal(self.directory, 1024 * 1024, fsync=False)
+        self.assertEqual(reopened.end, end)
+        self.assertEqual(
+            os.path.getsize(os.path.join(self.directory, "000000000000.log")),
+            end[1],
+        )
+        reopened.append(_commands(1, start=1))
+        commands, _ = self._read_all(reopened)
+        self.assertEqual(len(commands), 2)
+        reopened.close()
+
+    def test_corrupted_record_is_not_read(self):
+        journal = CommandJournal(self.directory, 1024 * 1024, fsync=False)
+        journal.append(_commands(1))
+        journal.close()
+        path = os.path.join(self.directory, "000000000000.log")
+        with open(path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"\x00")
+
+        reopened = CommandJournal(self.directory, 1024 * 1024, fsync=False)
+        commands, _ = self._read_all(reopened)
+        self.assertEqual(commands, [])
+        self.assertEqual(reopened.end, (0, 0))
+        reopened.close()
+
+    def test_rotates_and_deletes_committed_segments(self):
+        journal = CommandJournal(self.directory, 1, fsync=False)
+        for i in range(3):
+            journal.append(_commands(1, start=i))
+        self.assertEqual(len(os.listdir(self.directory)), 4)
+        commands, position = self._read_all(journal)
+        self.assertEqual(len(commands), 3)
+        self.assertGreater(journal.backlog(), 0)
+        journal.commit(position)
+        self.assertEqual(journal.backlog(), 0)
+        segments = [
+            name
+            for name in os.listdir(self.directory)
+            if name.endswith(".log")
+        ]
+        self.assertEqual(segments, ["000000000003.log"])
+        journal.close()
+
+
+class TestJournaledCommandExecutor(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.journal = CommandJournal(self.tmp.name, 1024 * 1024, fsync=False)
+        self.inner = mock.MagicMock()
+        self.written = []
+        self.inner.bulk_execute.side_effect = self.written.extend
+
+    def tearDown(self):
+        self.executor.close()
+        self.tmp.cleanup()
+
+    def test_writes_journaled_commands_in_background(self):
+        self.executor = JournaledCommandExecutor(
+            self.inner, self.journal, max_backlog=1024 * 1024
+        )
+        self.assertEqual(self.executor.bulk_execute(_commands(3)), 0)
+        self.executor.flush(timeout=5)
+        self.assertEqual(len(self.written), 3)
+        self.assertEqual(self.journal.checkpoint, self.journal.end)
+        self.assertFalse(self.executor.has_pending_writes())
+
+    def test_retries_while_database_is_unavailable(self):
+        failures = iter([AutoReconnect("down"), AutoReconnect("down")])
+        pending = []
+
+        def resume():
+            error = next(failures, None)
+            if error:
+                raise error
+            self.written.extend(pending)
+            pending.clear()
+
+        self.inner.bulk_execute.side_effect = lambda commands: (
+            pending.extend(commands),
+            resume(),
+        )
+        self.inner.resume.side_effect = resume
+        self.executor = JournaledCommandExecutor(
+            self.inner, self.journal, max_backlog=1024 * 1024, max_backoff=0
+        )
+        self.executor.bulk_execute(_commands(2))
+        self.executor.flush(timeout=5)
+        self.assertEqual(len(self.written), 2)
+        self.inner.bulk_execute.assert_called_once()
+        self.assertEqual(self.inner.resume.call_count, 2)
+
+    def test_discards_batch_after_repeated_errors(self):
+        self.inner.bulk_execute.side_effect = ValueError("invalid")
+        self.inner.resume.side_effect = ValueError("invalid")
+        self.inner.discard.return_value = _commands(1)
+        self.executor = JournaledCommandExecutor(
+            self.inner,
+            self.journal,
+            max_backlog=1024 * 1024,
+            max_backoff=0,
+            max_attempts=2,
+        )
+        self.executor.bulk_execute(_commands(1))
+        self.executor.flush(timeout=5)
+        self.inner.bulk_execute.assert_called_once()
+        self.inner.resume.assert_called_once()
+        self.inner.discard.assert_called_once()
+        self.assertEqual(self.journal.checkpoint, self.journal.end)
+
+    def test_discarded_commands_are_dead_lettered(self):
+        self.inner.bulk_execute.side_effect = ValueError("invalid")
+        self.inner.discard.return_value = _commands(1)
+        self.executor = JournaledCommandExecutor(
+            self.inner,
+            self.journal,
+            max_backlog=1024 * 1024,
+            max_backoff=0,
+            max_attempts=1,
+        )
+        self.executor.bulk_execute(_commands(1))
+        self.executor.flush(timeout=5)
+        with open(os.path.join(self.tmp.name, "dead_letter"), "rb") as f:
+            (payload, _), *rest = CommandJournal._records(f, 0)
+        self.assertEqual(rest, [])
+        self.assertEqual(pickle.loads(payload)[0].data, {"n": 0})
+
+    def test_unreadable_records_are_dead_lettered(self):
+        self.executor = JournaledCommandExecutor(
+            self.inner, self.journal, max_backlog=1024 * 1024
+        )
+        with mock.patch(
+            "mongo_scribe.db.journal.pickle.loads",
+            side_effect=[pickle.UnpicklingError("bad"), _commands(1)],
+        ):
+            self.executor.bulk_execute(_commands(1))
+            self.executor.bulk_execute(_commands(1))
+            self.executor.flush(timeout=5)
+        self.assertEqual(len(self.written), 1)
+        self.assertTrue(
+            os.path.exists(os.path.join(self.tmp.name, "dead_letter"))
+        )
+        self.assertEqual(self.journal.checkpoint, self.journal.end)
+
+    def test_fails_when_writer_stops(self):
+        self.executor = JournaledCommandExecutor(
+            self.inner, self.journal, max_backlog=0
+        )
+        with mock.patch.object(
+            self.journal, "commit", side_effect=OSError("disk full")
+        ):
+            self.executor.bulk_execute(_commands(1))
+            self.executor._thread.join(timeout=5)
+        with self.assertRaises(RuntimeError):
+            self.executor.bulk_execute(_commands(1))
+        with self.assertRaises(RuntimeError):
+            self.executor.flush(timeout=5)
+
+    def test_close_stops_retrying(self):
+        self.inner.bulk_execute.side_effect = AutoReconnect("down")
+        self.executor = JournaledCommandExecutor(
+            self.inner, self.journal, max_backlog=1024 * 1024
+        )
+        self.executor.bulk_execute(_commands(1))
+        time.sleep(0.1)
+        start = time.monotonic()
+        self.executor.close()
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertFalse(self.executor._thread.is_alive())
+        journal = CommandJournal(self.tmp.name, 1024 * 1024, fsync=False)
+        self.assertGreater(journal.backlog(), 0)
+        journal.close()
+        self.executor.close = lambda: None
+
+    def test_blocks_when_backlog_is_full(self):
+        release = threading.Event()
+        self.inner.bulk_execute.side_effect = lambda commands: release.wait()
+        self.executor = JournaledCommandExecutor(
+            self.inner, self.journal, max_backlog=0
+        )
+        self.executor.bulk_execute(_commands(1))
+        blocked = threading.Thread(
+            target=self.executor.bulk_execute, args=(_commands(1),)
+        )
+        blocked.start()
+        time.sleep(0.2)
+        self.assertTrue(blocked.is_alive())
+        release.set()
+        blocked.join(timeout=5)
+        self.assertFalse(blocked.is_alive())
@@ -0,0 +1,94 @@
+import unittest
+from unittest import mock
+
+from mongo_scribe.db.executor import ScribeCommandExecutor
+from mongo_scribe.db.noop import LastWrittenCache
+from mongo_scribe.command.commands import (
+    UpdateCommand,
+    UpdateProbabilitiesCommand,
+)
+
+from mockdata import valid_probabilities_dict
+
+
+def _upsert(data, _id=1):
+    return UpdateCommand("object", data, {"_id": _id}, {"upsert": True})
+
+
+class TestLastWrittenCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = LastWrittenCache(max_documents=2)
+
+    def test_drops_unchanged_fields_and_updates(self):
+        self.cache.prune([_upsert({"ndet": 1, "firstmjd": 2.0})])
+        remaining, dropped = self.cache.prune(
+            [
+                _upsert({"ndet": 2, "firstmjd": 2.0}),
+                _upsert({"ndet": 2, "firstmjd": 2.0}),
+            ]
+        )
+        self.assertEqual(len(remaining), 1)
+        self.assertEqual(remaining[0].data, {"ndet": 2})
+        self.assertEqual(dropped, {"object": [3, 1]})
+
+    def test_compares_types(self):
+        self.cache.prune([_upsert({"flag": 1})])
+        remaining, _ = self.cache.prune([_upsert({"flag": True})])
+        self.assertEqual(remaining[0].data, {"flag": True})
+
+    def test_does_not_cache_updates_without_upsert(self):
+        update = UpdateCommand("object", {"ndet": 1}, {"_id": 1})
+        self.cache.prune([update])
+        remaining, _ = self.cache.prune(
+            [UpdateCommand("object", {"ndet": 1}, {"_id": 1})]
+        )
+        self.assertEqual(len(remaining), 1)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_other_commands_forget_the_document(self):
+        self.cache.prune([_upsert({"ndet": 1})])
+        probabilities = UpdateProbabilitiesCommand(
+            "object",
+            valid_probabilities_dict["data"].copy(),
+            {"_id": 1},
+        )
+        self.cache.prune([probabilities])
+        remaining, _ = self.cache.prune([_upsert({"ndet": 1})])
+        self.assertEqual(len(remaining), 1)
+
+    def test_nested_fields_forget_their_parent(self):
+        self.cache.prune([_upsert({"a": {"b": 1}})])
+        self.cache.prune([_upsert({"a.b": 2})])
+        remaining, _ = self.cache.prune([_upsert({"a": {"b": 1}})])
+        self.assertEqual(len(remaining), 1)
+
+    def test_evicts_least_recently_updated(self):
+        for _id in (1, 2, 1, 3):
+            self.cache.prune([_upsert({"ndet": 1}, _id)])
+        self.assertEqual(len(self.cache), 2)
+        remaining, _ = self.cache.prune([_upsert({"ndet": 1}, 2)])
+        self.assertEqual(len(remaining), 1)
+
+
+class TestExecutorNoopCache(unittest.TestCase):
+    def setUp(self):
+        self.executor = ScribeCommandExecutor(
+            {"MONGO": {}, "NOOP_CACHE": {"MAX_DOCUMENTS": 10}}
+        )
+        self.executor.connection = mock.MagicMock()
+        self.bulk_write = (
+            self.executor.connection.database.__getitem__.return_value.bulk_write
+        )
+
+    def test_skips_updates_that_change_nothing(self):
+        self.assertEqual(self.executor.bulk_execute([_upsert({"a": 1})]), 1)
+        self.assertEqual(self.executor.bulk_execute([_upsert({"a": 1})]), 0)
+        self.bulk_write.assert_called_once()
+
+    def test_forgets_values_when_write_fails(self):
+        self.bulk_write.side_effect = RuntimeError("write failed")
+        with self.assertRaises(RuntimeError):
+            self.executor.bulk_execute([_upsert({"a": 1})])
+        self.bulk_write.side_effect = None
+        self.assertEqual(self.executor.resume(), 1)
+        self.assertEqual(self.executor.bulk_execute([_upsert({"a": 1})]), 1)
@@ -0,0 +1,78 @@
+import unittest
+from queue import Empty
+from unittest import mock
+
+from mongo_scribe.db.partition import (
+    PartitionedCommandExecutor,
+    partition_index,
+)
+from mongo_scribe.command.commands import InsertCommand, UpdateCommand
+from mongo_scribe.command.exceptions import PartitionWorkerException
+
+
+class TestPartitionedExecutor(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("mongo_scribe.db.partition.multiprocessing")
+        self.multiprocessing = patcher.start()
+        self.addCleanup(patcher.stop)
+        context = self.multiprocessing.get_context.return_value
+        context.Queue.side_effect = lambda: mock.MagicMock()
+        self.executor = PartitionedCommandExecutor({}, 4)
+
+    def test_partition_index_is_stable(self):
+        self.assertEqual(
+            partition_index("AID1", 4), partition_index("AID1", 4)
+        )
+
+    def test_same_document_goes_to_same_partition(self):
+        commands = [
+            UpdateCommand("object", {"field": i}, {"_id": "AID1"})
+            for i in range(10)
+        ]
+        partitions = self.executor.partition(commands)
+        self.assertEqual(sorted(len(p) for p in partitions), [0, 0, 0, 10])
+
+    def test_commands_without_key_are_spread(self):
+        commands = [InsertCommand("object", {"field": i}) for i in range(8)]
+        partitions = self.executor.partition(commands)
+        self.assertEqual([len(p) for p in partitions], [2, 2, 2, 2])
+
+    def test_bulk_execute_waits_for_involved_workers(self):
+        commands = [UpdateCommand("object", {"field": 1}, {"_id": "AID1"})]
+        idx = partition_index("AID1", 4)
+        self.executor.results.get.return_value = (1, idx, 3, None)
+        self.assertEqual(self.executor.bulk_execute(commands), 3)
+        self.executor.queues[idx].put.assert_called_once_with((1, commands))
+        self.executor.results.get.assert_called_once()
+
+    def test_bulk_execute_raises_when_worker_fails(self):
+        commands = [UpdateCommand("object", {"field": 1}, {"_id": "AID1"})]
+        idx = partition_index("AID1", 4)
+        self.executor.results.get.return_value = (1, idx, 0, "error")
+        with self.assertRaises(PartitionWorkerException):
+            self.executor.bulk_execute(commands)
+
+    def test_results_of_previous_batches_are_dropped(self):
+        commands = [UpdateCommand("object", {"field": 1}, {"_id": "AID1"})]
+        idx = partition_index("AID1", 4)
+        self.executor.sequence = 1
+        self.executor.results.get.side_effect = [
+            (1, (idx + 1) % 4, 5, None),
+            (2, idx, 3, None),
+        ]
+        self.assertEqual(self.executor.bulk_execute(commands), 3)
+
+    def test_dead_workers_are_restarted(self):
+        commands = [UpdateCommand("object", {"field": 1}, {"_id": "AID1"})]
+        idx = partition_index("AID1", 4)
+        dead = mock.MagicMock()
+        dead.is_alive.side_effect = [True, False]
+        self.executor.workers[idx] = dead
+        self.executor.results.get.side_effect = Empty
+        process = self.multiprocessing.get_context.return_value.Process
+        process.reset_mock()
+        with self.assertRaises(PartitionWorkerException):
+            self.executor.bulk_execute(commands)
+        process.assert_called_once()
+        self.assertIsNot(self.executor.workers[idx], dead)
+        self.executor.workers[idx].start.assert_called()
@@ -0,0 +1,80 @@
+import unittest
+from unittest import mock
+
+from pymongo.write_concern import WriteConcern
+
+from mongo_scribe.db.executor import ScribeCommandExecutor
+from mongo_scribe.db.profiles import WriteProfile, write_profiles
+from mongo_scribe.command.commands import InsertCommand
+
+PROFILES = {
+    "rebuildable": {
+        "COLLECTIONS": ["non_detection", "forced_photometry"],
+        "W": 1,
+        "ORDERED": False,
+        "BYPASS_DOCUMENT_VALIDATION": True,
+        "CHUNK_SIZE": 2,
+    },
+    "durable": {"COLLECTIONS": ["object"], "W": "majority", "J": True},
+}
+
+
+class TestWriteProfiles(unittest.TestCase):
+    def test_profiles_by_collection(self):
+        profiles = write_profiles(PROFILES)
+        self.assertIs(profiles["non_detection"], profiles["forced_photometry"])
+        self.assertEqual(profiles["non_detection"].chunk_size, 2)
+        self.assertEqual(
+            profiles["object"].write_concern,
+            WriteConcern(w="majority", j=True),
+        )
+        self.assertTrue(profiles["object"].ordered)
+
+    def test_client_write_concern_is_kept_without_options(self):
+        profile = WriteProfile.from_config("fast", {"ORDERED": False})
+        database = mock.MagicMock()
+        profile.bulk_write(database, "detection", [])
+        database["detection"].with_options.assert_not_called()
+        database["detection"].bulk_write.assert_called_once_with(
+            [], ordered=False, bypass_document_validation=False
+        )
+
+
+class TestExecutorProfiles(unittest.TestCase):
+    def setUp(self):
+        self.metrics = mock.MagicMock()
+        self.executor = ScribeCommandExecutor(
+            {"MONGO": {}, "WRITE_PROFILES": PROFILES}, metrics=self.metrics
+        )
+        self.executor.connection = mock.MagicMock()
+
+    def test_profiles_options_are_used_to_write(self):
+        self.executor.bulk_execute(
+            [InsertCommand("non_detection", {"n": i}) for i in range(3)]
+        )
+        collection = self.executor.connection.database["non_detection"]
+        collection.with_options.assert_called_with(
+            write_concern=WriteConcern(w=1)
+        )
+        bulk_write = collection.with_options.return_value.bulk_write
+        self.assertEqual(
+            [len(call.args[0]) for call in bulk_write.call_args_list], [2, 1]
+        )
+        self.assertEqual(
+            bulk_write.call_args.kwargs,
+            {"ordered": False, "bypass_document_validation": True},
+        )
+        self.assertEqual(
+            [
+                call.args[:2]
+                for call in self.metrics.observe_profile_write.call_args_list
+            ],
+            [("rebuildable", 2), ("rebuildable", 1)],
+        )
+
+    def test_collections_without_profile_use_defaults(self):
+        self.executor.bulk_execute([InsertCommand("detection", {"n": 1})])
+        collection = self.executor.connection.database["detection"]
+        collection.with_options.assert_not_called()
+        self.assertEqual(collection.bulk_write.call_args.kwargs, {})
+        self.metrics.observe_profile_write.assert_not_called()
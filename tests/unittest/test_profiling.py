@@ -0,0 +1,53 @@
+import os
+import signal
+import tempfile
+import unittest
+
+from mongo_scribe.profiling import BatchProfiler
+from mongo_scribe.tracing import NULL_SPAN
+
+
+class TestBatchProfiler(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output_dir = directory.name
+        self.profiler = BatchProfiler(self.output_dir, 2)
+        self.addCleanup(signal.signal, signal.SIGUSR1, signal.SIG_DFL)
+
+    def _run_batch(self):
+        self.profiler.start_batch()
+        with self.profiler.stage("decode"):
+            [str(i) for i in range(1000)]
+        with self.profiler.stage("write"):
+            sum(range(1000))
+        self.profiler.end_batch()
+
+    def test_inactive_until_triggered(self):
+        self._run_batch()
+        self.assertIs(self.profiler.stage("decode"), NULL_SPAN)
+        self.assertEqual(os.listdir(self.output_dir), [])
+
+    def test_writes_reports_per_stage_after_n_batches(self):
+        self.profiler.trigger()
+        self._run_batch()
+        self.assertTrue(self.profiler.active)
+        self.assertEqual(os.listdir(self.output_dir), [])
+        self._run_batch()
+        self.assertFalse(self.profiler.active)
+
+        files = os.listdir(self.output_dir)
+        for suffix in [
+            "-decode.prof",
+            "-decode.txt",
+            "-decode-memory.txt",
+            "-write.prof",
+        ]:
+            self.assertTrue(any(f.endswith(suffix) for f in files), suffix)
+
+    def test_triggered_by_signal(self):
+        os.kill(os.getpid(), signal.SIGUSR1)
+        self.profiler.start_batch()
+        self.assertTrue(self.profiler.active)
+        self.profiler.end_batch()
+        self.profiler.end_batch()
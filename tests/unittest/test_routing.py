@@ -0,0 +1,169 @@
+import unittest
+from unittest import mock
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import ConnectionFailure
+
+from mongo_scribe.db.executor import ScribeCommandExecutor
+from mongo_scribe.db.routing import (
+    ShardRouter,
+    operation_key,
+    sort_by_key,
+    sort_operations,
+)
+from mongo_scribe.command.commands import InsertCommand, UpdateCommand
+
+
+class TestOperationKey(unittest.TestCase):
+    def test_key_of_inserts_and_updates(self):
+        self.assertEqual(
+            operation_key(InsertOne({"aid": "a", "mjd": 1}), ["aid"]),
+            (("str", "a"),),
+        )
+        self.assertEqual(
+            operation_key(UpdateOne({"aid": {"$eq": "a"}}, {}), ["aid"]),
+            (("str", "a"),),
+        )
+
+    def test_dotted_and_compound_keys(self):
+        operation = UpdateOne({"o": {"aid": "a"}, "n": 2}, {})
+        self.assertEqual(
+            operation_key(operation, ["o.aid", "n"]),
+            (("str", "a"), ("number", 2)),
+        )
+
+    def test_no_key_for_missing_or_operator_values(self):
+        self.assertIsNone(operation_key(UpdateOne({"x": 1}, {}), ["aid"]))
+        self.assertIsNone(
+            operation_key(UpdateOne({"aid": {"$in": ["a"]}}, {}), ["aid"])
+        )
+
+
+class TestSortOperations(unittest.TestCase):
+    def test_stable_sort_with_barriers(self):
+        operations = ["b1", "a1", "b2", "x", "c1", "a2"]
+        keys = [("b",), ("a",), ("b",), None, ("c",), ("a",)]
+        operations, keys = sort_operations(operations, keys)
+        self.assertEqual(operations, ["a1", "b1", "b2", "x", "a2", "c1"])
+        self.assertEqual(keys, [("a",), ("b",), ("b",), None, ("a",), ("c",)])
+
+
+class TestShardRouter(unittest.TestCase):
+    def _operations(self, *aids):
+        return [
+            UpdateOne({"aid": aid}, {"$set": {"n": i}})
+            for i, aid in enumerate(aids)
+        ]
+
+    def test_chunks_split_at_boundaries(self):
+        router = ShardRouter({"detection": ["aid"]}, {"detection": ["m"]})
+        routed = list(
+            router.route("detection", self._operations("z", "a", "n", "b"), 10)
+        )
+        self.assertEqual(
+            [[op._filter["aid"] for op in chunk] for chunk, _ in routed],
+            [["a", "b"], ["n", "z"]],
+        )
+        self.assertEqual(
+            [routing for _, routing in routed], ["targeted", "targeted"]
+        )
+
+    def test_chunk_size_is_respected(self):
+        router = ShardRouter({"detection": ["aid"]})
+        routed = list(
+            router.route("detection", self._operations("c", "b", "a"), 2)
+        )
+        self.assertEqual([len(chunk) for chunk, _ in routed], [2, 1])
+        self.assertEqual(
+            [routing for _, routing in routed], ["unknown", "targeted"]
+        )
+
+    def test_operations_without_key_are_scattered(self):
+        router = ShardRouter({"detection": ["aid"]}, {"detection": ["m"]})
+        operations = [UpdateOne({"candid": 1}, {"$set": {}})]
+        self.assertEqual(
+            list(router.route("detection", operations, 10)),
+            [(operations, "scattered")],
+        )
+
+    def test_operations_are_sorted_within_windows(self):
+        router = ShardRouter({"detection": ["aid"]})
+        routed = router.route(
+            "detection", self._operations("d", "c", "b", "a"), 10, window=2
+        )
+        self.assertEqual(
+            [[op._filter["aid"] for op in chunk] for chunk, _ in routed],
+            [["c", "d", "a", "b"]],
+        )
+
+
+class TestSortByKey(unittest.TestCase):
+    def test_operations_are_sorted_within_windows(self):
+        operations = [UpdateOne({"aid": aid}, {"$set": {}}) for aid in "dcbaz"]
+        self.assertEqual(
+            [op._filter["aid"] for op in sort_by_key(operations, ["aid"], 2)],
+            ["c", "d", "a", "b", "z"],
+        )
+        self.assertEqual(
+            [op._filter["aid"] for op in sort_by_key(operations, ["aid"])],
+            ["a", "b", "c", "d", "z"],
+        )
+
+
+class TestExecutorRouting(unittest.TestCase):
+    def test_routed_collections_are_written_sorted(self):
+        executor = ScribeCommandExecutor(
+            {"MONGO": {}, "SHARD_KEYS": {"object": ["_id"]}}
+        )
+        executor.connection = mock.MagicMock()
+        executor.bulk_execute(
+            [
+                UpdateCommand("object", {"a": 1}, {"_id": "b"}),
+                UpdateCommand("object", {"a": 2}, {"_id": "a"}),
+                InsertCommand("detection", {"candid": 2}),
+                InsertCommand("detection", {"candid": 1}),
+            ]
+        )
+        collection = executor.connection.database.__getitem__.return_value
+        written = [
+            [op._filter["_id"] for op in call.args[0]]
+            for call in collection.bulk_write.call_args_list
+            if isinstance(call.args[0][0], UpdateOne)
+        ]
+        self.assertEqual(written, [["a", "b"]])
+
+    def test_routing_is_counted_after_the_write(self):
+        executor = ScribeCommandExecutor(
+            {"MONGO": {}, "SHARD_KEYS": {"object": ["_id"]}},
+            metrics=mock.MagicMock(),
+        )
+        executor.connection = mock.MagicMock()
+        collection = executor.connection.database.__getitem__.return_value
+        collection.bulk_write.side_effect = [ConnectionFailure("down"), None]
+        commands = [UpdateCommand("object", {"a": 1}, {"_id": "a"})]
+        with self.assertRaises(ConnectionFailure):
+            executor.bulk_execute(commands)
+        executor.metrics.observe_routing.assert_not_called()
+        executor.resume()
+        executor.metrics.observe_routing.assert_called_once_with(
+            "object", "targeted"
+        )
+
+    def test_sort_keys_order_writes_of_a_collection(self):
+        executor = ScribeCommandExecutor(
+            {"MONGO": {}, "SORT_KEYS": {"detection": ["aid", "candid"]}}
+        )
+        executor.connection = mock.MagicMock()
+        executor.bulk_execute(
+            [
+                InsertCommand("detection", {"aid": "b", "candid": 1}),
+                InsertCommand("detection", {"aid": "a", "candid": 3}),
+                InsertCommand("detection", {"aid": "a", "candid": 2}),
+            ]
+        )
+        collection = executor.connection.database.__getitem__.return_value
+        (operations,) = collection.bulk_write.call_args.args
+        self.assertEqual(
+            [(op._doc["aid"], op._doc["candid"]) for op in operations],
+            [("a", 2), ("a", 3), ("b", 1)],
+        )
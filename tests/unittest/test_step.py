@@ -0,0 +1,52 @@
+import unittest
+from unittest import mock
+
+from pymongo.errors import ConnectionFailure
+
+from mongo_scribe.step import MongoScribe
+
+
+def _step(db_client, **config):
+    """
+    Creates a step whose consumer is a mock, as `GenericStep` instantiates
+    the consumer class with the `CONSUMER_CONFIG`
+    """
+    config = {"CONSUMER_CONFIG": {"PARAMS": {}}, "DB_CONFIG": {}, **config}
+    return MongoScribe(mock.MagicMock(), config=config, db_client=db_client)
+
+
+class TestIdleFlush(unittest.TestCase):
+    def setUp(self):
+        self.db_client = mock.MagicMock()
+        self.step = _step(self.db_client)
+        self.consumer = self.step.consumer
+        self.kafka_consumer = self.consumer.consumer
+        self.kafka_consumer.consume.return_value = []
+        self.step.pre_consume()
+
+    def test_buffered_commands_are_flushed_when_idle(self):
+        self.db_client.has_pending_writes.return_value = True
+        self.db_client.flush.return_value = 1
+        self.assertEqual(self.consumer.consumer.consume(timeout=1), [])
+        self.db_client.flush.assert_called_once()
+        self.consumer.commit.assert_called_once()
+
+    def test_nothing_is_flushed_while_messages_arrive(self):
+        self.db_client.has_pending_writes.return_value = True
+        self.kafka_consumer.consume.return_value = [mock.MagicMock()]
+        self.consumer.consumer.consume(timeout=1)
+        self.db_client.flush.assert_not_called()
+
+
+class TestBreakerRetries(unittest.TestCase):
+    def test_transient_errors_resume_the_failed_write(self):
+        db_client = mock.MagicMock()
+        db_client.bulk_execute.side_effect = ConnectionFailure("down")
+        db_client.resume.return_value = 2
+        step = _step(db_client, CIRCUIT_BREAKER={"MIN_CALLS": 5})
+        commands = [mock.MagicMock()]
+        self.assertEqual(
+            step._write(lambda: db_client.bulk_execute(commands)), 2
+        )
+        db_client.bulk_execute.assert_called_once_with(commands)
+        db_client.resume.assert_called_once()
@@ -0,0 +1,96 @@
+import unittest
+from unittest import mock
+
+from mongo_scribe.supervisor import WorkerStats, WorkerSupervisor
+
+
+class TestWorkerStats(unittest.TestCase):
+    def test_record_accumulates(self):
+        stats = WorkerStats()
+        stats.record(10, 20, 0.5)
+        stats.record(5, 0, 0.0)
+        self.assertEqual(
+            stats.snapshot(),
+            {
+                "messages": 15,
+                "operations": 20,
+                "write_seconds": 0.5,
+                "writes": 1,
+            },
+        )
+
+
+class TestWorkerSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.supervisor = WorkerSupervisor(
+            mock.MagicMock(), 2, cpus=[3], backoff=1, max_backoff=4
+        )
+        patcher = mock.patch("mongo_scribe.supervisor.multiprocessing")
+        self.multiprocessing = patcher.start()
+        self.addCleanup(patcher.stop)
+        for idx in range(2):
+            self.supervisor._start(idx)
+
+    def _kill(self, idx, exitcode):
+        process = mock.MagicMock(exitcode=exitcode)
+        process.is_alive.return_value = False
+        self.supervisor.processes[idx] = process
+
+    def test_workers_are_pinned_round_robin(self):
+        self.assertEqual(self.supervisor._cpu(0), 3)
+        self.assertEqual(self.supervisor._cpu(1), 3)
+
+    def test_dead_worker_is_restarted_with_backoff(self):
+        self._kill(0, 1)
+        with mock.patch("mongo_scribe.supervisor.time") as time:
+            time.monotonic.return_value = 10
+            self.supervisor._check(0)
+            self.assertEqual(self.supervisor.restart_at[0], 10 + 1)
+            self.supervisor._check(0)
+            self.assertEqual(self.multiprocessing.Process.call_count, 2)
+
+            time.monotonic.return_value = 11
+            self.supervisor._check(0)
+            self.assertEqual(self.multiprocessing.Process.call_count, 3)
+            self.assertIsNone(self.supervisor.restart_at[0])
+
+            self._kill(0, 1)
+            self.supervisor._check(0)
+            self.assertEqual(self.supervisor.restart_at[0], 11 + 2)
+
+    def test_backoff_is_capped(self):
+        self.supervisor.failures[0] = 10
+        self._kill(0, 1)
+        with mock.patch("mongo_scribe.supervisor.time") as time:
+            time.monotonic.return_value = 10
+            self.supervisor._check(0)
+        self.assertEqual(self.supervisor.restart_at[0], 10 + 4)
+
+    def test_clean_exit_is_not_restarted(self):
+        self._kill(1, 0)
+        self.supervisor._check(1)
+        self.assertTrue(self.supervisor.finished[1])
+        self.assertIsNone(self.supervisor.restart_at[1])
+
+    def test_report_aggregates_workers(self):
+        self.supervisor.stats[0].record(10, 40, 1.0)
+        self.supervisor.stats[1].record(30, 60, 3.0)
+        with mock.patch.object(self.supervisor, "_publish") as publish:
+            self.supervisor._report(2.0)
+        worker, delta, elapsed = publish.call_args_list[-1].args
+        self.assertEqual(worker, "all")
+        self.assertEqual(delta["messages"], 40)
+        self.assertEqual(delta["operations"], 100)
+        self.assertEqual(delta["writes"], 2)
+
+    def test_shutdown_kills_workers_after_timeout(self):
+        self.supervisor.shutdown_timeout = 0
+        stopped, stuck = mock.MagicMock(), mock.MagicMock()
+        stopped.is_alive.side_effect = [True, False]
+        stuck.is_alive.return_value = True
+        self.supervisor.processes = [stopped, stuck]
+        self.supervisor.shutdown()
+        stopped.terminate.assert_called_once()
+        stuck.terminate.assert_called_once()
+        stopped.kill.assert_not_called()
+        stuck.kill.assert_called_once()
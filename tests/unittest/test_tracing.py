@@ -0,0 +1,60 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from mongo_scribe.tracing import NULL_SPAN, Tracer
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "trace-{pid}.json")
+
+    def _events(self):
+        with open(self.path.format(pid=os.getpid())) as f:
+            # The array is left open while tracing
+            return json.loads(f.read().rstrip(",\n") + "]")
+
+    def test_unsampled_batch_records_nothing(self):
+        tracer = Tracer(self.path, 0)
+        self.assertIsNone(tracer.start_batch())
+        self.assertIs(tracer.span("decode"), NULL_SPAN)
+        tracer.end_batch()
+        self.assertFalse(os.path.exists(self.path.format(pid=os.getpid())))
+
+    def test_sampled_batch_writes_trace_events(self):
+        tracer = Tracer(self.path, 1)
+        trace = tracer.start_batch()
+        with trace.span("decode"):
+            pass
+        with tracer.span("write", collection="object"):
+            pass
+        tracer.end_batch(n_messages=1)
+        tracer.close()
+
+        events = self._events()
+        self.assertEqual(
+            [event["name"] for event in events], ["decode", "write", "batch"]
+        )
+        self.assertEqual(events[1]["args"], {"collection": "object"})
+        self.assertTrue(all(event["ph"] == "X" for event in events))
+        self.assertTrue(all(event["pid"] == os.getpid() for event in events))
+
+    def test_batches_are_appended(self):
+        tracer = Tracer(self.path, 1)
+        for _ in range(2):
+            tracer.start_batch()
+            tracer.end_batch()
+        tracer.close()
+        self.assertEqual(len(self._events()), 2)
+
+    def test_sample_rate(self):
+        tracer = Tracer(self.path, 0.5)
+        with mock.patch("mongo_scribe.tracing.random.random") as random:
+            random.return_value = 0.7
+            self.assertIsNone(tracer.start_batch())
+            random.return_value = 0.2
+            self.assertIsNotNone(tracer.start_batch())